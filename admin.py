@@ -1,60 +1,69 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+import click
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, stream_with_context
+from flask.cli import with_appcontext
+from datetime import datetime, timezone
 from werkzeug.exceptions import abort
-from flask import jsonify
-
-# from models import db, User, Candidate
-
-from app import db, User, Candidate
-
+from flask import jsonify, make_response, Response
+
+from models import db, Candidate, Admin
+import admission
+import catalogue
+import tally
+import results
+import ballot_box
+import results_stream
+import voter_import
+import stats
+import audit_export
+import turnout
+import ledger
+import voter_filter
+import principal
+import sessions
+import voting_routes
+
+# Mounted at /admin by app.register_routes()
 admin_bp = Blueprint('admin', __name__)
 
 
 def get_current_user():
+    # the session's cached principal (principal.py), not the full User row
     user_id = session.get('user_id')
     if not user_id:
         return None
-    return User.query.get(user_id)
+    return principal.get(user_id)
 
 
 # Admin Dashboard
-@admin_bp.route('/dashboard')
+@admin_bp.route('/ballot')
 def dashboard():
     user = get_current_user()
     if not user:
         flash('Please log in to access the dashboard.')
         return redirect(url_for('auth.login'))  # change 'auth.login' to your login endpoint
-    candidates = Candidate.query.order_by(Candidate.id).all()
+    candidates = catalogue.candidates()
     return render_template('admin_dashboard.html', user=user, candidates=candidates)
 
 
-@admin_bp.route('/vote/<int:cand_id>', methods=['POST'])
+@admin_bp.route('/ballot/vote/<int:cand_id>', methods=['POST'])
 def vote(cand_id):
     user = get_current_user()
     if not user:
         flash('Please log in to vote.')
         return redirect(url_for('auth.login'))  # change to your login endpoint
 
-    # Prevent double voting - assumes User model has boolean 'has_voted' field
-    if getattr(user, 'has_voted', False):
-        flash('You have already voted.')
-        return redirect(url_for('admin.dashboard'))
-
-    candidate = Candidate.query.get(cand_id)
+    candidate = catalogue.get(cand_id)
     if not candidate:
         abort(404)
 
-    # Increment candidate votes (assumes integer 'votes' column)
-    candidate.votes = (candidate.votes or 0) + 1
-    # Mark user as voted (adjust field name if different)
-    setattr(user, 'has_voted', True)
-
-    try:
-        db.session.commit()
-        flash('Your vote has been recorded. Thank you.')
-    except Exception as e:
-        db.session.rollback()
-        # Log the exception in real app
-        flash('An error occurred while recording your vote. Please try again.')
+    # One vote per position: the ballot box refuses a race already voted in,
+    # and writes the Vote and tally together in one durable commit
+    outcome = ballot_box.cast(user.id, [candidate.id])
+    if outcome == ballot_box.NO_CANDIDATE:
+        abort(404)
+    # same bookkeeping and messages as the voter's own vote view
+    voting_routes.after_cast(outcome)
+    voting_routes.flash_outcome(outcome, 'Your vote has been recorded. Thank you.')
 
     return redirect(url_for('admin.dashboard'))
 
@@ -62,6 +71,7 @@ def vote(cand_id):
 @admin_bp.route('/logout')
 def logout():
     session.pop('user_id', None)
+    session.pop('admin_id', None)
     # add any other session cleanup as needed
     flash('You have been logged out.')
     return redirect(url_for('auth.login'))  # change to your login endpoint
@@ -75,23 +85,64 @@ def admin_required():
     return True
 
 
+def auditor_required():
+    """True for a session signed in to an Admin account through admin_login.
+
+    admin_required() only checks the voter's display name; anything that
+    reveals how individual voters voted needs this instead.
+    """
+    admin_id = session.get('admin_id')
+    return admin_id is not None and db.session.get(Admin, admin_id) is not None
+
+
+# Sign in to an Admin account (username/password from `flask create-admin`)
+@admin_bp.route('/login', methods=['POST'])
+def admin_login():
+    username = request.form.get('username', '').strip()
+    password = request.form.get('password', '')
+    if not (username and password):
+        return jsonify({'error': 'Username and password are required.'}), 400
+
+    # throttled like OTP checks, so passwords cannot be guessed at speed
+    with admission.OTPAdmission(f"admin:{username}", "verify") as gate:
+        if gate.rejection:
+            return gate.rejection
+        admin = Admin.query.filter_by(username=username).first()
+        if not admin or not admin.check_password(password):
+            return jsonify({'error': 'Invalid username or password.'}), 401
+
+    sessions.rotate(session)
+    session['admin_id'] = admin.id
+    return jsonify({'admin': admin.username})
+
+
+@click.command("create-admin")
+@click.argument("username")
+@click.password_option()
+@with_appcontext
+def create_admin_command(username, password):
+    """Create an Admin account, or reset its password."""
+    admin = Admin.query.filter_by(username=username).first()
+    if admin is None:
+        admin = Admin(username=username)
+        db.session.add(admin)
+    admin.set_password(password)
+    db.session.commit()
+    click.echo(f"admin {username} saved")
+
+
 # Admin Dashboard
-@app.route('/admin/dashboard')
+@admin_bp.route('/dashboard')
 def admin_dashboard():
     if not admin_required():
-        return redirect(url_for('login'))
-
-    candidates = Candidate.query.all()
-    total_voters = User.query.count()
-    voted_users = User.query.filter_by(has_voted=True).count()
-
-    # Fetch vote counts for each candidate
-    vote_data = (
-        db.session.query(Candidate.name, db.func.count(Vote.id))
-        .outerjoin(Vote)
-        .group_by(Candidate.id)
-        .all()
-    )
+        return redirect(url_for('voter.login'))
+
+    # One query (or none, within the STATS_MAX_AGE window) for the whole page
+    election = stats.election_stats()
+    candidates = election.candidates
+    total_voters = election.total_voters
+    voted_users = election.voted
+    vote_data = [(c.name, c.votes) for c in candidates]
 
     vote_labels = [v[0] for v in vote_data]
     vote_values = [v[1] for v in vote_data]
@@ -104,14 +155,88 @@ def admin_dashboard():
         vote_counts=vote_data,
         vote_labels=vote_labels,
         vote_values=vote_values,
+        turnout=election.turnout,
+        positions=election.positions,
     )
 
 
+@admin_bp.route('/stats')
+def admin_stats():
+    if not admin_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(stats.as_dict(stats.election_stats()))
+
+
+def _turnout_scope():
+    candidate = request.args.get('candidate', type=int)
+    return turnout.scope_for(position=request.args.get('position'), candidate_id=candidate)
+
+
+def _utc_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+# Turnout curve from the rollup: ?position= or ?candidate=, since/until (ISO, UTC), resolution=minute|hour
+@admin_bp.route('/turnout')
+def turnout_series():
+    if not admin_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+    try:
+        since, until = _utc_arg('since'), _utc_arg('until')
+    except ValueError:
+        return jsonify({'error': 'since/until must be ISO 8601 timestamps.'}), 400
+    resolution = {'minute': turnout.MINUTE, 'hour': turnout.HOUR}.get(request.args.get('resolution'))
+
+    try:
+        resolution, points = turnout.series(_turnout_scope(), since, until, resolution)
+    except ValueError as exc:
+        # since after until, or a window too long even at hourly resolution
+        return jsonify({'error': str(exc)}), 400
+    return jsonify({
+        'resolution_seconds': resolution,
+        'labels': [t.isoformat() + 'Z' for t, _, _ in points],
+        'votes': [n for _, n, _ in points],
+        'cumulative': [total for _, _, total in points],
+    })
+
+
+@admin_bp.route('/turnout/rate')
+def turnout_rate():
+    if not admin_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+    rates = turnout.rates(_turnout_scope())
+    return jsonify({'votes_per_minute': {f'{window}m': rate for window, rate in rates.items()}})
+
+
+# Ledger commitment: auditors compare this root with one recomputed from an export
+@admin_bp.route('/ledger/root')
+def ledger_root():
+    if not admin_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+    size, digest = ledger.root()
+    return jsonify({'tree_size': size, 'root': digest.hex() if digest else None})
+
+
+# Size, fill and hit rates of the registration pre-check (voter_filter.py)
+@admin_bp.route('/registration-filter')
+def registration_filter():
+    if not admin_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+    f = voter_filter.get_filter()
+    return jsonify(f.stats() if f else {'enabled': False})
+
+
 # Add candidate
-@app.route('/admin/add_candidate', methods=['POST'])
+@admin_bp.route('/add_candidate', methods=['POST'])
 def add_candidate():
     if not admin_required():
-        return redirect(url_for('login'))
+        return redirect(url_for('voter.login'))
 
     name = request.form['name']
     party = request.form['party']
@@ -119,38 +244,114 @@ def add_candidate():
 
     new_cand = Candidate(name=name, party=party, position=position)
     db.session.add(new_cand)
+    catalogue.bump()
     db.session.commit()
+    catalogue.invalidate()
+    stats.invalidate()
 
     flash('Candidate added successfully!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('admin.admin_dashboard'))
+
+
+# Bulk import a voter roll (CSV: name, email, voter_id[, password])
+@admin_bp.route('/import_voters', methods=['POST'])
+def import_voters():
+    if not admin_required():
+        return redirect(url_for('voter.login'))
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No CSV file uploaded.'}), 400
+
+    # runs in the background; poll the status URL for progress and the report
+    job_id = voter_import.start_upload(upload)
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('admin.import_status', job_id=job_id),
+    }), 202
+
+
+@admin_bp.route('/import_voters/<job_id>')
+def import_status(job_id):
+    if not admin_required():
+        return redirect(url_for('voter.login'))
+
+    status = voter_import.upload_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown import job.'}), 404
+    return jsonify(status)
 
 
 # Delete candidate
-@app.route('/admin/delete_candidate/<int:id>')
+@admin_bp.route('/delete_candidate/<int:id>')
 def delete_candidate(id):
     if not admin_required():
-        return redirect(url_for('login'))
+        return redirect(url_for('voter.login'))
 
     candidate = Candidate.query.get(id)
     if candidate:
+        tally.drop_candidate(candidate.id)
         db.session.delete(candidate)
+        catalogue.bump()
         db.session.commit()
+        catalogue.invalidate()
+        stats.invalidate()
         flash('Candidate deleted successfully!', 'info')
     else:
         flash('Candidate not found.', 'danger')
 
-    return redirect(url_for('admin_dashboard'))
-
-@app.route('/admin/live_votes')
-def live_votes():
-    vote_data = (
-        db.session.query(Candidate.name, db.func.count(Vote.id))
-        .outerjoin(Vote)
-        .group_by(Candidate.id)
-        .all()
+    return redirect(url_for('admin.admin_dashboard'))
+
+# Audit export of the full vote ledger, streamed page by page. It ties
+# voters to candidates, so it needs a real Admin sign-in, not admin_required()
+@admin_bp.route('/export/votes')
+def export_votes():
+    if not auditor_required():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in audit_export.FORMATS:
+        return jsonify({'error': f'Unknown format {fmt!r}; use csv or jsonl.'}), 400
+    compress = request.args.get('gzip', '1') not in ('0', 'false', 'no')
+
+    mimetype = 'application/gzip' if compress else audit_export.FORMATS[fmt][0]
+    name = audit_export.filename(fmt, compress)
+    return Response(
+        stream_with_context(audit_export.export_chunks(fmt, compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{name}"', 'X-Accel-Buffering': 'no'},
     )
 
-    labels = [v[0] for v in vote_data]
-    values = [v[1] for v in vote_data]
 
-    return jsonify({'labels': labels, 'values': values})
\ No newline at end of file
+@admin_bp.route('/live_votes')
+def live_votes():
+    version = results.results_version()
+    tag = results.etag(version)
+    if tag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(tag)
+        return response
+
+    snap = results.snapshot(version)
+    labels = [row[1] for row in snap.rows]
+    values = [row[3] for row in snap.rows]
+
+    response = jsonify({'labels': labels, 'values': values, 'version': snap.version})
+    response.set_etag(tag)
+    return response
+
+
+@admin_bp.route('/live_votes/stream')
+def live_votes_stream():
+    # Server-Sent Events: a full snapshot on connect, then deltas as votes commit
+    initial = results.snapshot()
+    try:
+        # each open stream holds a worker thread; refuse past the cap
+        stream = results_stream.event_stream(initial)
+    except results_stream.StreamFull:
+        return results_stream.busy_response()
+    return Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request
+
+# Admission control for OTP issuance and verification.
+#
+# Every OTP request has to pass, cheapest check first:
+#   1. a cap on OTP requests in flight (OTP_MAX_INFLIGHT, 32),
+#   2. a token bucket for the client IP (OTP_IP_BUCKET, burst 20, 1 per 3s),
+#   3. a token bucket for the voter ID (OTP_VOTER_BUCKET, burst 3, 1 per 60s),
+# and the mail queue itself refuses work when its bounded backlog is full.
+# Anything rejected gets an immediate 429 with Retry-After, before any user
+# lookup or email is attempted.
+#
+# The in-flight cap is a semaphore in each worker process, not shared state:
+# it protects that process's threads, and a deployment with N worker
+# processes admits up to N * OTP_MAX_INFLIGHT OTP requests at once. Size it
+# per worker; the buckets below are what bound a client across workers.
+#
+# Verifying a code goes through the same gate with its own, looser buckets
+# (OTP_VERIFY_IP_BUCKET, burst 30, 1 per 2s; OTP_VERIFY_VOTER_BUCKET, burst
+# 10, 1 per 30s), so guesses against one voter's code are throttled across
+# IPs on top of the store's per-code miss limit.
+#
+# A bucket is two floats (tokens, last update). Buckets that have refilled
+# completely carry no information and are swept, so storage is bounded by
+# the number of clients seen within one refill period. The SQLite backend
+# (default, RATE_LIMIT_BACKEND = "sqlite") is shared by all worker
+# processes and occasionally deletes rows past their full_at; "memory" keeps
+# buckets per process, drops the ones untouched for longer than the slowest
+# refill seen, and caps what is left at RATE_LIMIT_MAX_KEYS (100000).
+
+
+class MemoryBuckets:
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated), least recently updated first
+        self._horizon = 0.0  # longest time any bucket seen takes to refill from empty
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_seconds, now=None):
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) / refill_seconds)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) * refill_seconds
+            self._horizon = max(self._horizon, capacity * refill_seconds)
+            self._sweep(now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def _sweep(self, now):
+        # anything untouched for a whole horizon has refilled; those sit at the front
+        cutoff = now - self._horizon
+        while self._buckets and next(iter(self._buckets.values()))[1] <= cutoff:
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # schema on a throwaway connection: the app may be built before workers fork
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_buckets_full_at ON rate_buckets (full_at)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        # per thread and per process: a forked worker never reuses its parent's handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, capacity, refill_seconds, now=None):
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) / refill_seconds)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) * refill_seconds
+            full_at = now + (capacity - tokens) * refill_seconds
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, full_at),
+            )
+            if random.random() < 0.01:
+                # a full bucket is the same as no bucket
+                conn.execute("DELETE FROM rate_buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM rate_buckets").fetchone()[0]
+
+
+_stores = {}
+_inflight = {}
+_stores_lock = threading.Lock()
+
+
+def _buckets(app):
+    backend = app.config.get("RATE_LIMIT_BACKEND", "sqlite")
+    with _stores_lock:
+        store = _stores.get(id(app))
+        if store is None:
+            if backend == "memory":
+                store = MemoryBuckets(app.config.get("RATE_LIMIT_MAX_KEYS", 100000))
+            elif backend == "sqlite":
+                path = app.config.get("RATE_LIMIT_PATH") or os.path.join(app.instance_path, "ratelimit.db")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                store = SQLiteBuckets(path)
+            else:
+                raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend!r}")
+            _stores[id(app)] = store
+    return store
+
+
+def _semaphore(app):
+    with _stores_lock:
+        sem = _inflight.get(id(app))
+        if sem is None:
+            sem = threading.BoundedSemaphore(app.config.get("OTP_MAX_INFLIGHT", 32))
+            _inflight[id(app)] = sem
+    return sem
+
+
+def client_ip():
+    # ProxyFix (if deployed behind a proxy) makes remote_addr the real client
+    return request.remote_addr or "unknown"
+
+
+def too_many_requests(retry_after):
+    retry_after = max(1, int(retry_after + 0.999))
+    return (
+        "Too many OTP requests. Please wait before trying again.",
+        429,
+        {"Retry-After": str(retry_after), "Content-Type": "text/plain; charset=utf-8"},
+    )
+
+
+# action -> (key prefix, (IP bucket setting, default), (voter bucket setting, default))
+_LIMITS = {
+    "issue": ("", ("OTP_IP_BUCKET", (20, 3.0)), ("OTP_VOTER_BUCKET", (3, 60.0))),
+    "verify": ("verify:", ("OTP_VERIFY_IP_BUCKET", (30, 2.0)), ("OTP_VERIFY_VOTER_BUCKET", (10, 30.0))),
+}
+
+
+class OTPAdmission:
+    """Context manager guarding one OTP request; ``rejection`` is a 429 response or None.
+
+    ``action`` is "issue" (sending a code) or "verify" (checking one).
+    """
+
+    def __init__(self, voter_id, action="issue"):
+        self.voter_id = voter_id
+        self.action = action
+        self.rejection = None
+        self._sem = None
+
+    def __enter__(self):
+        app = current_app._get_current_object()
+        sem = _semaphore(app)
+        if not sem.acquire(blocking=False):
+            self.rejection = too_many_requests(1)
+            return self
+        self._sem = sem
+        store = _buckets(app)
+        prefix, ip_limit, voter_limit = _LIMITS[self.action]
+        ip_cap, ip_refill = app.config.get(*ip_limit)
+        wait = store.take(f"{prefix}ip:{client_ip()}", ip_cap, ip_refill)
+        if not wait and self.voter_id:
+            voter_cap, voter_refill = app.config.get(*voter_limit)
+            wait = store.take(f"{prefix}voter:{self.voter_id}", voter_cap, voter_refill)
+        if wait:
+            self.rejection = too_many_requests(wait)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._sem is not None:
+            self._sem.release()
+        return False
+
+    async def __aenter__(self):
+        # the bucket store may wait on a SQLite lock; keep that off the event loop
+        return await asyncio.to_thread(self.__enter__)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
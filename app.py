@@ -1,95 +1,92 @@
 import os
-from datetime import datetime
+import click
 from flask import Flask
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask.cli import with_appcontext
 from flask_mail import Mail
-from authentication import auth_bp
-
-# Initializing flask
-app = Flask(__name__)
-
-app.register_blueprint(auth_bp)
-
-# Basic config (use environment variables for sensitive data)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
-    "DATABASE_URL", "sqlite:///database.db"
-)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY", "change-this-to-a-secret")
-
-# Configure Flask-Mail using environment variables (do NOT hardcode credentials)
-app.config['MAIL_SERVER'] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
-app.config['MAIL_PORT'] = int(os.environ.get("MAIL_PORT", 587))
-app.config['MAIL_USE_TLS'] = os.environ.get("MAIL_USE_TLS", "True").lower() in ("1", "true", "yes")
-app.config['MAIL_USERNAME'] = os.environ.get("MAIL_USERNAME")
-app.config['MAIL_PASSWORD'] = os.environ.get("MAIL_PASSWORD")
-
-# initializing extensions
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-mail = Mail(app)
-
-# database models
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
-    email = db.Column(db.String(200), unique=True, nullable=False)
-    voter_id = db.Column(db.String(100), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-    has_voted = db.Column(db.Boolean, default=False)
-
-    def set_password(self, raw_password):
-        self.password = bcrypt.generate_password_hash(raw_password).decode("utf-8")
-
-    def check_password(self, raw_password):
-        return bcrypt.check_password_hash(self.password, raw_password)
-
-    def __repr__(self):
-        return f"<User {self.email}>"
-
-class Candidate(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
-    party = db.Column(db.String(200), nullable=False)
-    position = db.Column(db.String(200), nullable=False)
-    votes = db.Column(db.Integer, default=0, nullable=False)
-
-    def __repr__(self):
-        return f"<Candidate {self.name}>"
-
-class Vote(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    voter_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    candidate_id = db.Column(db.Integer, db.ForeignKey("candidate.id"), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-
-    def __repr__(self):
-        return f"<Vote user={self.voter_id} cand={self.candidate_id} at={self.timestamp}>"
-
-class Admin(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(255), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
-
-    def set_password(self, raw_password):
-        self.password = bcrypt.generate_password_hash(raw_password).decode("utf-8")
-
-    def check_password(self, raw_password):
-        return bcrypt.check_password_hash(self.password, raw_password)
-
-    def __repr__(self):
-        return f"<Admin {self.username}>"
-
-with app.app_context():
-    db.create_all()
-
-print("database and tables ensured (database.db)")
-
-
-
-
-
-
-
-
+import database
+import metrics
+import migrations
+import sessions
+from models import db
+
+# Extensions are created unbound and attached to each app in create_app(), so
+# importing this module has no side effects: no engine, no DDL, no config
+# rewrites. Deployments build the app with ``main:app`` (or call create_app()
+# themselves); the schema is brought up to date with ``flask upgrade-db``.
+mail = Mail()
+
+
+def _env_config():
+    # Basic config (use environment variables for sensitive data)
+    return {
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "change-this-to-a-secret"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        # Configure Flask-Mail using environment variables (do NOT hardcode credentials)
+        "MAIL_SERVER": os.environ.get("MAIL_SERVER", "smtp.gmail.com"),
+        "MAIL_PORT": int(os.environ.get("MAIL_PORT", 587)),
+        "MAIL_USE_TLS": os.environ.get("MAIL_USE_TLS", "True").lower() in ("1", "true", "yes"),
+        "MAIL_USERNAME": os.environ.get("MAIL_USERNAME"),
+        "MAIL_PASSWORD": os.environ.get("MAIL_PASSWORD"),
+    }
+
+
+def create_app(config=None):
+    """Build a configured app. ``config`` (a mapping) overrides environment defaults."""
+    app = Flask(__name__)
+    app.config.update(_env_config())
+    if config:
+        app.config.update(config)
+
+    # Engine settings (writer/reader, SQLite pragmas) live in database.py
+    database.configure(app)
+    db.init_app(app)
+    database.init_app(app, db)
+    metrics.init_app(app)
+    mail.init_app(app)
+    # small opaque cookie, session data kept server-side
+    sessions.init_app(app)
+
+    register_routes(app)
+    register_commands(app)
+    return app
+
+
+def register_routes(app):
+    """The one place where URL routes are attached to the app."""
+    from routes import voter_bp
+    import voting_routes  # noqa: F401  adds the vote route to voter_bp
+    from authentication import auth_bp
+    from admin import admin_bp
+
+    # voter journey: /, /login, /register, /get_otp, /verify_otp, /dashboard, /vote/<id>, /logout
+    app.register_blueprint(voter_bp)
+    # session-based OTP flow with its own verify page, kept under /auth
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    # admin dashboard, candidates, results, imports
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+
+
+def register_commands(app):
+    import voter_import
+    import audit_export
+    import turnout
+    import ledger
+    import tally
+    from admin import create_admin_command
+
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(voter_import.import_voters_command)
+    app.cli.add_command(audit_export.export_votes_command)
+    app.cli.add_command(turnout.backfill_turnout_command)
+    app.cli.add_command(ledger.ledger_verify_command)
+    app.cli.add_command(tally.fold_tallies_command)
+    app.cli.add_command(create_admin_command)
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """Apply pending schema migrations."""
+    for version, description in migrations.upgrade(db):
+        click.echo(f"applied migration {version}: {description}")
+    click.echo("database schema at version %d of %d" % migrations.status(db))
@@ -0,0 +1,7 @@
+from app import create_app
+from async_voter import AsyncVoterApp
+
+# ASGI entry point: ``uvicorn asgi:app`` (or hypercorn/daphne). The voter
+# journey runs on the event loop (async_voter.py); every other route is the
+# same Flask app as main:app, called on a thread pool. Needs aiosqlite.
+app = AsyncVoterApp(create_app())
@@ -0,0 +1,497 @@
+import asyncio
+import io
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import aiosqlite
+from flask import current_app, request, session, flash, redirect, url_for, render_template, jsonify, Response
+from flask.ctx import RequestContext
+from werkzeug.exceptions import HTTPException
+
+import admission
+import ballot_box
+import catalogue
+import fragments
+import mail_queue
+import principal
+import results
+import results_stream
+import sessions
+import voting_routes
+from models import db
+from otp_store import get_otp_store
+from routes import send_otp
+
+# ASGI serving mode for the voter journey (entry point: ``uvicorn asgi:app``).
+#
+# Under WSGI every request holds a worker thread until it returns, including
+# the wait for its ballot's group commit, so in-flight requests per process
+# are capped by the thread count. Here the voter endpoints - login page,
+# get_otp, verify_otp, otp_status, dashboard, ballot, vote/<id>, logout - are
+# coroutines on one event loop:
+#   - user and Vote reads go through a pool of read-only aiosqlite
+#     connections (ASYNC_DB_POOL_SIZE, 8); the voter principal cached in the
+#     session (principal.py) is shared with the WSGI views, so most page
+#     views make none
+#   - a ballot is handed to the ballot box's committer thread and its future
+#     awaited (ballot_box.cast_async), so any number of voters can wait on a
+#     commit at once
+#   - OTP mail only goes onto mail_queue, which never blocks; the session
+#     store, OTP store and rate-limit buckets are small SQLite files that may
+#     wait on a lock, so their calls run on the loop's default executor, a
+#     pool of ASYNC_IO_THREADS (32) threads
+#   - the candidate catalogue's periodic version check (catalogue.py) is a
+#     query, so views that read the catalogue run it on that executor first
+#   - OTP_MAX_INFLIGHT (admission.py) defaults to 256 rather than 32: the cap
+#     was sized to keep worker threads free, and a waiting coroutine holds none
+#   - the admin live results stream (/admin/live_votes/stream) is iterated
+#     on the loop (results_stream.async_event_stream), so a connected
+#     dashboard holds no thread for as long as it stays open;
+#     RESULTS_STREAM_MAX_SUBSCRIBERS defaults to 256 rather than 8 for the
+#     same reason as OTP_MAX_INFLIGHT
+# Each coroutine runs inside an ordinary Flask request context (contexts are
+# context variables, so every request task has its own). session, flash,
+# url_for, the templates and the before/after_request hooks are therefore
+# the WSGI ones, and a voter's session works the same under either server.
+#
+# Every other URL (registration, /auth, the rest of /admin, /receipt,
+# metrics) is passed to the WSGI app on a thread pool (ASYNC_WSGI_THREADS,
+# 16), streamed chunk by chunk.
+
+Voter = namedtuple("Voter", "id name email voter_id has_voted")
+
+_VOTER_COLUMNS = 'SELECT id, name, email, voter_id, has_voted FROM "user"'
+
+
+class AsyncReader:
+    """Pool of read-only aiosqlite connections to the voter database."""
+
+    def __init__(self, path, size=8, busy_timeout_ms=5000):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = None
+        self._opened = 0
+        self._lock = None
+
+    async def _acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            self._lock = asyncio.Lock()
+        if self._idle.empty() and self._opened < self.size:
+            async with self._lock:
+                if self._opened < self.size:
+                    self._opened += 1
+                    try:
+                        return await self._connect()
+                    except BaseException:
+                        self._opened -= 1
+                        raise
+        return await self._idle.get()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(f"file:{self.path}?mode=ro", uri=True)
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        return conn
+
+    async def fetchall(self, sql, params=()):
+        conn = await self._acquire()
+        try:
+            async with conn.execute(sql, params) as cur:
+                return await cur.fetchall()
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def fetchone(self, sql, params=()):
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    async def close(self):
+        while self._idle is not None and not self._idle.empty():
+            await self._idle.get_nowait().close()
+            self._opened -= 1
+
+    async def voter_by_voter_id(self, voter_id):
+        row = await self.fetchone(_VOTER_COLUMNS + " WHERE voter_id = ?", (voter_id,))
+        return Voter(*row[:4], bool(row[4])) if row else None
+
+    async def principal(self, user_id):
+        """principal.load() for the event loop: the user and their voted positions in one query."""
+        return principal.from_rows(await self.fetchall(
+            'SELECT u.id, u.name, u.has_voted, v.position FROM "user" u'
+            " LEFT JOIN vote v ON v.voter_id = u.id WHERE u.id = ?",
+            (user_id,),
+        ))
+
+
+_readers = {}
+
+
+def _reader():
+    return _readers[id(current_app._get_current_object())]
+
+
+# ---------------------------------------------------------------------------
+# Views: same behaviour as routes.py / voting_routes.py, awaiting the I/O
+
+async def login():
+    return render_template('login.html')
+
+
+async def get_otp():
+    voter_id = request.form.get('voter_id', '').strip()
+    if not voter_id:
+        flash("Please provide your Voter ID.", "warning")
+        return redirect(url_for('voter.login'))
+
+    async with admission.OTPAdmission(voter_id) as gate:
+        if gate.rejection:
+            return gate.rejection
+        user = await _reader().voter_by_voter_id(voter_id)
+        if not user:
+            flash("Voter ID not found. Please register first.", "danger")
+            return redirect(url_for('voter.register'))
+        return await asyncio.to_thread(send_otp, user)
+
+
+async def otp_status():
+    job_id = session.get('otp_mail_job')
+    # a read from the shared status store
+    status = await asyncio.to_thread(mail_queue.delivery_status, job_id) if job_id else None
+    return jsonify({'status': status or 'unknown'})
+
+
+async def verify_otp():
+    otp_entered = request.form.get('otp', '').strip()
+    if not otp_entered:
+        flash("Please enter the OTP.", "warning")
+        return redirect(url_for('voter.login'))
+
+    # only the voter this session asked a code for; never a form field
+    voter_id = session.get('otp_voter_id')
+    if not voter_id:
+        flash("No OTP request found. Please request a new OTP.", "warning")
+        return redirect(url_for('voter.login'))
+
+    async with admission.OTPAdmission(voter_id, "verify") as gate:
+        if gate.rejection:
+            return gate.rejection
+        if not await asyncio.to_thread(get_otp_store().verify, voter_id, otp_entered):
+            flash("Invalid or expired OTP. Please try again.", "danger")
+            return redirect(url_for('voter.login'))
+
+    user = await _reader().voter_by_voter_id(voter_id)
+    if not user:
+        flash("User not found. Please register.", "danger")
+        return redirect(url_for('voter.register'))
+
+    sessions.rotate(session)
+    session['user_id'] = user.id
+    session['user_name'] = user.name
+    session.pop('otp_voter_id', None)
+    flash("Logged in successfully!", "success")
+    return redirect(url_for('voter.dashboard'))
+
+
+async def _fresh_catalogue():
+    # the version check is a query; run it off the loop so the reads below are cache hits
+    if catalogue.due():
+        await asyncio.to_thread(catalogue.refresh)
+
+
+async def _principal(user_id):
+    return principal.cached(user_id) or principal.keep(await _reader().principal(user_id))
+
+
+async def _current_voter():
+    user_id = session.get('user_id')
+    user = await _principal(user_id) if user_id else None
+    if user_id and not user:
+        session.clear()
+        flash("User session invalid. Please log in again.", "warning")
+    return user
+
+
+async def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('voter.login'))
+
+    user = await _principal(session['user_id'])
+    if not user:
+        session.clear()
+        flash("User not found. Please log in again.", "warning")
+        return redirect(url_for('voter.login'))
+
+    await _fresh_catalogue()
+    races = fragments.open_races(user.id, user.voted)
+    if not races and user.has_voted:
+        flash("You have voted in every race. Thank you for participating!", "info")
+        return render_template('voted.html', user=user)
+
+    return fragments.render_dashboard(user, races)
+
+
+async def ballot():
+    user = await _current_voter()
+    if not user:
+        return voting_routes.not_logged_in()
+
+    selections = voting_routes.read_selections()
+    await _fresh_catalogue()
+    outcome = voting_routes.precheck(selections)
+    if outcome is None:
+        outcome = await ballot_box.cast_async(user.id, [cid for _, cid in selections])
+    return voting_routes.ballot_response(selections, outcome)
+
+
+async def vote(candidate_id):
+    user = await _current_voter()
+    if not user:
+        return redirect(url_for('voter.login'))
+
+    await _fresh_catalogue()
+    candidate = catalogue.get(candidate_id)
+    if not candidate:
+        flash("Candidate not found.", "danger")
+        return redirect(url_for('voter.dashboard'))
+
+    outcome = await ballot_box.cast_async(user.id, [candidate.id])
+    voting_routes.after_cast(outcome)
+    voting_routes.flash_outcome(outcome, f"Your vote for {candidate.name} has been recorded!")
+    return redirect(url_for('voter.dashboard'))
+
+
+async def logout():
+    session.clear()
+    flash("You have been logged out.", "info")
+    return redirect(url_for("voter.login"))
+
+
+async def live_votes_stream():
+    # same stream as admin.live_votes_stream; the body is an async iterable
+    # the adapter drives on the loop
+    initial = await asyncio.to_thread(results.snapshot)
+    try:
+        stream = results_stream.async_event_stream(initial)
+    except results_stream.StreamFull:
+        return results_stream.busy_response()
+    return Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+VIEWS = {
+    "voter.login": login,
+    "voter.get_otp": get_otp,
+    "voter.otp_status": otp_status,
+    "voter.verify_otp": verify_otp,
+    "voter.dashboard": dashboard,
+    "voter.ballot": ballot,
+    "voter.vote": vote,
+    "voter.logout": logout,
+    "admin.live_votes_stream": live_votes_stream,
+}
+
+
+# ---------------------------------------------------------------------------
+# ASGI adapter
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI http ``scope`` whose body has been read."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key == "CONTENT_LENGTH":
+            continue
+        if key != "CONTENT_TYPE":
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _header_list(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+class AsyncVoterApp:
+    """ASGI application: voter endpoints on the event loop, everything else through the WSGI app."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        config.setdefault("OTP_MAX_INFLIGHT", 256)
+        config.setdefault("RESULTS_STREAM_MAX_SUBSCRIBERS", 256)
+        with flask_app.app_context():
+            url = db.engine.url
+        if not url.drivername.startswith("sqlite") or url.database in (None, "", ":memory:"):
+            raise RuntimeError("The ASGI voter endpoints need a file-backed SQLite database")
+        _readers[id(flask_app)] = AsyncReader(
+            url.database, config.get("ASYNC_DB_POOL_SIZE", 8), config.get("DB_BUSY_TIMEOUT_MS", 5000)
+        )
+        self.executor = ThreadPoolExecutor(config.get("ASYNC_WSGI_THREADS", 16), thread_name_prefix="wsgi")
+        self.io_executor = ThreadPoolExecutor(config.get("ASYNC_IO_THREADS", 32), thread_name_prefix="async-io")
+        self._loop = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if self._loop is None:
+            # asyncio.to_thread() runs on the default executor; size it for store calls
+            self._loop = asyncio.get_running_loop()
+            self._loop.set_default_executor(self.io_executor)
+        body = await _read_body(receive)
+        if body is None:
+            return
+        environ = _environ(scope, body)
+        view, args = self._match(environ)
+        if view is None:
+            await self._call_wsgi(environ, receive, send)
+            return
+        response = await self._dispatch(view, environ, args)
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": _header_list(response.headers.items()),
+        })
+        if hasattr(response.response, "__aiter__"):
+            await self._send_stream(response.response, scope, receive, send)
+            return
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else response.get_data()})
+
+    def _match(self, environ):
+        try:
+            endpoint, args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # 404, 405 and redirects are answered by the WSGI app as usual
+            return None, None
+        return VIEWS.get(endpoint), args
+
+    async def _dispatch(self, view, environ, args):
+        """Run ``view`` the way Flask.wsgi_app runs a view, in its own request context."""
+        app = self.flask_app
+        req = app.request_class(environ)
+        req.json_module = app.json
+        # push() would open the session on the loop; open it on the pool instead
+        opened = await asyncio.to_thread(app.session_interface.open_session, app, req)
+        if opened is None:
+            opened = app.session_interface.make_null_session(app)
+        ctx = RequestContext(app, environ, request=req, session=opened)
+        ctx.push()
+        error = None
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view(**args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            # after_request hooks and the session save
+            return await asyncio.to_thread(app.finalize_request, rv)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+    async def _send_stream(self, frames, scope, receive, send):
+        """Send an async iterable body until it ends or the client disconnects."""
+
+        async def pump():
+            if scope["method"] != "HEAD":
+                async for frame in frames:
+                    await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        pumping = asyncio.ensure_future(pump())
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            await asyncio.wait({pumping, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            pumping.cancel()
+            disconnected.cancel()
+            await asyncio.gather(pumping, return_exceptions=True)
+            # release the subscription however the pump stopped
+            await frames.aclose()
+
+    async def _call_wsgi(self, environ, receive, send):
+        loop = asyncio.get_running_loop()
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(" ", 1)[0]), headers]
+            return lambda data: None
+
+        def begin():
+            return self.flask_app.wsgi_app(environ, start_response)
+
+        result = await loop.run_in_executor(self.executor, begin)
+        chunks = iter(result)
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            # the first chunk may be what calls start_response
+            chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            status, headers = started
+            await send({"type": "http.response.start", "status": status, "headers": _header_list(headers)})
+            while chunk is not None and not disconnected.done():
+                if chunk and environ["REQUEST_METHOD"] != "HEAD":
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            close = getattr(result, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await _readers[id(self.flask_app)].close()
+                self.executor.shutdown(wait=False)
+                self.io_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
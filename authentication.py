@@ -1,32 +1,23 @@
 # import random
 import secrets
-from datetime import datetime, timedelta
-from flask import Blueprint, request, flash, redirect, url_for, session, render_template
+from flask import Blueprint, request, flash, redirect, url_for, session, render_template, current_app
 from flask_mail import Message
+from sqlalchemy.exc import IntegrityError
 # from flask_sqlalchemy import SQLAlchemy
 
-from app import app, db, mail, User, Candidate
+from models import db, User
+import fragments
+from otp_store import get_otp_store, OTP_TTL_SECONDS
+import mail_queue
+import admission
+import sessions
+import voter_filter
+import principal
 
 auth_bp = Blueprint("auth", __name__)
 
-OTP_TTL_SECONDS = 300
-
-# app = Flask(__name__)
-app.secret_key = 'logh ptjv yzyp iovf'
-
-# Configuring database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///voters.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Configure email
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'riteshbill14@gmail.com'
-app.config['MAIL_PASSWORD'] = 'logh ptjv yzyp iovf'
-
-# mail = Mail(app)
-# db = SQLAlchemy(app)
+# Secret key and MAIL_* settings come from app.create_app() (environment),
+# not from this module.
 
 @auth_bp.route("/", methods=["GET", "POST"])
 @auth_bp.route("/login", methods=["GET", "POST"])
@@ -37,63 +28,76 @@ def login():
             flash("Please provide your Voter ID.", "warning")
             return redirect(url_for("auth.login"))
 
-        user = User.query.filter_by(voter_id=voter_id).first()
-        if not user:
-            flash("Voter ID not found. Please register first.", "danger")
-            return redirect(url_for("auth.register"))
+        # Rate limits and in-flight cap are checked before any lookup or email
+        with admission.OTPAdmission(voter_id) as gate:
+            if gate.rejection:
+                return gate.rejection
+            return _issue_otp(voter_id)
 
-        # generate OTP and temporary session values (do not set persistent user_id until verified)
-        otp = f"{secrets.randbelow(900000) + 100000}"  # 6-digit
-        session["auth_otp"] = otp
-        session["auth_otp_expiry"] = (datetime.utcnow() + timedelta(seconds=OTP_TTL_SECONDS)).timestamp()
-        session["auth_user_id_tmp"] = user.id
-        session["auth_user_name_tmp"] = user.name
-        session["auth_user_email_tmp"] = user.email
-
-        # prepare email sender/recipient using app config
-        sender = app.config.get("MAIL_USERNAME") or app.config.get("MAIL_DEFAULT_SENDER") or "noreply@example.com"
-        try:
-            msg = Message(
-                subject="Your OTP for Online Voting Login",
-                sender=sender,
-                recipients=[user.email],
-            )
-            msg.body = f"Hello {user.name},\n\nYour OTP for login is: {otp}\n\nThis code is valid for 5 minutes."
-            mail.send(msg)
-            flash("OTP sent to your email. Please check and verify.", "info")
-        except Exception:
-
-            flash("Unable to send OTP email. Contact administrator.", "danger")
+    return render_template("login.html")
 
-        return redirect(url_for("auth.verify_otp"))
 
-    return render_template("login.html")
+def _issue_otp(voter_id):
+    user = User.query.filter_by(voter_id=voter_id).first()
+    if not user:
+        flash("Voter ID not found. Please register first.", "danger")
+        return redirect(url_for("auth.register"))
+
+    # generate OTP and temporary session values (do not set persistent user_id until verified)
+    # the code itself lives in the OTP store, never in the client cookie
+    otp = f"{secrets.randbelow(900000) + 100000}"  # 6-digit
+    get_otp_store().put(user.voter_id, otp, OTP_TTL_SECONDS)
+    session["auth_voter_id_tmp"] = user.voter_id
+    session["auth_user_id_tmp"] = user.id
+    session["auth_user_name_tmp"] = user.name
+    session["auth_user_email_tmp"] = user.email
+
+    # prepare email sender/recipient using app config
+    sender = current_app.config.get("MAIL_USERNAME") or current_app.config.get("MAIL_DEFAULT_SENDER") or "noreply@example.com"
+    try:
+        msg = Message(
+            subject="Your OTP for Online Voting Login",
+            sender=sender,
+            recipients=[user.email],
+        )
+        msg.body = f"Hello {user.name},\n\nYour OTP for login is: {otp}\n\nThis code is valid for 5 minutes."
+        session["auth_otp_mail_job"] = mail_queue.enqueue(msg)
+        flash("OTP sent to your email. Please check and verify.", "info")
+    except mail_queue.QueueFull:
+        # shed load: the code could not be sent, so do not leave it redeemable
+        get_otp_store().discard(user.voter_id)
+        session.pop("auth_voter_id_tmp", None)
+        return admission.too_many_requests(30)
+    except Exception:
+
+        flash("Unable to send OTP email. Contact administrator.", "danger")
+
+    return redirect(url_for("auth.verify_otp"))
 
 
 @auth_bp.route("/verify_otp", methods=["GET", "POST"])
 def verify_otp():
     if request.method == "POST":
         entered_otp = request.form.get("otp", "").strip()
-        stored_otp = session.get("auth_otp")
-        expiry_ts = session.get("auth_otp_expiry")
-
-        if not stored_otp or not expiry_ts:
-            flash("No OTP request found. Please request a new OTP.", "warning")
-            return redirect(url_for("auth.login"))
+        voter_id = session.get("auth_voter_id_tmp")
+        store = get_otp_store()
 
-        if datetime.utcnow().timestamp() > expiry_ts:
-            session.pop("auth_otp", None)
-            session.pop("auth_otp_expiry", None)
+        if not voter_id or store.get(voter_id) is None:
+            session.pop("auth_voter_id_tmp", None)
             session.pop("auth_user_id_tmp", None)
             session.pop("auth_user_name_tmp", None)
             session.pop("auth_user_email_tmp", None)
-            flash("OTP expired. Please request a new one.", "warning")
+            flash("No valid OTP found. Please request a new one.", "warning")
             return redirect(url_for("auth.login"))
 
-        if entered_otp == stored_otp:
+        with admission.OTPAdmission(voter_id, "verify") as gate:
+            if gate.rejection:
+                return gate.rejection
+            verified = store.verify(voter_id, entered_otp)
 
-            session.pop("auth_otp", None)
-            session.pop("auth_otp_expiry", None)
+        if verified:
+            sessions.rotate(session)
+            session.pop("auth_voter_id_tmp", None)
             session["user_id"] = session.pop("auth_user_id_tmp", None)
             session["user_name"] = session.pop("auth_user_name_tmp", None)
             session["user_email"] = session.pop("auth_user_email_tmp", None)
@@ -113,14 +117,13 @@ def dashboard():
         flash("Please log in first.", "warning")
         return redirect(url_for("auth.login"))
 
-    user = User.query.get(user_id)
+    user = principal.get(user_id)
     if not user:
         session.clear()
         flash("User not found. Please log in again.", "warning")
         return redirect(url_for("auth.login"))
 
-    candidates = Candidate.query.order_by(Candidate.id).all()
-    return render_template("dashboard.html", user=user, candidates=candidates)
+    return fragments.render_dashboard(user, fragments.open_races(user.id, user.voted))
 
 
 @auth_bp.route("/register", methods=["GET", "POST"])
@@ -134,23 +137,27 @@ def register():
             flash("All fields are required.", "warning")
             return redirect(url_for("auth.register"))
 
-        if User.query.filter_by(voter_id=voter_id).first():
+        # each check skips the database when the registration filter rules the value out
+        if voter_filter.taken(voter_id=voter_id):
             flash("Voter ID already registered.", "danger")
             return redirect(url_for("auth.register"))
 
-        if User.query.filter_by(email=email).first():
+        if voter_filter.taken(email=email):
             flash("Email already registered.", "danger")
             return redirect(url_for("auth.register"))
 
+        # login is OTP-only, so no password hash is computed or stored
         new_user = User(name=name, email=email, voter_id=voter_id)
-        random_pw = secrets.token_urlsafe(16)
-        if hasattr(new_user, "set_password"):
-            new_user.set_password(random_pw)
-        else:
-            new_user.password = random_pw
+        new_user.set_otp_only()
 
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash("Voter ID or email already registered.", "danger")
+            return redirect(url_for("auth.register"))
+        voter_filter.remember(voter_id, email)
         flash("Registration successful! You can now log in using your Voter ID.", "success")
         return redirect(url_for("auth.login"))
 
@@ -165,6 +172,10 @@ def logout():
 
 
 if __name__ == '__main__':
+    import migrations
+    from app import create_app
+
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        migrations.upgrade(db)
     app.run(debug=True)
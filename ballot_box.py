@@ -0,0 +1,237 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import db, Candidate, Vote
+from database import read_session
+import ledger
+import tally
+import turnout
+
+# Group-commit vote ingestion.
+#
+# A ballot is one voter's selections: at most one candidate per position,
+# any number of positions. Request threads hand their ballot to submit() and
+# block until it is durable (coroutines await it with cast_async() and hold
+# no thread meanwhile). One committer thread per process collects
+# ballots for a short window and writes the whole batch in a single
+# transaction: every selected candidate is checked with one query, the
+# voters' existing votes are read with one query so a race they already
+# voted in refuses the whole ballot (including two ballots from one voter in
+# the same batch), the Vote rows are inserted together and appended to the
+# ledger's Merkle tree (ledger.py), and each candidate's tally and each
+# turnout bucket (turnout.py) is bumped once by the number of votes it
+# received. One commit, one fsync, for the batch.
+# The unique (voter, position) index on Vote backs this up across processes.
+#
+# A voter is told their ballot is recorded only after that commit returns.
+# A request that stops waiting (VOTE_SUBMIT_TIMEOUT) withdraws its ballot
+# if the committer has not taken it yet and reports ERROR, so a retry is
+# safe; once the ballot is in a batch being written it can no longer be
+# withdrawn, and the request reports PENDING instead of a failure.
+#
+# Config:
+#   VOTE_GROUP_COMMIT      batch ballots on the committer thread (True); when
+#                          off each request commits its own ballot
+#   VOTE_BATCH_WINDOW_MS   how long to keep collecting after the first ballot (5)
+#   VOTE_BATCH_MAX         max ballots per transaction (256)
+#   VOTE_SUBMIT_TIMEOUT    seconds a request waits for its batch to commit (10)
+
+RECORDED = "recorded"
+ALREADY_VOTED = "already_voted"
+NO_CANDIDATE = "no_candidate"
+INVALID = "invalid"  # empty, or two selections for one position
+ERROR = "error"
+PENDING = "pending"  # taken into a batch that had not committed when the request stopped waiting
+
+
+class Ballot:
+    __slots__ = ("user_id", "candidate_ids", "future")
+
+    def __init__(self, user_id, candidate_ids):
+        self.user_id = user_id
+        self.candidate_ids = tuple(candidate_ids)
+        self.future = Future()
+
+
+def voted_positions(user_id, session=None):
+    """Positions ``user_id`` has already voted in (answered from the unique index)."""
+    session = session or read_session()
+    return {p for (p,) in session.query(Vote.position).filter(Vote.voter_id == user_id)}
+
+
+def _commit_batch(ballots):
+    """Write ``ballots`` in one transaction and resolve their futures."""
+    outcomes = {}
+    try:
+        positions = dict(
+            db.session.query(Candidate.id, Candidate.position).filter(
+                Candidate.id.in_({cid for b in ballots for cid in b.candidate_ids})
+            )
+        )
+        voted = set(
+            db.session.query(Vote.voter_id, Vote.position).filter(
+                Vote.voter_id.in_({b.user_id for b in ballots})
+            )
+        )
+        accepted = []
+        for b in ballots:
+            if not b.candidate_ids:
+                outcomes[b] = INVALID
+            elif any(cid not in positions for cid in b.candidate_ids):
+                outcomes[b] = NO_CANDIDATE
+            else:
+                races = [positions[cid] for cid in b.candidate_ids]
+                if len(set(races)) != len(races):
+                    outcomes[b] = INVALID
+                elif any((b.user_id, race) in voted for race in races):
+                    outcomes[b] = ALREADY_VOTED
+                else:
+                    voted.update((b.user_id, race) for race in races)
+                    accepted.append(b)
+                    outcomes[b] = RECORDED
+        if accepted:
+            # one timestamp per batch, shared by the ledger and the turnout rollup
+            now = datetime.utcnow()
+            rows = [
+                {"voter_id": b.user_id, "candidate_id": cid, "position": positions[cid], "timestamp": now}
+                for b in accepted for cid in b.candidate_ids
+            ]
+            ids = db.session.execute(
+                db.insert(Vote).returning(Vote.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            ledger.append([
+                (vote_id, r["voter_id"], r["candidate_id"], r["position"], now) for vote_id, r in zip(ids, rows)
+            ])
+            turnout.record((now, positions[cid], cid) for b in accepted for cid in b.candidate_ids)
+            per_candidate = {}
+            for b in accepted:
+                for cid in b.candidate_ids:
+                    per_candidate[cid] = per_candidate.get(cid, 0) + 1
+            for candidate_id, count in per_candidate.items():
+                tally.increment(candidate_id, count)
+            tally.mark_voted({b.user_id for b in accepted})
+        db.session.commit()
+    except IntegrityError:
+        # another process recorded a vote in one of these races since we looked;
+        # fall back to one transaction per ballot so the others still land
+        db.session.rollback()
+        if len(ballots) > 1:
+            for b in ballots:
+                _commit_batch([b])
+            return
+        outcomes = {ballots[0]: ALREADY_VOTED}
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception("Failed to commit a batch of %d ballots", len(ballots))
+        outcomes = {b: ERROR for b in ballots}
+    for b in ballots:
+        b.future.set_result(outcomes[b])
+
+
+class BallotBox:
+
+    def __init__(self, app):
+        self.app = app
+        self.window = app.config.get("VOTE_BATCH_WINDOW_MS", 5) / 1000.0
+        self.max_batch = app.config.get("VOTE_BATCH_MAX", 256)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ballot-box", daemon=True)
+        self._thread.start()
+
+    def submit(self, ballot):
+        self._queue.put(ballot)
+        return ballot.future
+
+    def _collect(self):
+        # a ballot whose request gave up (and cancelled its future) is skipped
+        batch = []
+        while not batch:
+            ballot = self._queue.get()
+            if ballot.future.set_running_or_notify_cancel():
+                batch.append(ballot)
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ballot = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if ballot.future.set_running_or_notify_cancel():
+                batch.append(ballot)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                with self.app.app_context():
+                    _commit_batch(batch)
+            except Exception:
+                self.app.logger.exception("Ballot committer failed")
+                for b in batch:
+                    if not b.future.done():
+                        b.future.set_result(ERROR)
+
+
+_boxes = {}
+_boxes_lock = threading.Lock()
+
+
+def _box(app):
+    with _boxes_lock:
+        box = _boxes.get(id(app))
+        if box is None:
+            box = BallotBox(app)
+            _boxes[id(app)] = box
+    return box
+
+
+def _give_up(future):
+    """Outcome for a request that stopped waiting on ``future``."""
+    if future.cancel():
+        # still queued: the committer will skip it, nothing was written
+        return ERROR
+    if future.done():
+        return future.result()
+    return PENDING
+
+
+def cast(user_id, candidate_ids):
+    """Record one ballot (all of ``candidate_ids`` or none) and return its outcome once durable."""
+    app = current_app._get_current_object()
+    ballot = Ballot(user_id, candidate_ids)
+    if not app.config.get("VOTE_GROUP_COMMIT", True):
+        _commit_batch([ballot])
+        return ballot.future.result()
+    # release this request's connection; the committer has its own
+    db.session.rollback()
+    future = _box(app).submit(ballot)
+    try:
+        return future.result(timeout=app.config.get("VOTE_SUBMIT_TIMEOUT", 10))
+    except TimeoutError:
+        return _give_up(future)
+
+
+async def cast_async(user_id, candidate_ids):
+    """cast() for coroutines: waits for the commit without holding a thread."""
+    app = current_app._get_current_object()
+    if not app.config.get("VOTE_GROUP_COMMIT", True):
+        return await asyncio.to_thread(cast, user_id, candidate_ids)
+    future = _box(app).submit(Ballot(user_id, candidate_ids))
+    # shielded: a disconnected request must not cancel the ballot's future,
+    # which the committer resolves whatever happens to the request; a timeout
+    # withdraws the ballot only if it is still queued
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), app.config.get("VOTE_SUBMIT_TIMEOUT", 10)
+        )
+    except asyncio.TimeoutError:
+        return _give_up(future)
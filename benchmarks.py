@@ -0,0 +1,344 @@
+"""Micro-benchmarks for individual hot paths.
+
+  python benchmarks.py ballot [--candidates 50] [--iterations 2000]
+  python benchmarks.py startup [--runs 10] [--app main:app]
+  python benchmarks.py session [--iterations 5000]
+  python benchmarks.py ledger [--size 100000] [--ballots 300]
+  python benchmarks.py registration [--voters 200000] [--error-rate 0.001]
+  python benchmarks.py credentials [--registrations 64] [--concurrency 16] [--rounds 12]
+
+For end-to-end numbers across the whole voter journey use loadtest.py.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+
+def _timeit(fn, iterations):
+    fn()  # warm up template caches
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed, elapsed / iterations * 1e6
+
+
+def _template_app():
+    # Just the templates, with stand-ins for the endpoints they link to,
+    # so template cost is measured without a database.
+    from flask import Blueprint, Flask
+    app = Flask(__name__, template_folder="templates")
+    voter = Blueprint("voter", __name__)
+    voter.add_url_rule("/ballot", "ballot", lambda: "", methods=["POST"])
+    voter.add_url_rule("/logout", "logout", lambda: "")
+    app.register_blueprint(voter)
+    app.config["SECRET_KEY"] = "bench"
+    return app
+
+
+def bench_ballot(args):
+    """Full dashboard render vs. page assembled around a pre-rendered ballot."""
+    from flask import render_template
+    from markupsafe import Markup
+
+    Voter = namedtuple("Voter", "name has_voted")
+    Entry = namedtuple("Entry", "id name party position")
+    candidates = tuple(
+        Entry(i, f"Candidate {i}", f"Party {i % 5}", f"Position {i % 3}") for i in range(1, args.candidates + 1)
+    )
+    races = {}
+    for c in candidates:
+        races.setdefault(c.position, []).append(c)
+    races = tuple((position, tuple(group)) for position, group in races.items())
+    user = Voter("Bench Voter", False)
+    app = _template_app()
+
+    with app.test_request_context("/dashboard"):
+        full = lambda: render_template("dashboard.html", user=user, races=races)
+        ballot = Markup(render_template("_ballot.html", races=races))
+        assembled = lambda: render_template("dashboard.html", user=user, races=(), ballot_html=ballot)
+        assert full().split() == assembled().split()
+
+        full_rate, full_us = _timeit(full, args.iterations)
+        frag_rate, frag_us = _timeit(assembled, args.iterations)
+
+    print(f"dashboard.html with {args.candidates} candidates, {args.iterations} renders each")
+    print(f"  full render       {full_rate:10.0f}/s  {full_us:8.1f} us/page")
+    print(f"  fragment assembly {frag_rate:10.0f}/s  {frag_us:8.1f} us/page  ({full_us / frag_us:.1f}x)")
+
+
+def bench_session(args):
+    """Session load + save per request: signed cookie vs. server-side stores."""
+    import tempfile
+    from flask import Flask, request
+    from flask.sessions import SecureCookieSessionInterface
+    import sessions
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "bench"
+    data = {
+        "user_id": 4821, "user_name": "Bench Voter", "user_email": "bench.voter@example.com",
+        "_flashes": [("success", "Logged in successfully!")],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [
+            ("signed cookie", SecureCookieSessionInterface()),
+            ("memory", sessions.ServerSessionInterface(sessions.MemorySessionStore())),
+            ("sqlite", sessions.ServerSessionInterface(sessions.SQLiteSessionStore(os.path.join(tmp, "s.db")))),
+        ]
+        print(f"session load+save, {args.iterations} requests each")
+        for label, interface in backends:
+            # first response creates the session and its cookie
+            with app.test_request_context("/"):
+                session = interface.open_session(app, request)
+                session.update(data)
+                response = app.response_class()
+                interface.save_session(app, session, response)
+            cookie = response.headers["Set-Cookie"].split(";", 1)[0]
+
+            def read_only(cookie=cookie, interface=interface):
+                with app.test_request_context("/", headers={"Cookie": cookie}):
+                    session = interface.open_session(app, request)
+                    interface.save_session(app, session, app.response_class())
+
+            def read_write(cookie=cookie, interface=interface):
+                with app.test_request_context("/", headers={"Cookie": cookie}):
+                    session = interface.open_session(app, request)
+                    session["n"] = session.get("n", 0) + 1
+                    interface.save_session(app, session, app.response_class())
+
+            _, ro_us = _timeit(read_only, args.iterations)
+            _, rw_us = _timeit(read_write, args.iterations)
+            print(f"  {label:<14} cookie {len(cookie):4d} B   read {ro_us:7.1f} us   read+write {rw_us:7.1f} us")
+
+
+def bench_ledger(args):
+    """Merkle ledger: append cost per batch, proof size/time, and share of a ballot commit."""
+    import tempfile
+    from datetime import datetime
+    from app import create_app
+    from models import db, User, Candidate
+    import ballot_box
+    import ledger
+    import migrations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "VOTE_GROUP_COMMIT": False,
+        })
+        with app.app_context():
+            migrations.upgrade(db)
+            now = datetime.utcnow()
+            # grow the tree to --size synthetic leaves (negative ids, clear of real votes)
+            for start in range(1, args.size + 1, 10000):
+                ledger.append([(-i, i, 1, "P", now) for i in range(start, min(start + 10000, args.size + 1))])
+            db.session.commit()
+
+            print(f"ledger with {args.size} leaves")
+            for batch in (1, 16, 256):
+                votes = [(-args.size - i, 0, 1, "P", now) for i in range(1, batch + 1)]
+
+                def append_batch(votes=votes):
+                    ledger.append(votes)
+                    db.session.rollback()
+
+                _, us = _timeit(append_batch, 200)
+                print(f"  append batch of {batch:<4} {us:9.1f} us/batch  {us / batch:7.1f} us/vote")
+
+            proof = ledger.prove(-(args.size // 3))
+            leaf, path = bytes.fromhex(proof["leaf_hash"]), [bytes.fromhex(h) for h in proof["path"]]
+            root = bytes.fromhex(proof["root"])
+            _, prove_us = _timeit(lambda: (ledger.prove(-(args.size // 3)), db.session.rollback()), 500)
+            _, verify_us = _timeit(
+                lambda: ledger.verify_inclusion(leaf, proof["leaf_index"], proof["tree_size"], path, root), 5000
+            )
+            print(f"  inclusion proof  {len(path)} hashes, build {prove_us:.1f} us, verify {verify_us:.1f} us")
+
+            db.session.add(Candidate(name="A", party="P", position="P"))
+            db.session.add_all(User(name="v", email=f"v{i}@b", voter_id=f"B{i}", password="x") for i in range(args.ballots))
+            db.session.commit()
+            user_ids = [u.id for u in User.query.all()]
+            candidate_id = Candidate.query.first().id
+            start = time.perf_counter()
+            for uid in user_ids:
+                assert ballot_box.cast(uid, [candidate_id]) == ballot_box.RECORDED
+            per_ballot = (time.perf_counter() - start) / len(user_ids) * 1e6
+            print(f"  ballot commit (one per transaction, incl. append) {per_ballot:.1f} us/ballot")
+
+
+def bench_registration(args):
+    """Duplicate check before registration: database lookups vs. the Bloom filter pre-check."""
+    import tempfile
+    import uuid
+    from app import create_app
+    from models import db, User
+    import credentials
+    import migrations
+    import voter_filter
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "REGISTRATION_FILTER_ERROR_RATE": args.error_rate,
+        })
+        with app.app_context():
+            migrations.upgrade(db)
+            for start in range(0, args.voters, 10000):
+                db.session.execute(db.insert(User), [
+                    {"name": "v", "email": f"v{i}@bench.invalid", "voter_id": f"B{i}", "password": credentials.OTP_ONLY}
+                    for i in range(start, min(start + 10000, args.voters))
+                ])
+            db.session.commit()
+
+            f = voter_filter.get_filter()
+            f.might_contain(voter_filter.VOTER_ID, "warm-up")  # starts the background build
+            while not f.stats()["built"]:
+                time.sleep(0.05)
+            fresh = [uuid.uuid4().hex for _ in range(args.checks)]
+
+            def database_only(values=iter(fresh * 2)):
+                value = next(values)
+                User.query.filter((User.email == f"{value}@x") | (User.voter_id == value)).first()
+
+            def with_filter(values=iter(fresh * 2)):
+                value = next(values)
+                voter_filter.taken(voter_id=value, email=f"{value}@x")
+
+            _, db_us = _timeit(database_only, args.checks)
+            _, filter_us = _timeit(with_filter, args.checks)
+            report = f.stats()
+            print(f"{args.voters} voters, target false-positive rate {args.error_rate}")
+            print(f"  filter build          {report['build_seconds'] * 1000:9.1f} ms")
+            print(f"  filter memory         {report['bytes'] / 1024:9.1f} KiB, {report['hashes']} hashes")
+            print(f"  expected fp rate      {report['expected_error_rate']:9.6f}")
+            print(f"  observed fp rate      {report['observed_error_rate']:9.6f} over {report['checks']} new values")
+            print(f"  new voter, DB query   {db_us:9.1f} us/check")
+            print(f"  new voter, filter     {filter_us:9.1f} us/check")
+
+
+def bench_credentials(args):
+    """Password work per registration: a bcrypt hash vs. the OTP-only sentinel."""
+    import secrets
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from flask import Flask
+    import credentials
+
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_ROUNDS=args.rounds)
+    modes = [
+        # before: every OTP-only registration hashed a random password; real passwords still do
+        ("bcrypt", lambda: credentials.hash_password(secrets.token_urlsafe(16))),
+        # OTP-only accounts now: no hash at all
+        ("OTP-only sentinel", lambda: credentials.OTP_ONLY),
+    ]
+
+    def register(work):
+        with app.app_context():
+            work()
+
+    def probe(stop, delays):
+        # stands in for the other requests a worker serves meanwhile
+        while not stop.is_set():
+            start = time.perf_counter()
+            sum(i * i for i in range(2000))
+            delays.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    print(f"{args.registrations} registrations from {args.concurrency} request threads, "
+          f"bcrypt rounds {args.rounds}, {os.cpu_count()} CPUs")
+    for label, work in modes:
+        stop, delays = threading.Event(), []
+        watcher = threading.Thread(target=probe, args=(stop, delays))
+        watcher.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(register, [work] * args.registrations))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        watcher.join()
+        delays.sort()
+        p95 = delays[int(len(delays) * 0.95)] * 1000 if delays else 0.0
+        print(f"  {label:<18} {args.registrations / elapsed:10.1f} registrations/s"
+              f"   other work p50 {statistics.median(delays) * 1000 if delays else 0.0:6.2f} ms  p95 {p95:6.2f} ms")
+
+
+_STARTUP_PROBE = """
+import sys, time
+start = time.perf_counter()
+import importlib
+module_name, _, attr = sys.argv[1].partition(":")
+app = getattr(importlib.import_module(module_name), attr or "app")
+imported = time.perf_counter()
+with app.test_request_context("/"):
+    pass
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def bench_startup(args):
+    """Cold worker start: interpreter launch, app import and first app context."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="0")
+    wall, imports = [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE, args.app],
+            cwd=here, env=env, check=True, capture_output=True, text=True,
+        ).stdout.split()
+        wall.append(time.perf_counter() - start)
+        imports.append(float(out[-2]))
+
+    print(f"{args.app}: {args.runs} cold starts")
+    print(f"  import + create_app  median {statistics.median(imports) * 1000:8.1f} ms  max {max(imports) * 1000:8.1f} ms")
+    print(f"  process wall time    median {statistics.median(wall) * 1000:8.1f} ms  max {max(wall) * 1000:8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    ballot = sub.add_parser("ballot", help=bench_ballot.__doc__)
+    ballot.add_argument("--candidates", type=int, default=50)
+    ballot.add_argument("--iterations", type=int, default=2000)
+    ballot.set_defaults(func=bench_ballot)
+
+    startup = sub.add_parser("startup", help=bench_startup.__doc__)
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("--app", default="main:app", help="module:attribute to import")
+    startup.set_defaults(func=bench_startup)
+
+    session = sub.add_parser("session", help=bench_session.__doc__)
+    session.add_argument("--iterations", type=int, default=5000)
+    session.set_defaults(func=bench_session)
+
+    ledger = sub.add_parser("ledger", help=bench_ledger.__doc__)
+    ledger.add_argument("--size", type=int, default=100000)
+    ledger.add_argument("--ballots", type=int, default=300)
+    ledger.set_defaults(func=bench_ledger)
+
+    registration = sub.add_parser("registration", help=bench_registration.__doc__)
+    registration.add_argument("--voters", type=int, default=200000)
+    registration.add_argument("--error-rate", type=float, default=0.001)
+    registration.add_argument("--checks", type=int, default=20000)
+    registration.set_defaults(func=bench_registration)
+
+    creds = sub.add_parser("credentials", help=bench_credentials.__doc__)
+    creds.add_argument("--registrations", type=int, default=64)
+    creds.add_argument("--concurrency", type=int, default=16)
+    creds.add_argument("--rounds", type=int, default=12)
+    creds.set_defaults(func=bench_credentials)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+
+from models import db, Candidate, CatalogueVersion
+from database import read_session
+
+# Candidate catalogue cache.
+#
+# The candidate list only changes when an admin adds or deletes a candidate,
+# so voter pages read it from an in-process cache instead of querying
+# Candidate on every view. Those admin routes call bump() in the same
+# transaction as their change; every worker notices the new version through
+# a primary-key read of the one-row catalogue_version table, done at most
+# once per CATALOGUE_CHECK_SECONDS (default 1.0). Between checks a page view
+# needs no query at all.
+
+CandidateEntry = namedtuple("CandidateEntry", "id name party position")
+
+_lock = threading.Lock()
+_version = None
+_entries = ()
+_by_id = {}
+_races = ()
+_checked_at = 0.0
+
+
+def catalogue_version(session=None):
+    session = session or read_session()
+    return session.query(CatalogueVersion.version).filter(CatalogueVersion.id == 1).scalar() or 0
+
+
+def bump():
+    """Mark the catalogue changed; call inside the transaction that changes candidates."""
+    db.session.execute(
+        db.update(CatalogueVersion)
+        .where(CatalogueVersion.id == 1)
+        .values(version=CatalogueVersion.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def invalidate():
+    """Make this process re-check the version on its next read (call after commit)."""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def due(now=None):
+    """True if the next read re-checks the version, i.e. runs a query."""
+    now = time.monotonic() if now is None else now
+    return _version is None or now - _checked_at >= current_app.config.get("CATALOGUE_CHECK_SECONDS", 1.0)
+
+
+def refresh():
+    """Re-check the version now if it is due (async views call this on a worker thread)."""
+    _refresh()
+
+
+def _refresh():
+    global _version, _entries, _by_id, _races, _checked_at
+    now = time.monotonic()
+    if not due(now):
+        return
+    with _lock:
+        if not due(now):
+            return
+        session = read_session()
+        version = catalogue_version(session)
+        if version != _version:
+            entries = tuple(
+                CandidateEntry(*row)
+                for row in session.query(
+                    Candidate.id, Candidate.name, Candidate.party, Candidate.position
+                ).order_by(Candidate.id)
+            )
+            races = {}
+            for e in entries:
+                races.setdefault(e.position, []).append(e)
+            _entries, _by_id, _races, _version = (
+                entries,
+                {e.id: e for e in entries},
+                tuple((position, tuple(group)) for position, group in races.items()),
+                version,
+            )
+        _checked_at = now
+
+
+def candidates():
+    """Tuple of CandidateEntry ordered by id."""
+    _refresh()
+    return _entries
+
+
+def races():
+    """Tuple of (position, candidates) in order of each position's first candidate."""
+    _refresh()
+    return _races
+
+
+def get(candidate_id):
+    _refresh()
+    return _by_id.get(candidate_id)
+
+
+def version():
+    _refresh()
+    return _version
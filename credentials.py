@@ -0,0 +1,46 @@
+import bcrypt as _bcrypt
+from flask import current_app, has_app_context
+
+# Password credentials.
+#
+# Voters log in with an emailed OTP, so accounts created through the OTP flow
+# have no usable password. They store the OTP_ONLY sentinel instead of a
+# bcrypt hash of a random string: it can never match a password and costs
+# nothing to produce.
+#
+# Real hashes (routes.register, Admin.set_password) are computed on the
+# calling thread. bcrypt releases the GIL while hashing, so other request
+# threads keep running meanwhile; handing the work to a pool and waiting on it
+# would only add a thread hop. The cost factor comes from config:
+#   PASSWORD_HASH_ROUNDS   bcrypt log rounds (falls back to BCRYPT_LOG_ROUNDS, then 12)
+
+OTP_ONLY = "!otp-only"
+DEFAULT_ROUNDS = 12
+
+
+def hash_rounds(config=None):
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    return config.get("PASSWORD_HASH_ROUNDS") or config.get("BCRYPT_LOG_ROUNDS") or DEFAULT_ROUNDS
+
+
+def _hash(raw_password, rounds):
+    return _bcrypt.hashpw(raw_password.encode("utf-8"), _bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def hash_password(raw_password):
+    return _hash(raw_password, hash_rounds())
+
+
+def check_password(stored, raw_password):
+    if not stored or stored == OTP_ONLY or not raw_password:
+        return False
+    try:
+        return _bcrypt.checkpw(raw_password.encode("utf-8"), stored.encode("utf-8"))
+    except ValueError:
+        # not a bcrypt hash
+        return False
+
+
+def has_password(stored):
+    return bool(stored) and stored != OTP_ONLY
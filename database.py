@@ -0,0 +1,123 @@
+import os
+import sqlite3
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+
+# Database engine configuration, all in one place.
+#
+# Two engines are configured on the same database:
+#   default  - the writer, used by db.session for votes, registration, admin edits
+#   "reader" - pooled read-only connections for dashboards, live results and
+#              statistics (read_session() below)
+#
+# For SQLite every connection gets WAL journaling, so readers never block a
+# ballot commit and vice versa, plus a busy timeout so concurrent writers
+# wait for the lock instead of failing with "database is locked". Reader
+# connections are opened with mode=ro so they cannot write.
+#
+# The writer keeps synchronous = FULL: in WAL mode NORMAL skips the fsync on
+# commit, and a ballot the voter was told is recorded could be lost on power
+# failure. Only the read-only reader, which never commits, runs with NORMAL.
+#
+# Environment:
+#   DATABASE_URL        writer database (default sqlite:///database.db)
+#   READ_DATABASE_URL   read replica; defaults to a read-only view of DATABASE_URL
+#   DB_BUSY_TIMEOUT_MS  SQLite busy timeout (5000)
+#   DB_READ_POOL_SIZE   pooled reader connections per process (10)
+#   DB_SYNCHRONOUS      writer's PRAGMA synchronous: FULL (default) or EXTRA;
+#                       NORMAL/OFF trade commit durability for speed
+
+READER = "reader"
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+_db = None
+
+
+def _is_memory(url):
+    url = make_url(url)
+    return url.drivername.startswith("sqlite") and url.database in (None, "", ":memory:")
+
+
+def _read_only_url(url):
+    url = make_url(url)
+    if url.drivername not in {"sqlite", "sqlite+pysqlite"}:
+        return url
+    if url.query.get("uri"):
+        return url.update_query_dict({"mode": "ro"})
+    return url.set(database=f"file:{url.database}").update_query_dict({"mode": "ro", "uri": "true"})
+
+
+def configure(app):
+    """Fill in engine settings on ``app.config``; call before SQLAlchemy(app)."""
+    config = app.config
+    writer_url = config.setdefault(
+        "SQLALCHEMY_DATABASE_URI", os.environ.get("DATABASE_URL", "sqlite:///database.db")
+    )
+    config["DB_BUSY_TIMEOUT_MS"] = int(os.environ.get("DB_BUSY_TIMEOUT_MS", config.get("DB_BUSY_TIMEOUT_MS", 5000)))
+    read_pool = int(os.environ.get("DB_READ_POOL_SIZE", config.get("DB_READ_POOL_SIZE", 10)))
+    synchronous = os.environ.get("DB_SYNCHRONOUS", config.get("DB_SYNCHRONOUS", "FULL")).upper()
+    if synchronous not in _SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown DB_SYNCHRONOUS: {synchronous!r}")
+    config["DB_SYNCHRONOUS"] = synchronous
+
+    config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {"pool_pre_ping": True})
+    binds = config.setdefault("SQLALCHEMY_BINDS", {})
+    # an in-memory database cannot be shared with a second engine; reads use db.session
+    if READER not in binds and not _is_memory(writer_url):
+        read_url = os.environ.get("READ_DATABASE_URL") or _read_only_url(writer_url)
+        binds[READER] = {"url": read_url, "pool_size": read_pool, "pool_pre_ping": True}
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    from flask import current_app, has_app_context
+    busy = current_app.config.get("DB_BUSY_TIMEOUT_MS", 5000) if has_app_context() else 5000
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA busy_timeout = {int(busy)}")
+    try:
+        # persistent in the file; a read-only connection just reports the current mode
+        cur.execute("PRAGMA journal_mode = WAL")
+    except sqlite3.OperationalError:
+        pass
+    cur.execute("PRAGMA temp_store = MEMORY")
+    cur.execute("PRAGMA cache_size = -16000")
+    cur.close()
+
+
+def read_session():
+    """Session on the read-only engine, scoped to the current app context."""
+    if READER not in _db.engines:
+        return _db.session
+    session = g.get("_read_session")
+    if session is None:
+        session = Session(bind=_db.engines[READER], autoflush=False)
+        g._read_session = session
+    return session
+
+
+def close_read_session(exc=None):
+    session = g.pop("_read_session", None)
+    if session is not None:
+        session.close()
+
+
+def _set_synchronous(engine, mode):
+    @event.listens_for(engine, "connect")
+    def _synchronous(dbapi_conn, connection_record):
+        if isinstance(dbapi_conn, sqlite3.Connection):
+            dbapi_conn.execute(f"PRAGMA synchronous = {mode}")
+
+
+def init_app(app, db):
+    global _db
+    _db = db
+    app.teardown_appcontext(close_read_session)
+    with app.app_context():
+        engines = dict(db.engines)
+    for name, engine in engines.items():
+        # commits must reach the disk; the read-only reader never commits
+        _set_synchronous(engine, "NORMAL" if name == READER else app.config["DB_SYNCHRONOUS"])
@@ -0,0 +1,80 @@
+import gzip
+import threading
+from flask import current_app, render_template, request, make_response
+from markupsafe import Markup
+
+import ballot_box
+import catalogue
+
+# Pre-rendered ballot fragment for dashboard.html.
+#
+# The ballot (_ballot.html) depends only on the candidate catalogue and on
+# which races the voter still has open, so it is rendered once per
+# catalogue version and set of open races and dropped into the page as
+# ready-made markup; per request only the greeting, flash messages and
+# voted state are rendered. Most voters share one of a handful of sets
+# (nothing voted yet, everything voted), so the cache stays small.
+#
+# Config:
+#   BALLOT_FRAGMENT_CACHE  use the cached fragment (True)
+#   DASHBOARD_GZIP         gzip the assembled page for clients that accept it (False)
+#
+# If a CSRF extension puts csrf_token() into templates the fragment would
+# carry one voter's token, so caching switches itself off in that case.
+
+_lock = threading.Lock()
+_cached = (None, {})  # (catalogue version, {open positions: Markup})
+_MAX_VARIANTS = 64
+
+
+def _cacheable():
+    if not current_app.config.get("BALLOT_FRAGMENT_CACHE", True):
+        return False
+    return "csrf_token" not in current_app.jinja_env.globals
+
+
+def open_races(user_id, voted=None):
+    """Races from the catalogue that ``user_id`` has not voted in yet (``voted``: positions, if known)."""
+    if voted is None:
+        voted = ballot_box.voted_positions(user_id)
+    return tuple(race for race in catalogue.races() if race[0] not in voted)
+
+
+def ballot_html(races):
+    """The rendered ballot for ``races``, or None if not cacheable."""
+    global _cached
+    if not _cacheable():
+        return None
+    version = catalogue.version()
+    key = tuple(position for position, _ in races)
+    cached_version, variants = _cached
+    html = variants.get(key) if cached_version == version else None
+    if html is not None:
+        return html
+    html = Markup(render_template("_ballot.html", races=races))
+    with _lock:
+        if _cached[0] != version or len(_cached[1]) >= _MAX_VARIANTS:
+            _cached = (version, {})
+        _cached[1][key] = html
+    return html
+
+
+def render_dashboard(user, races=None):
+    if races is None:
+        races = open_races(user.id)
+    ballot = ballot_html(races) if races else None
+    if ballot is not None:
+        body = render_template("dashboard.html", user=user, races=(), ballot_html=ballot)
+    else:
+        body = render_template("dashboard.html", user=user, races=races)
+    return _compressed(body)
+
+
+def _compressed(body):
+    if not current_app.config.get("DASHBOARD_GZIP", False) or "gzip" not in request.accept_encodings:
+        return body
+    response = make_response(gzip.compress(body.encode("utf-8"), compresslevel=1))
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
@@ -0,0 +1,103 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Status stores for background jobs, keyed by random job id.
+#
+# A job is started by one worker process and may be polled through any
+# other, so by default statuses live in a small SQLite file every process
+# can read (OTP_STORE_PATH, default instance/otp.db, one table per kind of
+# job). The "memory" backend keeps them per process in an LRU, e.g. for
+# tests. Statuses expire ``ttl`` seconds after their last update.
+#
+# Used by mail_queue (OTP delivery) and voter_import (roll uploads).
+
+
+class MemoryStatusStore:
+    """Per-process job statuses, oldest dropped first beyond ``max_keys``."""
+
+    def __init__(self, max_keys=10000, ttl=900):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._entries = OrderedDict()  # job_id -> (status, updated)
+        self._lock = threading.Lock()
+
+    def set(self, job_id, status):
+        now = time.time()
+        with self._lock:
+            self._entries.pop(job_id, None)
+            self._entries[job_id] = (status, now)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+        if entry is None or entry[1] < time.time() - self.ttl:
+            return None
+        return entry[0]
+
+
+class SQLiteStatusStore:
+    """Job statuses shared by every worker process through a small SQLite file."""
+
+    def __init__(self, path, table, ttl=900):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._local = threading.local()
+        # schema on a throwaway connection: the app may be built before workers fork
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " job_id TEXT PRIMARY KEY, status TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_updated ON {table} (updated)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        # per thread and per process: a forked worker never reuses its parent's handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def set(self, job_id, status):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (job_id, status, updated) VALUES (?, ?, ?)",
+            (job_id, status, now),
+        )
+        if random.random() < 0.01:
+            conn.execute(f"DELETE FROM {self.table} WHERE updated < ?", (now - self.ttl,))
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            f"SELECT status FROM {self.table} WHERE job_id = ? AND updated >= ?",
+            (job_id, time.time() - self.ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+
+def open_store(app, table, backend, max_keys=10000, ttl=900):
+    """The status store for one kind of job; ``backend`` is "sqlite" or "memory"."""
+    if backend == "memory":
+        return MemoryStatusStore(max_keys, ttl)
+    if backend == "sqlite":
+        path = app.config.get("OTP_STORE_PATH") or os.path.join(app.instance_path, "otp.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteStatusStore(path, table, ttl)
+    raise ValueError(f"Unknown job status backend: {backend!r}")
@@ -0,0 +1,266 @@
+import hashlib
+import json
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from models import db, Vote, LedgerNode
+from database import read_session
+
+# Tamper-evident commitment over the vote ledger.
+#
+# Votes are the leaves of an append-only Merkle tree in the RFC 6962 /
+# Certificate Transparency shape: leaf = SHA-256(0x00 || vote), node =
+# SHA-256(0x01 || left || right), leaves in Vote.id order. Every complete
+# subtree is stored as a LedgerNode row (level, index), about two rows per
+# vote, written in the same transaction as the Vote rows by the ballot box.
+#
+# Appending k votes reads the tree's current peaks (one row per set bit of
+# the tree size, one query), hashes about 2k nodes in memory and inserts
+# them in one executemany, so the cost per ballot does not grow with the
+# ledger. The root is the peaks folded right to left; an inclusion proof is
+# O(log n) stored nodes, fetched with one query. Auditors compare roots,
+# voters check their receipts with verify_inclusion(), and `flask
+# ledger-verify` rehashes the whole Vote table against the stored tree.
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(vote_id, voter_id, candidate_id, position, timestamp):
+    encoded = json.dumps(
+        [vote_id, voter_id, candidate_id, position, timestamp.isoformat()],
+        separators=(",", ":"), ensure_ascii=False,
+    ).encode("utf-8")
+    return hashlib.sha256(LEAF_PREFIX + encoded).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _subtrees(start, end):
+    """(level, index) of the stored subtrees that cover leaves [start, end), largest first."""
+    nodes = []
+    while start < end:
+        level = (end - start).bit_length() - 1
+        nodes.append((level, start >> level))
+        start += 1 << level
+    return nodes
+
+
+def _fold(hashes):
+    """Merkle hash of a range from its subtree hashes (largest first)."""
+    result = hashes[-1]
+    for h in reversed(hashes[:-1]):
+        result = node_hash(h, result)
+    return result
+
+
+_TREE_SIZE = select(db.func.max(LedgerNode.idx)).where(LedgerNode.level == 0)
+_fetch_statements = {}
+
+
+def _fetch_statement(count):
+    # OR of primary-key lookups (SQLite does not use the index for a row-value
+    # IN), built once per key count: constructing it per call costs more than
+    # running it
+    statement = _fetch_statements.get(count)
+    if statement is None:
+        statement = select(LedgerNode.level, LedgerNode.idx, LedgerNode.hash).where(db.or_(*(
+            db.and_(LedgerNode.level == db.bindparam(f"l{i}"), LedgerNode.idx == db.bindparam(f"i{i}"))
+            for i in range(count)
+        )))
+        _fetch_statements[count] = statement
+    return statement
+
+
+def _fetch(executor, keys):
+    if not keys:
+        return {}
+    params = {}
+    for i, (level, idx) in enumerate(keys):
+        params[f"l{i}"], params[f"i{i}"] = level, idx
+    rows = executor.execute(_fetch_statement(len(keys)), params)
+    return {(level, idx): h for level, idx, h in rows}
+
+
+def tree_size(executor=None):
+    executor = executor or read_session()
+    last = executor.execute(_TREE_SIZE).scalar()
+    return 0 if last is None else last + 1
+
+
+def append(votes, executor=None):
+    """Add ``votes`` (id, voter_id, candidate_id, position, timestamp; in id order) as leaves.
+
+    Runs in the caller's transaction, which must already hold the write lock
+    (the ballot box calls it after inserting the Vote rows).
+    """
+    if not votes:
+        return
+    executor = executor or db.session
+    size = tree_size(executor)
+    peaks = _subtrees(0, size)
+    known = _fetch(executor, peaks)
+    stack = [(level, idx, known[(level, idx)]) for level, idx in peaks]
+    rows = []
+    for n, vote in enumerate(votes, start=size):
+        h = leaf_hash(*vote)
+        rows.append({"level": 0, "idx": n, "hash": h, "vote_id": vote[0]})
+        level, idx = 0, n
+        # a new right child completes every parent up the right edge
+        while stack and stack[-1][0] == level:
+            left = stack.pop()[2]
+            h = node_hash(left, h)
+            level, idx = level + 1, idx >> 1
+            rows.append({"level": level, "idx": idx, "hash": h, "vote_id": None})
+        stack.append((level, idx, h))
+    executor.execute(LedgerNode.__table__.insert(), rows)
+
+
+def root(executor=None):
+    """(tree size, root hash) of the ledger as committed; (0, None) while empty."""
+    executor = executor or read_session()
+    size = tree_size(executor)
+    if size == 0:
+        return 0, None
+    peaks = _subtrees(0, size)
+    known = _fetch(executor, peaks)
+    return size, _fold([known[p] for p in peaks])
+
+
+def _audit_plan(index, size):
+    """Subtree ranges whose hashes form the RFC 6962 inclusion path, leaf first."""
+    plan = []
+    start, end = 0, size
+    while end - start > 1:
+        split = 1 << ((end - start - 1).bit_length() - 1)
+        if index - start < split:
+            plan.append(_subtrees(start + split, end))
+            end = start + split
+        else:
+            plan.append(_subtrees(start, start + split))
+            start += split
+    plan.reverse()
+    return plan
+
+
+def prove(vote_id, session=None):
+    """Inclusion proof for ``vote_id`` against the current root, or None if it is not in the tree."""
+    session = session or read_session()
+    leaf = session.execute(
+        select(LedgerNode.idx, LedgerNode.hash).where(LedgerNode.vote_id == vote_id)
+    ).first()
+    if leaf is None:
+        return None
+    index, leaf_digest = leaf
+    size = tree_size(session)
+    plan = _audit_plan(index, size)
+    peaks = _subtrees(0, size)
+    known = _fetch(session, sorted({node for step in plan for node in step} | set(peaks)))
+    return {
+        "vote_id": vote_id,
+        "leaf_index": index,
+        "tree_size": size,
+        "leaf_hash": leaf_digest.hex(),
+        "path": [_fold([known[node] for node in step]).hex() for step in plan],
+        "root": _fold([known[p] for p in peaks]).hex(),
+    }
+
+
+def verify_inclusion(leaf_digest, index, size, path, root_digest):
+    """Check an inclusion proof (RFC 9162, 2.1.3.2). Hashes are bytes."""
+    if index >= size:
+        return False
+    fn, sn = index, size - 1
+    result = leaf_digest
+    for sibling in path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            result = node_hash(sibling, result)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            result = node_hash(result, sibling)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and result == root_digest
+
+
+def _ledger_pages(executor, batch_size, after=0):
+    query = select(Vote.id, Vote.voter_id, Vote.candidate_id, Vote.position, Vote.timestamp).order_by(Vote.id)
+    last = after
+    while True:
+        page = executor.execute(query.where(Vote.id > last).limit(batch_size)).all()
+        if not page:
+            return
+        last = page[-1][0]
+        yield page
+
+
+def build(conn, batch_size=5000):
+    """Append every ledger vote not yet in the tree (migration 6 runs this once)."""
+    size = tree_size(conn)
+    last = conn.execute(
+        select(LedgerNode.vote_id).where(LedgerNode.level == 0, LedgerNode.idx == size - 1)
+    ).scalar()
+    added = 0
+    for page in _ledger_pages(conn, batch_size, after=last or 0):
+        append([tuple(row) for row in page], conn)
+        added += len(page)
+    return added
+
+
+def verify_ledger(executor, batch_size=5000):
+    """Rehash every vote and every stored node above it.
+
+    Returns (votes checked, the first mismatch found or None, recomputed root).
+    Interior nodes are checked as well as the root: proofs are built from them.
+    """
+    stack = []
+    checked = 0
+    for page in _ledger_pages(executor, batch_size):
+        stored = {vote_id: (idx, h) for vote_id, idx, h in executor.execute(
+            select(LedgerNode.vote_id, LedgerNode.idx, LedgerNode.hash)
+            .where(LedgerNode.vote_id.in_([row[0] for row in page]))
+        )}
+        computed = {}  # level -> {idx: hash} of the nodes this page completes
+        for row in page:
+            h = leaf_hash(*row)
+            if stored.get(row[0]) != (checked, h):
+                return checked, f"vote {row[0]} does not match its ledger leaf", None
+            level, idx = 0, checked
+            while stack and stack[-1][0] == level:
+                h = node_hash(stack.pop()[1], h)
+                level, idx = level + 1, idx >> 1
+                computed.setdefault(level, {})[idx] = h
+            stack.append((level, h))
+            checked += 1
+        # one primary-key range read per level
+        for level, nodes in sorted(computed.items()):
+            found = dict(executor.execute(
+                select(LedgerNode.idx, LedgerNode.hash)
+                .where(LedgerNode.level == level, LedgerNode.idx.between(min(nodes), max(nodes)))
+            ).all())
+            for idx in sorted(nodes):
+                if found.get(idx) != nodes[idx]:
+                    return checked, f"ledger node {level}/{idx} does not match the votes below it", None
+    return checked, None, _fold([h for _, h in stack]) if stack else None
+
+
+@click.command("ledger-verify")
+@with_appcontext
+def ledger_verify_command():
+    """Rehash the vote ledger and compare it with the stored Merkle root."""
+    with db.engine.connect() as conn:
+        checked, mismatch, recomputed = verify_ledger(conn)
+        size, stored = root(conn)
+    if mismatch is not None:
+        raise click.ClickException(mismatch)
+    if checked != size or recomputed != stored:
+        raise click.ClickException(f"ledger has {checked} votes but the tree commits to {size}; roots differ")
+    click.echo(f"ok: {size} votes, root {stored.hex() if stored else '-'}")
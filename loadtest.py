@@ -0,0 +1,546 @@
+"""Load test for the full voter journey.
+
+Each simulated voter runs register -> get_otp -> verify_otp -> dashboard ->
+vote -> dashboard. OTP emails are delivered to a local SMTP sink started by
+this script, which reads the code out of the message, so no real mail relay
+is involved.
+
+Three targets:
+
+  in-process   python loadtest.py --voters 200 --concurrency 20
+               imports the app (--app, default main:app) and uses Flask test
+               clients; the app is pointed at the sink before first use.
+               --server-threads N admits at most N requests at a time, like a
+               threaded WSGI server with N workers.
+  asgi         python loadtest.py --asgi --voters 200 --concurrency 20
+               imports the ASGI app (default asgi:app) and calls it from one
+               event loop thread, as an ASGI server would.
+  server       python loadtest.py --url http://127.0.0.1:5000 --smtp-port 8025
+               drives a running server over HTTP. Start the server with
+               MAIL_SERVER=127.0.0.1 MAIL_PORT=8025 MAIL_USE_TLS=0 so its mail
+               reaches the sink.
+
+WSGI and ASGI side by side, many voters per worker thread:
+
+  python loadtest.py --preregister --voters 400 --concurrency 200 --server-threads 16 --output wsgi.json
+  python loadtest.py --preregister --asgi --voters 400 --concurrency 200 --compare wsgi.json
+
+In-process runs never touch the deployment's data: unless --database names
+one, the app gets a fresh SQLite database in a temporary directory (set as
+DATABASE_URL before the app is imported), and its session, OTP and
+rate-limit stores are moved there too. Candidates are seeded into it.
+
+Per-route p50/p95/p99 latency, throughput and error rate are printed and,
+with --output, written as JSON. --compare takes an earlier JSON result and
+prints the change per route.
+"""
+import argparse
+import asyncio
+import html
+import http.cookiejar
+import http.cookies
+import importlib
+import json
+import math
+import os
+import platform
+import re
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+OTP_RE = re.compile(rb"OTP for login is: (\d{6})")
+BALLOT_ACTION_RE = re.compile(r'action="([^"]*/ballot)"')
+BALLOT_CHOICE_RE = re.compile(r'type="radio" name="([^"]+)" value="(\d+)"')
+
+
+# ---------------------------------------------------------------------------
+# SMTP sink
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.sink.connected()
+        self.reply("220 loadtest sink")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.strip().upper()
+            if cmd.startswith((b"EHLO", b"HELO")):
+                self.reply("250 loadtest")
+            elif cmd.startswith(b"MAIL FROM"):
+                recipients = []
+                self.reply("250 OK")
+            elif cmd.startswith(b"RCPT TO"):
+                recipients.append(line.split(b":", 1)[1].strip().strip(b"<>").decode().lower())
+                self.reply("250 OK")
+            elif cmd == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                body = []
+                for data in iter(self.rfile.readline, b""):
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    body.append(data)
+                if self.server.sink.refuse():
+                    self.reply("451 Try again later")
+                else:
+                    self.server.sink.deliver(recipients, b"".join(body))
+                    self.reply("250 OK")
+            elif cmd in (b"RSET", b"NOOP"):
+                self.reply("250 OK")
+            elif cmd == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Minimal SMTP server that records the latest OTP sent to each address.
+
+    Also counts connections, and can refuse the next few messages with a
+    transient 451 (fail_next) to exercise the sender's retries.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = _SMTPServer((host, port), _SMTPHandler)
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self.messages = 0
+        self.connections = 0
+        self._failures = 0
+        self._otps = {}
+        self._cond = threading.Condition()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def connected(self):
+        with self._cond:
+            self.connections += 1
+
+    def fail_next(self, count=1):
+        with self._cond:
+            self._failures += count
+
+    def refuse(self):
+        with self._cond:
+            if self._failures:
+                self._failures -= 1
+                return True
+            return False
+
+    def deliver(self, recipients, body):
+        match = OTP_RE.search(body.replace(b"=\r\n", b""))
+        with self._cond:
+            self.messages += 1
+            if match:
+                for rcpt in recipients:
+                    self._otps[rcpt] = match.group(1).decode()
+            self._cond.notify_all()
+
+    def wait_for_otp(self, email, timeout=30):
+        email = email.lower()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while email not in self._otps:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._otps.pop(email)
+
+    def close(self):
+        self.server.shutdown()
+
+
+# ---------------------------------------------------------------------------
+# Clients
+
+class InProcessClient:
+
+    def __init__(self, app, remote_addr=None, slots=None):
+        self.client = app.test_client()
+        self.slots = slots
+        if remote_addr:
+            # one address per simulated voter, as in real traffic, so per-IP
+            # OTP rate limits see distinct clients
+            self.client.environ_base["REMOTE_ADDR"] = remote_addr
+
+    def request(self, method, path, data=None):
+        if self.slots is None:
+            resp = self.client.open(path, method=method, data=data)
+        else:
+            # a worker thread is busy from the first byte to the last
+            with self.slots:
+                resp = self.client.open(path, method=method, data=data)
+        return resp.status_code, resp.headers.get("Location", ""), resp.get_data(as_text=True)
+
+
+class ASGIRunner:
+    """An event loop on its own thread calling the ASGI app, standing in for the server."""
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="asgi-server", daemon=True).start()
+
+    def call(self, method, path, body, headers, client):
+        return asyncio.run_coroutine_threadsafe(self._call(method, path, body, headers, client), self.loop).result()
+
+    async def _call(self, method, path, body, headers, client):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": headers, "client": (client, 0), "server": ("loadtest", 80),
+        }
+        finished = asyncio.Event()
+        request = [{"type": "http.request", "body": body, "more_body": False}]
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def receive():
+            if request:
+                return request.pop()
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"], response["headers"] = message["status"], message["headers"]
+            else:
+                response["body"].append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return response["status"], response["headers"], b"".join(response["body"])
+
+
+class ASGIClient:
+
+    def __init__(self, runner, remote_addr="127.0.0.1"):
+        self.runner = runner
+        self.remote_addr = remote_addr
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else b""
+        headers = [(b"host", b"loadtest")]
+        if body:
+            headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+        if self.cookies:
+            headers.append((b"cookie", "; ".join(f"{k}={v}" for k, v in self.cookies.items()).encode()))
+        status, response_headers, payload = self.runner.call(method, path, body, headers, self.remote_addr)
+        location = ""
+        for name, value in response_headers:
+            if name == b"location":
+                location = value.decode("latin-1")
+            elif name == b"set-cookie":
+                for key, morsel in http.cookies.SimpleCookie(value.decode("latin-1")).items():
+                    if morsel["max-age"] == "0":
+                        self.cookies.pop(key, None)
+                    else:
+                        self.cookies[key] = morsel.value
+        return status, location, payload.decode("utf-8", "replace")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                return resp.status, resp.headers.get("Location", ""), resp.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as err:
+            return err.code, err.headers.get("Location", ""), err.read().decode("utf-8", "replace")
+
+
+# ---------------------------------------------------------------------------
+# Journey and statistics
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = {}  # route -> [(seconds, ok)]
+        self._lock = threading.Lock()
+
+    def timed(self, route, client, method, path, data=None, expect=None):
+        start = time.perf_counter()
+        try:
+            status, location, body = client.request(method, path, data)
+            ok = status < 400 and (expect is None or expect(status, location, body))
+        except Exception:
+            status, location, body, ok = 0, "", "", False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed, ok))
+        return ok, status, location, body
+
+    def fail(self, route, elapsed=0.0):
+        with self._lock:
+            self.samples.setdefault(route, []).append((elapsed, False))
+
+
+def _redirects_away_from(*fragments):
+    def check(status, location, body):
+        return status < 300 or not any(f in location for f in fragments)
+    return check
+
+
+def _voter(n, run_id):
+    voter_id = f"LT-{run_id}-{n}"
+    return voter_id, f"{voter_id.lower()}@loadtest.invalid"
+
+
+def run_voter(n, run_id, client, sink, recorder, vote_path=None, register=True):
+    voter_id, email = _voter(n, run_id)
+
+    if register:
+        recorder.timed("register", client, "POST", "/register", {
+            "name": f"Load Voter {n}", "email": email, "voter_id": voter_id, "password": "loadtest-pw",
+        }, expect=_redirects_away_from("register"))
+
+    ok, *_ = recorder.timed("get_otp", client, "POST", "/get_otp", {"voter_id": voter_id},
+                            expect=_redirects_away_from("register"))
+    if not ok:
+        return
+    waited = time.perf_counter()
+    otp = sink.wait_for_otp(email)
+    if otp is None:
+        recorder.fail("otp_delivery", time.perf_counter() - waited)
+        return
+
+    ok, *_ = recorder.timed("verify_otp", client, "POST", "/verify_otp", {"otp": otp, "voter_id": voter_id},
+                            expect=lambda s, loc, b: "dashboard" in loc)
+    if not ok:
+        return
+
+    ok, status, location, body = recorder.timed("dashboard", client, "GET", "/dashboard")
+    actions = BALLOT_ACTION_RE.findall(body) if ok else []
+    # one choice per race, spread across candidates
+    races = {}
+    for name, candidate_id in BALLOT_CHOICE_RE.findall(body) if ok else ():
+        races.setdefault(html.unescape(name), []).append(candidate_id)
+    ballot = {name: ids[n % len(ids)] for name, ids in races.items()}
+    path = vote_path or (urllib.parse.urlparse(html.unescape(actions[0])).path if actions and ballot else None)
+    if path:
+        recorder.timed("vote", client, "POST", path, ballot, expect=_redirects_away_from("login"))
+        recorder.timed("dashboard_after_vote", client, "GET", "/dashboard")
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank percentile
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(recorder, wall_seconds):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(s for s, _ in samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        routes[route] = {
+            "requests": len(samples),
+            "errors": errors,
+            "error_rate": round(errors / len(samples), 4),
+            "throughput_rps": round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+    return routes
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    print(f"{result['voters']} voters, concurrency {result['concurrency']}, "
+          f"{result['wall_seconds']:.2f}s wall, target {result['target']}")
+    header = f"{'route':<22}{'reqs':>7}{'err%':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    for route, r in result["routes"].items():
+        line = (f"{route:<22}{r['requests']:>7}{r['error_rate'] * 100:>6.1f}%{r['throughput_rps']:>9}"
+                f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}")
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old and old.get("p95_ms"):
+            change = (r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f"   p95 {change:+.1f}% vs baseline"
+        print(line)
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+
+def _load_app(spec, sink_port, database, scratch):
+    # mail and database settings are read when the app is created; set them first
+    os.environ["MAIL_SERVER"] = "127.0.0.1"
+    os.environ["MAIL_PORT"] = str(sink_port)
+    os.environ["MAIL_USE_TLS"] = "0"
+    os.environ["DATABASE_URL"] = database
+    os.environ.pop("READ_DATABASE_URL", None)
+    module_name, _, attr = spec.partition(":")
+    served = getattr(importlib.import_module(module_name), attr or "app")
+    # an ASGI wrapper carries the Flask app it serves
+    app = getattr(served, "flask_app", served)
+    app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=sink_port, MAIL_USE_TLS=False,
+                      MAIL_USE_SSL=False, MAIL_USERNAME=None, MAIL_PASSWORD=None)
+    from flask_mail import Mail
+    Mail().init_app(app)
+    # sessions, OTP codes and rate-limit buckets go to the scratch directory as well
+    import sessions
+    app.config.update(
+        SESSION_PATH=os.path.join(scratch, "sessions.db"),
+        OTP_STORE_PATH=os.path.join(scratch, "otp.db"),
+        RATE_LIMIT_PATH=os.path.join(scratch, "ratelimit.db"),
+    )
+    sessions.init_app(app)
+    return served, app
+
+
+def _seed_candidates(app, count):
+    import migrations
+    from models import db, Candidate
+    with app.app_context():
+        migrations.upgrade(db)
+        if Candidate.query.count() == 0:
+            for i in range(count):
+                position = ("President", "Governor")[i % 2]
+                db.session.add(Candidate(name=f"Candidate {i + 1}", party=f"Party {i % 3}", position=position))
+            db.session.commit()
+
+
+def _preregister(app, run_id, count):
+    from models import db, User
+    with app.app_context():
+        for n in range(count):
+            voter_id, email = _voter(n, run_id)
+            user = User(name=f"Load Voter {n}", email=email, voter_id=voter_id)
+            user.set_otp_only()
+            db.session.add(user)
+        db.session.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--voters", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--url", help="base URL of a running server (default: in-process)")
+    parser.add_argument("--app", help="module:attribute of the app for in-process runs (main:app, or asgi:app with --asgi)")
+    parser.add_argument("--asgi", action="store_true", help="in-process: call the ASGI app from one event loop")
+    parser.add_argument("--server-threads", type=int,
+                        help="in-process WSGI: requests admitted at once (default: one per client)")
+    parser.add_argument("--smtp-port", type=int, default=0, help="port for the SMTP sink (default: any free port)")
+    parser.add_argument("--preregister", action="store_true",
+                        help="in-process: create the voters in the database and skip /register, whose "
+                             "password hashing otherwise dominates the run")
+    parser.add_argument("--database",
+                        help="in-process: database URL to run against (default: a new temporary SQLite file); "
+                             "it is migrated and seeded")
+    parser.add_argument("--seed-candidates", type=int, default=5, help="in-process: candidates to create if none exist")
+    parser.add_argument("--output", help="write the JSON result here")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    args = parser.parse_args(argv)
+
+    sink = SMTPSink(port=args.smtp_port)
+    scratch = tempfile.TemporaryDirectory(prefix="loadtest-", ignore_cleanup_errors=True)
+    if args.url:
+        target = args.url
+        make_client = lambda: HTTPClient(args.url)
+    else:
+        spec = args.app or ("asgi:app" if args.asgi else "main:app")
+        database = args.database or f"sqlite:///{os.path.join(scratch.name, 'loadtest.db')}"
+        served, app = _load_app(spec, sink.port, database, scratch.name)
+        _seed_candidates(app, args.seed_candidates)
+        addresses = (f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}" for n in range(1, 1 << 24))
+        if args.asgi:
+            runner = ASGIRunner(served)
+            target = f"asgi:{spec}"
+            make_client = lambda: ASGIClient(runner, next(addresses))
+        else:
+            slots = threading.BoundedSemaphore(args.server_threads) if args.server_threads else None
+            target = f"in-process:{spec}" + (f" ({args.server_threads} threads)" if slots else "")
+            make_client = lambda: InProcessClient(app, next(addresses), slots)
+
+    run_id = uuid.uuid4().hex[:8]
+    preregister = args.preregister and not args.url
+    if preregister:
+        _preregister(app, run_id, args.voters)
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_voter, n, run_id, make_client(), sink, recorder, register=not preregister)
+            for n in range(args.voters)
+        ]
+        for f in futures:
+            f.result()
+    wall = time.perf_counter() - start
+    sink.close()
+    scratch.cleanup()
+
+    result = {
+        "run_id": run_id,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - wall)),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "target": target,
+        "voters": args.voters,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(wall, 3),
+        "journeys_per_second": round(args.voters / wall, 2) if wall else None,
+        "mail_messages": sink.messages,
+        "mail_connections": sink.connections,
+        "routes": summarize(recorder, wall),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from flask import current_app
+
+import job_status
+import metrics
+
+# Background OTP mail delivery.
+#
+# Requests call enqueue() and return immediately; a small pool of worker
+# threads owns long-lived SMTP connections (connect + STARTTLS + login happens
+# once per worker, not once per email) and retries failed sends with
+# exponential backoff. Each job gets a random id (uuid4 hex) whose delivery
+# status the request side can check with delivery_status().
+#
+# Statuses live in a store every worker process can read (job_status.py),
+# because the status poll may reach a different process from the one that
+# queued the mail: a mail_status table next to the OTP codes (OTP_STORE_PATH,
+# default instance/otp.db), or a per-process LRU when OTP_STORE_BACKEND is
+# "memory".
+# Ids are unguessable and never reused, so a job id the store does not know
+# reads as unknown, never as some other voter's mail.
+#
+# Config (all optional):
+#   MAIL_QUEUE_SIZE          max pending messages before enqueue() refuses (1000)
+#   MAIL_QUEUE_WORKERS       number of sender threads / SMTP connections (4)
+#   MAIL_QUEUE_MAX_RETRIES   attempts after the first failure (3)
+#   MAIL_QUEUE_BACKOFF       base backoff in seconds, doubled per retry (0.5)
+#   MAIL_QUEUE_IDLE_SECONDS  close an idle connection after this long (30)
+#   MAIL_STATUS_BACKEND      "sqlite" or "memory" (default: OTP_STORE_BACKEND)
+#
+# Point MAIL_SERVER/MAIL_PORT at a local stand-in (e.g. aiosmtpd's debugging
+# server) with MAIL_USE_TLS off to exercise the queue without a real relay.
+
+QUEUED = "queued"
+SENDING = "sending"
+RETRYING = "retrying"
+SENT = "sent"
+FAILED = "failed"
+
+STATUS_TTL_SECONDS = 900
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _status_store(app):
+    backend = app.config.get("MAIL_STATUS_BACKEND") or app.config.get("OTP_STORE_BACKEND", "sqlite")
+    return job_status.open_store(
+        app, "mail_status", backend, max_keys=2 * app.config.get("MAIL_QUEUE_SIZE", 1000), ttl=STATUS_TTL_SECONDS
+    )
+
+
+class MailQueue:
+
+    def __init__(self, app):
+        self.app = app
+        self.mail = app.extensions["mail"]  # Flask-Mail state, configured from app.config
+        self.max_retries = app.config.get("MAIL_QUEUE_MAX_RETRIES", 3)
+        self.backoff = app.config.get("MAIL_QUEUE_BACKOFF", 0.5)
+        self.idle_seconds = app.config.get("MAIL_QUEUE_IDLE_SECONDS", 30)
+        self._queue = queue.Queue(maxsize=app.config.get("MAIL_QUEUE_SIZE", 1000))
+        self._statuses = _status_store(app)
+        self._workers = []
+        self._stopping = threading.Event()
+        for i in range(app.config.get("MAIL_QUEUE_WORKERS", 4)):
+            t = threading.Thread(target=self._run, name=f"mail-queue-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def enqueue(self, msg):
+        """Queue ``msg`` for delivery and return its job id.
+
+        Raises QueueFull instead of blocking when the backlog is at capacity,
+        so a burst of logins cannot pin request threads on mail delivery.
+        """
+        if self._queue.full():
+            # shed without touching the status store
+            raise QueueFull()
+        job_id = uuid.uuid4().hex
+        self._set_status(job_id, QUEUED)
+        try:
+            self._queue.put_nowait((job_id, msg, 0))
+        except queue.Full:
+            self._set_status(job_id, FAILED)
+            raise QueueFull()
+        return job_id
+
+    def delivery_status(self, job_id):
+        """Status of ``job_id``, or None if no worker knows it (or it expired)."""
+        if not isinstance(job_id, str):
+            return None
+        return self._statuses.get(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def shutdown(self, timeout=5):
+        self._stopping.set()
+        for t in self._workers:
+            t.join(timeout)
+
+    def _set_status(self, job_id, status):
+        self._statuses.set(job_id, status)
+
+    def _run(self):
+        with self.app.app_context():
+            conn = None
+            while not self._stopping.is_set():
+                try:
+                    job_id, msg, attempt = self._queue.get(timeout=self.idle_seconds)
+                except queue.Empty:
+                    # let the server reclaim idle connections; reopen on demand
+                    conn = self._close(conn)
+                    continue
+
+                self._set_status(job_id, SENDING)
+                started = time.perf_counter()
+                try:
+                    if conn is None:
+                        conn = self.mail.connect()
+                        conn.__enter__()
+                    conn.send(msg)
+                    metrics.observe_mail(time.perf_counter() - started, True)
+                    self._set_status(job_id, SENT)
+                except (smtplib.SMTPException, OSError):
+                    metrics.observe_mail(time.perf_counter() - started, False)
+                    current_app.logger.warning("OTP mail delivery failed (job %s, attempt %s)", job_id, attempt + 1)
+                    conn = self._close(conn)
+                    self._retry(job_id, msg, attempt)
+                except Exception:
+                    current_app.logger.exception("OTP mail could not be built (job %s)", job_id)
+                    self._set_status(job_id, FAILED)
+                finally:
+                    self._queue.task_done()
+            self._close(conn)
+
+    def _retry(self, job_id, msg, attempt):
+        if attempt >= self.max_retries:
+            self._set_status(job_id, FAILED)
+            return
+        self._set_status(job_id, RETRYING)
+        delay = self.backoff * (2 ** attempt)
+
+        def requeue():
+            try:
+                self._queue.put_nowait((job_id, msg, attempt + 1))
+            except queue.Full:
+                self._set_status(job_id, FAILED)
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def _close(conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_mail_queue(app=None):
+    app = app or current_app._get_current_object()
+    with _queues_lock:
+        mq = _queues.get(id(app))
+        if mq is None:
+            mq = MailQueue(app)
+            _queues[id(app)] = mq
+    return mq
+
+
+def enqueue(msg):
+    return get_mail_queue().enqueue(msg)
+
+
+def delivery_status(job_id):
+    return get_mail_queue().delivery_status(job_id)
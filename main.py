@@ -1,13 +1,14 @@
-from app import app
+from app import create_app
 
-from authentication import auth_bp
-from logout import logout_bp
-from admin import admin_bp
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(logout_bp)
-app.register_blueprint(admin_bp)
+# WSGI entry point: ``gunicorn main:app`` / ``flask --app main run``.
+# Blueprints are registered inside create_app(); run ``flask --app main upgrade-db``
+# once per deploy instead of migrating on every worker boot.
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    import migrations
+    from models import db
 
+    with app.app_context():
+        migrations.upgrade(db)
+    app.run(debug=True)
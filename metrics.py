@@ -0,0 +1,223 @@
+import bisect
+import hashlib
+import threading
+import time
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request, SQL, mail and session-store instrumentation with a Prometheus text endpoint.
+#
+# Per request we record wall time, number of SQL statements and time spent in
+# them (via SQLAlchemy cursor events on every engine), keyed by Flask
+# endpoint, so the overlapping dashboard implementations show up separately
+# (voter.dashboard, auth.dashboard, admin.dashboard). If a request runs the same
+# SQL statement more than N_PLUS_ONE_THRESHOLD times it is counted and logged
+# as a likely N+1 pattern.
+#
+# Cost per request is a few dict updates under a lock, so it stays on in
+# production. Metrics are per process: with several workers, scrape each one
+# or aggregate downstream.
+#
+# Config: METRICS_ENABLED (True), N_PLUS_ONE_THRESHOLD (10)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for labels, series in items:
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by endpoint.", LATENCY_BUCKETS, ("endpoint", "method")
+)
+REQUESTS = Counter("http_requests_total", "Requests by endpoint and status.", ("endpoint", "method", "status"))
+SQL_PER_REQUEST = Histogram(
+    "sql_statements_per_request", "SQL statements issued per request.", QUERY_COUNT_BUCKETS, ("endpoint",)
+)
+SQL_TIME = Histogram(
+    "sql_time_per_request_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS, ("endpoint",)
+)
+N_PLUS_ONE = Counter(
+    "sql_n_plus_one_suspected_total",
+    "Requests that repeated one SQL statement more than the threshold.",
+    ("endpoint", "statement"),
+)
+MAIL_SEND = Histogram("mail_send_duration_seconds", "SMTP send time per message.", LATENCY_BUCKETS, ("outcome",))
+SESSION_IO = Histogram(
+    "session_store_duration_seconds", "Server-side session load/save time.", FAST_BUCKETS, ("operation",)
+)
+
+ALL = (REQUEST_LATENCY, REQUESTS, SQL_PER_REQUEST, SQL_TIME, N_PLUS_ONE, MAIL_SEND, SESSION_IO)
+
+
+class _RequestStats:
+    __slots__ = ("start", "status", "queries", "sql_seconds", "statements")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.status = None
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = {}
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return g.get("_metrics")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current()
+    starts = conn.info.get("_metrics_start")
+    if stats is None or not starts:
+        return
+    stats.sql_seconds += time.perf_counter() - starts.pop()
+    stats.queries += 1
+    stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+def observe_mail(seconds, ok):
+    MAIL_SEND.observe(("sent" if ok else "failed",), seconds)
+
+
+def observe_session(operation, seconds):
+    SESSION_IO.observe((operation,), seconds)
+
+
+def _before_request():
+    g._metrics = _RequestStats()
+
+
+def _after_request(response):
+    stats = g.get("_metrics")
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    # Recorded at teardown, which runs for every request: a view or hook that
+    # raised never reaches the after_request hooks (the exception propagates
+    # under TESTING / PROPAGATE_EXCEPTIONS), and still has to count as a 500.
+    stats = g.pop("_metrics", None)
+    if stats is None:
+        return
+    endpoint = request.endpoint or "unmatched"
+    if endpoint == "metrics":
+        return
+    status = 500 if exc is not None or stats.status is None else stats.status
+    REQUEST_LATENCY.observe((endpoint, request.method), time.perf_counter() - stats.start)
+    REQUESTS.inc((endpoint, request.method, str(status)))
+    SQL_PER_REQUEST.observe((endpoint,), stats.queries)
+    SQL_TIME.observe((endpoint,), stats.sql_seconds)
+
+    threshold = _threshold
+    for statement, count in stats.statements.items():
+        if count > threshold:
+            digest = hashlib.sha1(statement.encode("utf-8")).hexdigest()[:12]
+            N_PLUS_ONE.inc((endpoint, digest))
+            _logger.warning(
+                "Possible N+1 in %s: statement %s ran %d times: %s",
+                endpoint, digest, count, " ".join(statement.split())[:200],
+            )
+
+
+def render():
+    lines = []
+    for metric in ALL:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+_threshold = 10
+_logger = None
+
+
+def init_app(app):
+    global _threshold, _logger
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    _threshold = app.config.get("N_PLUS_ONE_THRESHOLD", 10)
+    _logger = app.logger
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
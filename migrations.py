@@ -0,0 +1,135 @@
+from sqlalchemy import inspect, text
+
+# Versioned schema migrations.
+#
+# The database records the schema version it is at in a one-row
+# ``schema_version`` table; upgrade() applies every migration above that
+# number, in order, each in its own transaction. Migrations must be
+# idempotent (CREATE ... IF NOT EXISTS, column checks) because databases
+# created before versioning start at version 0 with some of the schema
+# already present, and several workers may race to upgrade at boot.
+#
+# To change the schema, append a new (version, description, function) entry
+# to MIGRATIONS. Never edit or reorder an entry that has shipped.
+
+
+def _initial_tables(conn, db):
+    db.metadata.create_all(conn, checkfirst=True)
+
+
+def _vote_ledger_indexes(conn, db):
+    duplicate = conn.execute(
+        text("SELECT voter_id FROM vote GROUP BY voter_id HAVING count(*) > 1 LIMIT 1")
+    ).first()
+    if duplicate:
+        raise RuntimeError(
+            f"Cannot add one-vote-per-voter constraint: user {duplicate[0]} has several Vote rows"
+        )
+    # one ballot per voter, enforced by the database
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_vote_voter_id ON vote (voter_id)"))
+    # per-candidate tallies: the group-by is answered from the index alone
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_vote_candidate_id ON vote (candidate_id, id)"))
+    # turnout over time
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_vote_timestamp ON vote (timestamp)"))
+    # voted / not-voted counts on User
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_has_voted ON "user" (has_voted)'))
+
+
+def _catalogue_version(conn, db):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS catalogue_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+    ))
+    conn.execute(text(
+        "INSERT INTO catalogue_version (id, version) SELECT 1, 0"
+        " WHERE NOT EXISTS (SELECT 1 FROM catalogue_version WHERE id = 1)"
+    ))
+
+
+def _per_position_ballots(conn, db):
+    if not has_column(conn, "vote", "position"):
+        conn.execute(text("ALTER TABLE vote ADD COLUMN position VARCHAR(200) NOT NULL DEFAULT ''"))
+    conn.execute(text(
+        "UPDATE vote SET position = (SELECT c.position FROM candidate c WHERE c.id = vote.candidate_id)"
+        " WHERE position = '' AND EXISTS (SELECT 1 FROM candidate c WHERE c.id = vote.candidate_id)"
+    ))
+    # one ballot per voter and race, instead of one ballot per voter
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_vote_voter_position ON vote (voter_id, position)"))
+    conn.execute(text("DROP INDEX IF EXISTS uq_vote_voter_id"))
+
+
+def _turnout_rollups(conn, db):
+    import turnout
+    db.metadata.tables["turnout_bucket"].create(conn, checkfirst=True)
+    # count the votes already in the ledger
+    turnout.backfill(conn)
+
+
+def _ledger_tree(conn, db):
+    import ledger
+    db.metadata.tables["ledger_node"].create(conn, checkfirst=True)
+    # commit to the votes already in the ledger
+    ledger.build(conn)
+
+
+def _candidate_vote_counter(conn, db):
+    # create_all() in migration 1 never adds columns to a table that already
+    # exists, so databases from before versioning lack the maintained tally
+    if has_column(conn, "candidate", "votes"):
+        return
+    conn.execute(text("ALTER TABLE candidate ADD COLUMN votes INTEGER NOT NULL DEFAULT 0"))
+    # count the ledger, less anything already sitting on tally shards
+    conn.execute(text(
+        "UPDATE candidate SET votes ="
+        " (SELECT count(*) FROM vote v WHERE v.candidate_id = candidate.id)"
+        " - (SELECT coalesce(sum(s.votes), 0) FROM tally_shard s WHERE s.candidate_id = candidate.id)"
+    ))
+
+
+MIGRATIONS = [
+    (1, "initial tables", _initial_tables),
+    (2, "vote ledger indexes and one-vote-per-voter constraint", _vote_ledger_indexes),
+    (3, "candidate catalogue version row", _catalogue_version),
+    (4, "one vote per voter per position", _per_position_ballots),
+    (5, "turnout rollup buckets", _turnout_rollups),
+    (6, "Merkle tree over the vote ledger", _ledger_tree),
+    (7, "vote counter column on candidates from before versioning", _candidate_vote_counter),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def has_column(conn, table, column):
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def current_version(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    row = conn.execute(text("SELECT version FROM schema_version")).first()
+    if row is None:
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (0)"))
+        return 0
+    return row[0]
+
+
+def upgrade(db, target=None):
+    """Bring the database behind ``db`` up to ``target`` (default: latest)."""
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version > target:
+            break
+        with db.engine.begin() as conn:
+            # re-read inside the transaction: another worker may have got here first
+            if current_version(conn) >= version:
+                continue
+            migrate(conn, db)
+            conn.execute(
+                text("UPDATE schema_version SET version = :v WHERE version < :v"), {"v": version}
+            )
+        applied.append((version, description))
+    return applied
+
+
+def status(db):
+    with db.engine.begin() as conn:
+        return current_version(conn), LATEST_VERSION
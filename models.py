@@ -1,28 +1,109 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+import credentials
 
+# Extension is created unbound; app.create_app() calls db.init_app(app)
 db = SQLAlchemy()
 
+# database models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     email = db.Column(db.String(200), unique=True, nullable=False)
     voter_id = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
-    has_voted = db.Column(db.Boolean, default=False)
+    # turnout flag: set with the voter's first ballot. Which races they have
+    # voted in is the Vote ledger itself (one row per voter and position).
+    has_voted = db.Column(db.Boolean, default=False, index=True)
+
+    def set_password(self, raw_password):
+        self.password = credentials.hash_password(raw_password)
+
+    def set_otp_only(self):
+        # OTP-login accounts keep no password hash at all
+        self.password = credentials.OTP_ONLY
+
+    def check_password(self, raw_password):
+        return credentials.check_password(self.password, raw_password)
+
+    def __repr__(self):
+        return f"<User {self.email}>"
 
 class Candidate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     party = db.Column(db.String(200), nullable=False)
     position = db.Column(db.String(200), nullable=False)
+    votes = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<Candidate {self.name}>"
 
 class Vote(db.Model):
+    # indexes are created by migrations.py; declared here so create_all matches
+    __table_args__ = (
+        db.Index("uq_vote_voter_position", "voter_id", "position", unique=True),
+        db.Index("ix_vote_candidate_id", "candidate_id", "id"),
+        db.Index("ix_vote_timestamp", "timestamp"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    voter_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    candidate_id = db.Column(db.Integer, db.ForeignKey("candidate.id"), nullable=False)
+    # the candidate's position when the vote was cast; one vote per voter per position
+    position = db.Column(db.String(200), nullable=False, default="")
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Vote user={self.voter_id} cand={self.candidate_id} at={self.timestamp}>"
+
+class TallyShard(db.Model):
+    # Sharded vote counters, merged into Candidate.votes on read (see tally.py)
+    candidate_id = db.Column(db.Integer, db.ForeignKey("candidate.id"), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    votes = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<TallyShard cand={self.candidate_id} shard={self.shard} votes={self.votes}>"
+
+class TurnoutBucket(db.Model):
+    # Votes per minute/hour, overall and per position/candidate (see turnout.py)
+    resolution = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    scope = db.Column(db.String(210), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    votes = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<TurnoutBucket {self.resolution}s {self.scope or 'all'} @{self.bucket}: {self.votes}>"
+
+class LedgerNode(db.Model):
+    # Merkle tree over the vote ledger: leaves at level 0 (see ledger.py)
+    level = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    idx = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    hash = db.Column(db.LargeBinary(32), nullable=False)
+    vote_id = db.Column(db.Integer, db.ForeignKey("vote.id"), unique=True)
+
+    def __repr__(self):
+        return f"<LedgerNode {self.level}/{self.idx} {self.hash.hex()[:12]}>"
+
+class CatalogueVersion(db.Model):
+    # Single row, bumped whenever candidates are added or removed (see catalogue.py)
     id = db.Column(db.Integer, primary_key=True)
-    voter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    candidate_id = db.Column(db.Integer, db.ForeignKey('candidate.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<CatalogueVersion {self.version}>"
 
 class Admin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(255), unique=True, nullable=False)
-    password = db.Column(db.String(200), nullable=False)
\ No newline at end of file
+    password = db.Column(db.String(200), nullable=False)
+
+    def set_password(self, raw_password):
+        self.password = credentials.hash_password(raw_password)
+
+    def check_password(self, raw_password):
+        return credentials.check_password(self.password, raw_password)
+
+    def __repr__(self):
+        return f"<Admin {self.username}>"
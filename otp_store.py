@@ -0,0 +1,191 @@
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app
+
+# Pluggable OTP storage.
+#
+# Codes are keyed by the voter they were issued to, so checking a submitted
+# code is a single lookup instead of a scan over every pending OTP. Expiry is
+# driven by an ordered structure (a min-heap in memory, an index on the expiry
+# column in SQLite) so purging only touches entries that actually expired.
+#
+# Every wrong guess against a voter's code is counted, and the code is
+# dropped after OTP_MAX_MISSES (5) of them, so a 6-digit code cannot be
+# brute-forced within its lifetime; the voter has to request a new one.
+#
+# Select the backend with OTP_STORE_BACKEND = "sqlite" (default, shared by all
+# worker processes on the host) or "memory" (single process, e.g. for tests).
+
+OTP_TTL_SECONDS = 300  # 5 minutes
+OTP_MAX_MISSES = 5
+
+
+class MemoryOTPStore:
+    """Per-process store: dict for lookups, min-heap of expiries for eviction."""
+
+    def __init__(self):
+        self._codes = {}  # key -> [otp, expiry, misses]
+        self._expiries = []  # heap of (expiry, key)
+        self._lock = threading.Lock()
+
+    def put(self, key, otp, ttl=OTP_TTL_SECONDS):
+        expiry = time.time() + ttl
+        with self._lock:
+            self._codes[key] = [otp, expiry, 0]
+            heapq.heappush(self._expiries, (expiry, key))
+            self._purge(time.time())
+        return expiry
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            entry = self._codes.get(key)
+        if entry is None or entry[1] < now:
+            return None
+        return entry[0], entry[1]
+
+    def verify(self, key, otp, max_misses=OTP_MAX_MISSES):
+        """Consume the code for ``key`` if it matches and has not expired.
+
+        A wrong ``otp`` counts as a miss; the code is dropped at ``max_misses``.
+        """
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            entry = self._codes.get(key)
+            if entry is None or entry[1] < now:
+                return False
+            if entry[0] != otp:
+                entry[2] += 1
+                if entry[2] >= max_misses:
+                    del self._codes[key]
+                return False
+            del self._codes[key]
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._codes.pop(key, None)
+
+    def purge_expired(self):
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now):
+        removed = 0
+        while self._expiries and self._expiries[0][0] < now:
+            expiry, key = heapq.heappop(self._expiries)
+            entry = self._codes.get(key)
+            # heap entries for re-issued codes are stale; only drop the live one
+            if entry is not None and entry[1] == expiry:
+                del self._codes[key]
+                removed += 1
+        return removed
+
+
+class SQLiteOTPStore:
+    """Store shared across worker processes through a small SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # schema on a throwaway connection: the app may be built before workers fork
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS otp_codes ("
+                " key TEXT PRIMARY KEY, otp TEXT NOT NULL, expiry REAL NOT NULL,"
+                " misses INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(otp_codes)")}
+            if "misses" not in columns:
+                # otp.db files from before the miss counter
+                conn.execute("ALTER TABLE otp_codes ADD COLUMN misses INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_otp_codes_expiry ON otp_codes (expiry)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        # per thread and per process: a forked worker never reuses its parent's handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def put(self, key, otp, ttl=OTP_TTL_SECONDS):
+        now = time.time()
+        expiry = now + ttl
+        conn = self._conn()
+        conn.execute("DELETE FROM otp_codes WHERE expiry < ?", (now,))
+        conn.execute(
+            "INSERT OR REPLACE INTO otp_codes (key, otp, expiry, misses) VALUES (?, ?, ?, 0)",
+            (str(key), otp, expiry),
+        )
+        return expiry
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT otp, expiry FROM otp_codes WHERE key = ? AND expiry >= ?",
+            (str(key), time.time()),
+        ).fetchone()
+        return row
+
+    def verify(self, key, otp, max_misses=OTP_MAX_MISSES):
+        """Consume the code for ``key`` if it matches and has not expired.
+
+        A wrong ``otp`` counts as a miss; the code is dropped at ``max_misses``.
+        """
+        # A single conditional DELETE makes check-and-consume atomic across
+        # processes: only one request can ever redeem a given code.
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM otp_codes WHERE key = ? AND otp = ? AND expiry >= ? AND misses < ?",
+            (str(key), otp, time.time(), max_misses),
+        )
+        if cur.rowcount == 1:
+            return True
+        # the increment is atomic too, so parallel guesses cannot exceed the limit
+        conn.execute("UPDATE otp_codes SET misses = misses + 1 WHERE key = ?", (str(key),))
+        conn.execute("DELETE FROM otp_codes WHERE key = ? AND misses >= ?", (str(key), max_misses))
+        return False
+
+    def discard(self, key):
+        self._conn().execute("DELETE FROM otp_codes WHERE key = ?", (str(key),))
+
+    def purge_expired(self):
+        cur = self._conn().execute("DELETE FROM otp_codes WHERE expiry < ?", (time.time(),))
+        return cur.rowcount
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_otp_store(app=None):
+    """Return the OTP store configured for ``app`` (default: current app)."""
+    app = app or current_app._get_current_object()
+    backend = app.config.get("OTP_STORE_BACKEND", "sqlite")
+    with _stores_lock:
+        store = _stores.get((id(app), backend))
+        if store is None:
+            if backend == "memory":
+                store = MemoryOTPStore()
+            elif backend == "sqlite":
+                path = app.config.get("OTP_STORE_PATH") or os.path.join(app.instance_path, "otp.db")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                store = SQLiteOTPStore(path)
+            else:
+                raise ValueError(f"Unknown OTP_STORE_BACKEND: {backend!r}")
+            _stores[(id(app), backend)] = store
+    return store
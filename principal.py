@@ -0,0 +1,93 @@
+import time
+from flask import current_app, session
+
+from models import User, Vote
+from database import read_session
+
+# The logged-in voter, cached in their session.
+#
+# Voter pages only need the voter's id, name, turnout flag (has_voted) and
+# the positions they have voted in - not the ORM row with its password hash.
+# Those are read with one query (the user left-joined to their votes) and
+# kept in the session as a plain list for VOTER_PRINCIPAL_TTL seconds (30),
+# so repeat page views need no user or vote query. The session is
+# server-side and shared by every worker (sessions.py), so a copy dropped
+# in one request is gone for all of them.
+#
+# The vote paths call invalidate() once the ballot box has answered a
+# ballot - recorded, or refused because a race was already voted in - so the
+# next page reloads the voted state. The TTL bounds what an out-of-band
+# change (another login of the same voter, an admin edit) can leave stale.
+# The cached state is only ever used to draw pages: whether a race is still
+# open to a ballot is decided by the ballot box, from the Vote table, at
+# commit time.
+#
+# VOTER_PRINCIPAL_TTL = 0 turns the cache off (every view queries).
+
+_KEY = "_voter"
+
+
+class VoterPrincipal:
+    """What views know about the logged-in voter."""
+
+    __slots__ = ("id", "name", "has_voted", "voted")
+
+    def __init__(self, id, name, has_voted, voted):
+        self.id = id
+        self.name = name
+        self.has_voted = bool(has_voted)
+        self.voted = frozenset(voted)  # positions voted in
+
+    def __repr__(self):
+        return f"<VoterPrincipal {self.id}>"
+
+
+def from_rows(rows):
+    """Principal from (id, name, has_voted, position) rows of a user joined to their votes; None if empty."""
+    if not rows:
+        return None
+    user_id, name, has_voted, _ = rows[0]
+    return VoterPrincipal(user_id, name, has_voted, {row[3] for row in rows if row[3] is not None})
+
+
+def load(user_id):
+    """Read the principal for ``user_id`` from the database; None if there is no such user."""
+    rows = (
+        read_session()
+        .query(User.id, User.name, User.has_voted, Vote.position)
+        .outerjoin(Vote, Vote.voter_id == User.id)
+        .filter(User.id == user_id)
+        .all()
+    )
+    return from_rows(rows)
+
+
+def _ttl():
+    return current_app.config.get("VOTER_PRINCIPAL_TTL", 30)
+
+
+def cached(user_id):
+    """The session's principal if it is for ``user_id`` and younger than the TTL, else None."""
+    entry = session.get(_KEY)
+    if not entry or entry[0] != user_id or time.time() - entry[4] >= _ttl():
+        return None
+    return VoterPrincipal(*entry[:4])
+
+
+def keep(found):
+    """Cache a freshly loaded principal (or forget the old one if ``found`` is None); returns ``found``."""
+    if found is None or _ttl() <= 0:
+        session.pop(_KEY, None)
+    else:
+        session[_KEY] = [found.id, found.name, found.has_voted, sorted(found.voted), time.time()]
+    return found
+
+
+def get(user_id):
+    """The principal for ``user_id``: from the session within the TTL, else one query. None if no such user."""
+    return cached(user_id) or keep(load(user_id))
+
+
+def invalidate():
+    """Drop the cached principal, e.g. after a ballot changed the voter's voted state."""
+    session.pop(_KEY, None)
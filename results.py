@@ -0,0 +1,52 @@
+import threading
+from collections import namedtuple
+
+from models import db, Candidate, Vote, CatalogueVersion
+from database import read_session
+import tally
+
+# Election results snapshot.
+#
+# Tallies are maintained incrementally as votes commit (see tally.py), so the
+# results are read from the candidate counters rather than by counting the
+# Vote ledger. The snapshot carries a version built from two index lookups
+# (highest Vote id and the candidate catalogue version): it changes
+# whenever a vote commits or the candidate list changes, and lets callers
+# answer conditional requests without touching the tallies at all.
+
+ResultsSnapshot = namedtuple("ResultsSnapshot", "version rows")
+# rows: list of (candidate_id, name, position, votes), ordered by candidate id
+
+_lock = threading.Lock()
+_cached = None
+
+
+def results_version():
+    last_vote, catalogue = read_session().query(
+        db.select(db.func.max(Vote.id)).scalar_subquery(),
+        CatalogueVersion.version,
+    ).filter(CatalogueVersion.id == 1).one()
+    return f"{last_vote or 0}.{catalogue}"
+
+
+def snapshot(version=None):
+    """Return the current ResultsSnapshot, rebuilding it only if the version moved."""
+    global _cached
+    version = version or results_version()
+    cached = _cached
+    if cached is not None and cached.version == version:
+        return cached
+
+    totals = tally.candidate_totals(read_session())
+    rows = [
+        (c.id, c.name, c.position, totals.get(c.id, 0))
+        for c in read_session().query(Candidate.id, Candidate.name, Candidate.position).order_by(Candidate.id)
+    ]
+    snap = ResultsSnapshot(version, rows)
+    with _lock:
+        _cached = snap
+    return snap
+
+
+def etag(version):
+    return f"results-{version}"
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import queue
+import threading
+from flask import current_app
+
+import results
+
+# Server-Sent Events fan-out for live results.
+#
+# One producer thread per process watches results.results_version() and, when
+# it moves, builds a delta against the previous snapshot and hands it to every
+# subscriber. Dashboards therefore cost one cheap version check per interval
+# per process, not one aggregate query per poll per client.
+#
+# Each subscriber has a small bounded queue. A client that falls behind does
+# not grow it: its backlog is dropped and it is sent a full snapshot instead,
+# which supersedes all the deltas it missed.
+#
+# event_stream() waits on that queue from a WSGI worker thread.
+# async_event_stream() is the event-loop version used by the ASGI server
+# (async_voter.py): the producer wakes its coroutine through the loop, so a
+# connected dashboard holds no thread at all.
+#
+# Under WSGI every connected dashboard holds a worker thread for as long as
+# it stays open, so subscribers per process are capped: past
+# RESULTS_STREAM_MAX_SUBSCRIBERS, subscribe() raises StreamFull and the view
+# answers 503 with Retry-After (busy_response()) instead of taking a thread.
+#
+# Config (optional):
+#   RESULTS_STREAM_INTERVAL          seconds between version checks / coalescing window (1.0)
+#   RESULTS_STREAM_QUEUE             max pending events per subscriber (16)
+#   RESULTS_STREAM_KEEPALIVE         seconds between keep-alive comments (15)
+#   RESULTS_STREAM_MAX_SUBSCRIBERS   concurrent subscribers per process (8)
+
+_RESYNC = object()
+RETRY_AFTER_SECONDS = 10
+
+
+class StreamFull(Exception):
+    pass
+
+
+class Subscription:
+
+    def __init__(self, maxsize, version, loop=None):
+        self.events = queue.Queue(maxsize=maxsize)
+        self.version = version  # version of the last state queued for this client
+        # set for subscribers on an event loop; the producer wakes them through it
+        self.loop = loop
+        self.ready = asyncio.Event() if loop is not None else None
+
+    def offer(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # slow client: throw away what it has not read and resend the whole state
+            while True:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    break
+            self.events.put_nowait(_RESYNC)
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError:
+                pass  # loop already closed; the subscriber is gone
+
+
+class ResultsBroadcaster:
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get("RESULTS_STREAM_INTERVAL", 1.0)
+        self.queue_size = app.config.get("RESULTS_STREAM_QUEUE", 16)
+        self.keepalive = app.config.get("RESULTS_STREAM_KEEPALIVE", 15)
+        self.max_subscribers = app.config.get("RESULTS_STREAM_MAX_SUBSCRIBERS", 8)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._current = None
+        self._thread = threading.Thread(target=self._run, name="results-stream", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, version, loop=None):
+        """Register a subscriber; raises StreamFull at RESULTS_STREAM_MAX_SUBSCRIBERS."""
+        sub = Subscription(self.queue_size, version, loop)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise StreamFull()
+            self._subscribers.add(sub)
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def notify(self):
+        """Hint that a vote just committed in this process; check immediately."""
+        self._wake.set()
+
+    def current(self):
+        return self._current
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                idle = not self._subscribers
+            if idle:
+                continue
+            try:
+                with self.app.app_context():
+                    snap = results.snapshot()
+            except Exception:
+                self.app.logger.exception("Results stream poll failed")
+                continue
+            previous, self._current = self._current, snap
+            if previous is not None and previous.version == snap.version:
+                continue
+            event = ("delta", snap.version, _delta(previous, snap)) if previous else None
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for sub in subscribers:
+                if sub.version == snap.version:
+                    continue
+                # a delta only applies on top of the state it was computed from
+                sub.offer(event if event and sub.version == previous.version else _RESYNC)
+                sub.version = snap.version
+
+
+def _snapshot_payload(snap):
+    return {
+        "version": snap.version,
+        "labels": [row[1] for row in snap.rows],
+        "values": [row[3] for row in snap.rows],
+        "ids": [row[0] for row in snap.rows],
+    }
+
+
+def _delta(previous, snap):
+    before = {row[0]: row for row in previous.rows}
+    changed = {
+        str(row[0]): {"name": row[1], "votes": row[3]}
+        for row in snap.rows
+        if before.get(row[0]) != row
+    }
+    current_ids = {row[0] for row in snap.rows}
+    removed = [cid for cid in before if cid not in current_ids]
+    return {"version": snap.version, "changed": changed, "removed": removed}
+
+
+def _format(event, version, payload):
+    return f"event: {event}\nid: {version}\ndata: {json.dumps(payload)}\n\n"
+
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def get_broadcaster(app=None):
+    app = app or current_app._get_current_object()
+    with _broadcasters_lock:
+        b = _broadcasters.get(id(app))
+        if b is None:
+            b = ResultsBroadcaster(app)
+            _broadcasters[id(app)] = b
+    return b
+
+
+def notify():
+    b = _broadcasters.get(id(current_app._get_current_object()))
+    if b is not None:
+        b.notify()
+
+
+def _frame(broadcaster, item, initial):
+    if item is _RESYNC:
+        snap = broadcaster.current() or initial
+        return _format("snapshot", snap.version, _snapshot_payload(snap))
+    return _format(*item)
+
+
+class EventStream:
+    """SSE frames for one subscriber: ``initial`` snapshot first, then deltas as they arrive.
+
+    The subscription is taken when the stream is created, so a full
+    broadcaster is reported before any response starts; close() releases it,
+    whether or not the frames were ever read.
+    """
+
+    def __init__(self, broadcaster, sub, initial):
+        self.broadcaster = broadcaster
+        self.sub = sub
+        self.initial = initial
+
+    def __iter__(self):
+        yield "retry: 3000\n\n"
+        yield _format("snapshot", self.initial.version, _snapshot_payload(self.initial))
+        while True:
+            try:
+                item = self.sub.events.get(timeout=self.broadcaster.keepalive)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield _frame(self.broadcaster, item, self.initial)
+
+    def close(self):
+        self.broadcaster.unsubscribe(self.sub)
+
+
+class AsyncEventStream(EventStream):
+    """EventStream for the event loop: the producer wakes it, it never waits on a thread."""
+
+    async def __aiter__(self):
+        sub = self.sub
+        yield "retry: 3000\n\n"
+        yield _format("snapshot", self.initial.version, _snapshot_payload(self.initial))
+        while True:
+            try:
+                item = sub.events.get_nowait()
+            except queue.Empty:
+                try:
+                    await asyncio.wait_for(sub.ready.wait(), self.broadcaster.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                sub.ready.clear()
+                continue
+            yield _frame(self.broadcaster, item, self.initial)
+
+    async def aclose(self):
+        self.close()
+
+
+def event_stream(initial):
+    """EventStream for a WSGI view; raises StreamFull if the process is at its cap."""
+    broadcaster = get_broadcaster()
+    return EventStream(broadcaster, broadcaster.subscribe(initial.version), initial)
+
+
+def async_event_stream(initial):
+    """AsyncEventStream for a coroutine view; raises StreamFull if the process is at its cap."""
+    broadcaster = get_broadcaster()
+    return AsyncEventStream(broadcaster, broadcaster.subscribe(initial.version, asyncio.get_running_loop()), initial)
+
+
+def busy_response():
+    """503 for a dashboard that arrives while the process is at its subscriber cap."""
+    return (
+        "Too many live result viewers. Please try again shortly.",
+        503,
+        {"Retry-After": str(RETRY_AFTER_SECONDS), "Content-Type": "text/plain; charset=utf-8"},
+    )
@@ -1,16 +1,22 @@
 import secrets
-import time
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
 from flask_mail import Message
-from app import app, db, bcrypt, User, Candidate, mail
-
-# OTP storage: voter_id -> {"otp": str, "expiry": timestamp}
-otp_storage = {}
-OTP_TTL_SECONDS = 300  # 5 minutes
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+import fragments
+from otp_store import get_otp_store, OTP_TTL_SECONDS
+import mail_queue
+import admission
+import sessions
+import voter_filter
+import principal
+
+# Voter-facing pages, mounted at the site root by app.register_routes()
+voter_bp = Blueprint('voter', __name__)
 
 # Registration route
-@app.route('/register', methods=['GET', 'POST'])
+@voter_bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == "POST":
         name = request.form.get('name', '').strip()
@@ -20,56 +26,72 @@ def register():
 
         if not (name and email and voter_id and password):
             flash("All fields are required.", 'warning')
-            return redirect(url_for('register'))
+            return redirect(url_for('voter.register'))
 
-        existing_user = User.query.filter((User.email == email) | (User.voter_id == voter_id)).first()
-        if existing_user:
+        # the in-memory filter rules out most new voters without a query
+        if voter_filter.taken(voter_id=voter_id, email=email):
             flash("User already exists. Please login.", 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('voter.login'))
 
-        # Prefer model helper if available
         new_user = User(name=name, email=email, voter_id=voter_id)
-        if hasattr(new_user, "set_password"):
-            new_user.set_password(password)
-        else:
-            hashed_pass = bcrypt.generate_password_hash(password).decode('utf-8')
-            new_user.password = hashed_pass
+        new_user.set_password(password)
 
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # registered by another worker since the check; the unique columns decide
+            db.session.rollback()
+            flash("User already exists. Please login.", 'warning')
+            return redirect(url_for('voter.login'))
+        voter_filter.remember(voter_id, email)
 
         flash("Registered successfully!", 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('voter.login'))
 
     return render_template('register.html')
 
 
-@app.route('/', methods=['GET'])
-@app.route('/login', methods=['GET'])
+@voter_bp.route('/', methods=['GET'])
+@voter_bp.route('/login', methods=['GET'])
 def login():
     # login page shows form that posts to /get_otp or /verify_otp depending on your UI
     return render_template('login.html')
 
 
-@app.route('/get_otp', methods=['POST'])
+@voter_bp.route('/get_otp', methods=['POST'])
 def get_otp():
     voter_id = request.form.get('voter_id', '').strip()
     if not voter_id:
         flash("Please provide your Voter ID.", "warning")
-        return redirect(url_for('login'))
+        return redirect(url_for('voter.login'))
+
+    # Rate limits and in-flight cap are checked before any lookup or email
+    with admission.OTPAdmission(voter_id) as gate:
+        if gate.rejection:
+            return gate.rejection
+        return _issue_otp(voter_id)
 
+
+def _issue_otp(voter_id):
     user = User.query.filter_by(voter_id=voter_id).first()
     if not user:
         flash("Voter ID not found. Please register first.", "danger")
-        return redirect(url_for('register'))
+        return redirect(url_for('voter.register'))
+    return send_otp(user)
+
 
+def send_otp(user):
+    """Store a fresh code for ``user`` and queue the email; never waits on SMTP."""
+    voter_id = user.voter_id
     # Generate 6-digit OTP
     otp = f"{secrets.randbelow(900000) + 100000}"
-    expiry = time.time() + OTP_TTL_SECONDS
-    otp_storage[voter_id] = {"otp": otp, "expiry": expiry}
+    get_otp_store().put(voter_id, otp, OTP_TTL_SECONDS)
+    # remember who asked so verify_otp can look the code up directly
+    session['otp_voter_id'] = voter_id
 
     # Send email using Flask-Mail (uses app.config MAIL_* settings)
-    sender = app.config.get("MAIL_USERNAME") or app.config.get("MAIL_DEFAULT_SENDER") or "noreply@example.com"
+    sender = current_app.config.get("MAIL_USERNAME") or current_app.config.get("MAIL_DEFAULT_SENDER") or "noreply@example.com"
     msg = Message(
         subject="Your Voting System OTP",
         sender=sender,
@@ -77,78 +99,87 @@ def get_otp():
         body=f"Dear {user.name},\n\nYour OTP for login is: {otp}\nThis code is valid for {OTP_TTL_SECONDS//60} minutes.\n\nDo not share it with anyone."
     )
 
+    # Delivery happens on the background mail queue; the request does not wait on SMTP
     try:
-        mail.send(msg)
+        session['otp_mail_job'] = mail_queue.enqueue(msg)
         flash("OTP has been sent to your registered email.", "success")
-    except Exception:
-        # Do not leak exception detail to users
-        current_app.logger.exception("Failed sending OTP email")
-        flash("Error sending OTP email. Contact administrator.", "danger")
+    except mail_queue.QueueFull:
+        # shed load: the code could not be sent, so do not leave it redeemable
+        current_app.logger.warning("OTP mail queue full, rejecting request for %s", voter_id)
+        get_otp_store().discard(voter_id)
+        session.pop('otp_voter_id', None)
+        return admission.too_many_requests(30)
+
+    return redirect(url_for('voter.login', otp_sent='true'))
 
-    return redirect(url_for('login', otp_sent='true'))
 
+@voter_bp.route('/otp_status', methods=['GET'])
+def otp_status():
+    # Delivery state of the last OTP email queued for this session
+    job_id = session.get('otp_mail_job')
+    status = mail_queue.delivery_status(job_id) if job_id else None
+    return jsonify({'status': status or 'unknown'})
 
-@app.route('/verify_otp', methods=['POST'])
+
+@voter_bp.route('/verify_otp', methods=['POST'])
 def verify_otp():
     otp_entered = request.form.get('otp', '').strip()
     if not otp_entered:
         flash("Please enter the OTP.", "warning")
-        return redirect(url_for('login'))
-
-    # Clean expired otps and find match
-    now = time.time()
-    matched_voter_id = None
-    expired_keys = []
-    for v_id, data in list(otp_storage.items()):
-        if data.get("expiry", 0) < now:
-            expired_keys.append(v_id)
-            continue
-        if data.get("otp") == otp_entered:
-            matched_voter_id = v_id
-            break
-
-    for k in expired_keys:
-        otp_storage.pop(k, None)
-
-    if not matched_voter_id:
-        flash("Invalid or expired OTP. Please try again.", "danger")
-        return redirect(url_for('login'))
-
-    user = User.query.filter_by(voter_id=matched_voter_id).first()
+        return redirect(url_for('voter.login'))
+
+    # only the voter this session asked a code for; never a form field
+    voter_id = session.get('otp_voter_id')
+    if not voter_id:
+        flash("No OTP request found. Please request a new OTP.", "warning")
+        return redirect(url_for('voter.login'))
+
+    with admission.OTPAdmission(voter_id, "verify") as gate:
+        if gate.rejection:
+            return gate.rejection
+        # Single keyed lookup; a matching code is consumed so it cannot be
+        # reused, and too many misses drop it
+        if not get_otp_store().verify(voter_id, otp_entered):
+            flash("Invalid or expired OTP. Please try again.", "danger")
+            return redirect(url_for('voter.login'))
+
+    user = User.query.filter_by(voter_id=voter_id).first()
     if not user:
         flash("User not found. Please register.", "danger")
-        return redirect(url_for('register'))
+        return redirect(url_for('voter.register'))
 
-    # Successful login
+    # Successful login; a fresh session ID so a planted one is useless
+    sessions.rotate(session)
     session['user_id'] = user.id
     session['user_name'] = user.name
-    otp_storage.pop(matched_voter_id, None)
+    session.pop('otp_voter_id', None)
     flash("Logged in successfully!", "success")
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('voter.dashboard'))
 
 
-@app.route('/dashboard')
+@voter_bp.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('voter.login'))
 
-    user = User.query.get(session['user_id'])
+    # cached in the session for a few seconds (principal.py): no query on a repeat view
+    user = principal.get(session['user_id'])
     if not user:
         session.clear()
         flash("User not found. Please log in again.", "warning")
-        return redirect(url_for('login'))
-
-    candidates = Candidate.query.order_by(Candidate.id).all()
+        return redirect(url_for('voter.login'))
 
-    if getattr(user, "has_voted", False):
-        flash("You have already voted. Thank you for participating!", "info")
+    # races still open to this voter; done once every race has their vote
+    races = fragments.open_races(user.id, user.voted)
+    if not races and user.has_voted:
+        flash("You have voted in every race. Thank you for participating!", "info")
         return render_template('voted.html', user=user)
 
-    return render_template('dashboard.html', user=user, candidates=candidates)
+    return fragments.render_dashboard(user, races)
 
 
-@app.route('/logout')
+@voter_bp.route('/logout')
 def logout():
     session.clear()
     flash("You have been logged out.", "info")
-    return redirect(url_for("login"))
+    return redirect(url_for("voter.login"))
@@ -1,9 +1,7 @@
-from app import app
-from authentication import auth_bp
+from app import create_app
 
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(voting_bp)
+# Blueprints are registered by create_app()
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,305 @@
+import os
+import random
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+import metrics
+
+# Server-side sessions.
+#
+# The cookie carries only a random session ID (22 URL-safe characters); the
+# session dict itself lives on the server. Nothing about the voter - IDs,
+# names, email, pending-login state - is sent to or signed for the client,
+# and the cookie stays the same size whatever the session holds.
+#
+# Backends (SESSION_BACKEND):
+#   "sqlite"  (default) one small SQLite file shared by every worker on the
+#             host (SESSION_PATH, default instance/sessions.db), fronted by a
+#             per-process LRU of decoded sessions (SESSION_CACHE_SIZE, 10000).
+#             A load is one primary-key lookup; the stored data is only
+#             transferred and decoded when another worker changed it since
+#             this process last saw it (each save writes a new version).
+#   "memory"  per-process LRU only (single worker, tests).
+#   "cookie"  Flask's default signed cookie session.
+#
+# Sessions are written only when they change. An unchanged session is
+# re-dated once less than half its lifetime remains, so idle sessions expire
+# without a write on every request. Lifetime is PERMANENT_SESSION_LIFETIME for
+# permanent sessions and SESSION_IDLE_SECONDS (86400) otherwise. Expired rows
+# are swept by a fraction of writes and by purge_expired().
+#
+# Values are encoded with Flask's tagged JSON, as the cookie session does.
+# Nested values must be reassigned, not mutated in place - the same rule as
+# for detecting changes to a cookie session.
+
+_SID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def new_sid():
+    return secrets.token_urlsafe(16)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expiry=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expiry = expiry
+        self.modified = False
+        self.rotated = None
+
+    def rotate(self):
+        """Move the data to a fresh session ID, e.g. on login, so a planted ID is useless."""
+        if self.sid is not None:
+            self.rotated = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore:
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # sid -> (expiry, data)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < now:
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+        return entry[0], dict(entry[1])
+
+    def save(self, sid, data, expiry):
+        with self._lock:
+            self._entries[sid] = (expiry, dict(data))
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def touch(self, sid, expiry):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (expiry, entry[1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (expiry, _) in self._entries.items() if expiry < now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteSessionStore:
+
+    def __init__(self, path, cache_size=10000):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # sid -> (version, data)
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        # the app is often built before the server forks its workers, so the
+        # schema is made on a connection that is closed again at once
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " sid TEXT PRIMARY KEY, data TEXT NOT NULL, expiry REAL NOT NULL, version INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expiry ON sessions (expiry)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self):
+        # one connection per thread and per process: a forked worker never
+        # reuses a handle it inherited from its parent
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _cached(self, sid):
+        with self._cache_lock:
+            entry = self._cache.get(sid)
+            if entry is not None:
+                self._cache.move_to_end(sid)
+        return entry
+
+    def _remember(self, sid, version, data):
+        with self._cache_lock:
+            self._cache[sid] = (version, data)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._cache_lock:
+            self._cache.pop(sid, None)
+
+    def load(self, sid):
+        cached = self._cached(sid)
+        known = cached[0] if cached else None
+        # the data column is only sent back if our cached copy is stale
+        row = self._conn().execute(
+            "SELECT version, expiry, CASE WHEN version = ? THEN NULL ELSE data END"
+            " FROM sessions WHERE sid = ? AND expiry >= ?",
+            (known, sid, time.time()),
+        ).fetchone()
+        if row is None:
+            if cached:
+                self._forget(sid)
+            return None
+        version, expiry, payload = row
+        if payload is None:
+            data = cached[1]
+        else:
+            data = session_json_serializer.loads(payload)
+            self._remember(sid, version, data)
+        return expiry, dict(data)
+
+    def save(self, sid, data, expiry):
+        data = dict(data)
+        version = random.getrandbits(62)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expiry, version) VALUES (?, ?, ?, ?)",
+            (sid, session_json_serializer.dumps(data), expiry, version),
+        )
+        self._remember(sid, version, data)
+        if random.random() < 0.01:
+            self.purge_expired()
+
+    def touch(self, sid, expiry):
+        self._conn().execute("UPDATE sessions SET expiry = ? WHERE sid = ?", (expiry, sid))
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        self._forget(sid)
+
+    def purge_expired(self):
+        cur = self._conn().execute("DELETE FROM sessions WHERE expiry < ?", (time.time(),))
+        return cur.rowcount
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+
+class ServerSessionInterface(SessionInterface):
+
+    def __init__(self, store):
+        self.store = store
+
+    def _lifetime(self, app, session):
+        if session.permanent:
+            return app.permanent_session_lifetime.total_seconds()
+        return app.config.get("SESSION_IDLE_SECONDS", 86400)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID.match(sid):
+            start = time.perf_counter()
+            entry = self.store.load(sid)
+            metrics.observe_session("load", time.perf_counter() - start)
+            if entry is not None:
+                expiry, data = entry
+                return ServerSession(data, sid=sid, expiry=expiry)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        start = time.perf_counter()
+
+        if session.rotated:
+            self.store.delete(session.rotated)
+        if not session:
+            # logged out or never used: drop server state and the cookie
+            if session.sid is not None and session.modified:
+                self.store.delete(session.sid)
+            if session.rotated or (session.sid is not None and session.modified):
+                response.delete_cookie(name, domain=domain, path=path)
+                metrics.observe_session("save", time.perf_counter() - start)
+            return
+
+        response.vary.add("Cookie")
+        lifetime = self._lifetime(app, session)
+        now = time.time()
+        if session.modified or session.sid is None:
+            is_new = session.sid is None
+            if is_new:
+                session.sid = new_sid()
+            session.expiry = now + lifetime
+            self.store.save(session.sid, session, session.expiry)
+            set_cookie = is_new or session.permanent
+        elif session.expiry is not None and session.expiry - now < lifetime / 2:
+            session.expiry = now + lifetime
+            self.store.touch(session.sid, session.expiry)
+            set_cookie = session.permanent
+        else:
+            return
+        if set_cookie:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        metrics.observe_session("save", time.perf_counter() - start)
+
+
+def rotate(session):
+    """Give the current session a new ID (no-op with the cookie backend)."""
+    rotate_sid = getattr(session, "rotate", None)
+    if rotate_sid is not None:
+        rotate_sid()
+
+
+def make_store(app):
+    backend = app.config.get("SESSION_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemorySessionStore(app.config.get("SESSION_CACHE_SIZE", 10000))
+    if backend == "sqlite":
+        path = app.config.get("SESSION_PATH") or os.path.join(app.instance_path, "sessions.db")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteSessionStore(path, app.config.get("SESSION_CACHE_SIZE", 10000))
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend!r}")
+
+
+def init_app(app):
+    if app.config.get("SESSION_BACKEND", "sqlite") == "cookie":
+        return
+    app.session_interface = ServerSessionInterface(make_store(app))
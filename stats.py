@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+
+from models import db, User, Candidate, TallyShard
+from database import read_session
+
+# Election statistics for the admin dashboard and API consumers.
+#
+# Everything the dashboard shows (voter count, turnout, per-candidate and
+# per-position results) comes back from a single SELECT: candidate rows with
+# their maintained tallies, plus the two User counts as scalar subqueries
+# answered from ix_user_has_voted. The result is kept for STATS_MAX_AGE
+# seconds (default 5) so a room full of admins refreshing costs one query per
+# window per process, not one per page view.
+
+CandidateResult = namedtuple("CandidateResult", "id name party position votes")
+ElectionStats = namedtuple(
+    "ElectionStats", "total_voters voted turnout candidates positions computed_at"
+)
+
+_lock = threading.Lock()
+_cached = None
+
+
+def _query():
+    total_voters = db.select(db.func.count(User.id)).scalar_subquery()
+    voted = db.select(db.func.count(User.id)).where(User.has_voted.is_(True)).scalar_subquery()
+    sharded = (
+        db.select(db.func.coalesce(db.func.sum(TallyShard.votes), 0))
+        .where(TallyShard.candidate_id == Candidate.id)
+        .scalar_subquery()
+    )
+    session = read_session()
+    rows = (
+        session.query(
+            Candidate.id,
+            Candidate.name,
+            Candidate.party,
+            Candidate.position,
+            db.func.coalesce(Candidate.votes, 0) + sharded,
+            total_voters,
+            voted,
+        )
+        .order_by(Candidate.id)
+        .all()
+    )
+    if rows:
+        total, voted_count = rows[0][5], rows[0][6]
+    else:
+        total, voted_count = session.query(total_voters, voted).one()
+    return [CandidateResult(*r[:5]) for r in rows], total, voted_count
+
+
+def compute():
+    candidates, total, voted = _query()
+    positions = {}
+    for cand in candidates:
+        positions.setdefault(cand.position, []).append(cand)
+    turnout = round(100.0 * voted / total, 2) if total else 0.0
+    return ElectionStats(total, voted, turnout, candidates, positions, time.time())
+
+
+def election_stats(max_age=None):
+    """Return ElectionStats no older than ``max_age`` seconds."""
+    global _cached
+    if max_age is None:
+        max_age = current_app.config.get("STATS_MAX_AGE", 5)
+    cached = _cached
+    if cached is not None and time.time() - cached.computed_at <= max_age:
+        return cached
+    with _lock:
+        # another request may have refreshed while we waited
+        cached = _cached
+        if cached is not None and time.time() - cached.computed_at <= max_age:
+            return cached
+        _cached = compute()
+        return _cached
+
+
+def invalidate():
+    global _cached
+    _cached = None
+
+
+def as_dict(stats):
+    return {
+        "total_voters": stats.total_voters,
+        "voted": stats.voted,
+        "turnout": stats.turnout,
+        "candidates": [c._asdict() for c in stats.candidates],
+        "positions": {
+            position: [{"id": c.id, "name": c.name, "votes": c.votes} for c in cands]
+            for position, cands in stats.positions.items()
+        },
+        "computed_at": stats.computed_at,
+    }
@@ -0,0 +1,132 @@
+import random
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Candidate, TallyShard
+
+# Vote tally updates.
+#
+# The old code did ``candidate.votes = (candidate.votes or 0) + 1`` in Python,
+# which loses updates when two workers read the same value. Every increment
+# here is a single ``UPDATE ... SET votes = votes + 1`` executed by the
+# database, inside the caller's transaction, so the tally commits or rolls
+# back together with the Vote row.
+#
+# With TALLY_SHARDS = 1 (default) the increment goes straight to
+# Candidate.votes. With TALLY_SHARDS > 1 each transaction bumps a randomly
+# chosen TallyShard row, so concurrent transactions for one popular candidate
+# do not all queue on the same row lock; readers merge the shards with
+# candidate_totals() and ``flask fold-tallies`` (fold_shards()) compacts them
+# back into Candidate.votes.
+#
+# Under group commit (ballot_box.py, the default) a process has a single
+# committer thread and one transaction in flight, so sharding spreads
+# contention across worker processes, not across threads. A random pick per
+# increment keeps two processes from settling on the same row for good, as a
+# shard derived from the pid or thread id could.
+
+
+def _pick_shard(shards):
+    return random.randrange(shards)
+
+
+def mark_voted(user_ids):
+    """Set the ``has_voted`` turnout flag for ``user_ids`` in the current transaction.
+
+    Double voting is refused by the one-vote-per-position constraint on Vote,
+    not by this flag.
+    """
+    db.session.execute(
+        db.update(User)
+        .where(User.id.in_(user_ids), db.or_(User.has_voted.is_(None), User.has_voted.is_(False)))
+        .values(has_voted=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def increment(candidate_id, amount=1):
+    """Add ``amount`` votes for ``candidate_id`` in the current transaction."""
+    shards = current_app.config.get("TALLY_SHARDS", 1)
+    if shards <= 1:
+        result = db.session.execute(
+            db.update(Candidate)
+            .where(Candidate.id == candidate_id)
+            .values(votes=db.func.coalesce(Candidate.votes, 0) + amount)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    shard = _pick_shard(shards)
+    bump = (
+        db.update(TallyShard)
+        .where(TallyShard.candidate_id == candidate_id, TallyShard.shard == shard)
+        .values(votes=TallyShard.votes + amount)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(bump).rowcount == 1:
+        return True
+    # first vote on this shard: create the row, or bump it if another worker just did
+    try:
+        with db.session.begin_nested():
+            db.session.add(TallyShard(candidate_id=candidate_id, shard=shard, votes=amount))
+    except IntegrityError:
+        return db.session.execute(bump).rowcount == 1
+    return True
+
+
+def candidate_totals(session=None):
+    """Return ``{candidate_id: votes}`` with any unfolded shards merged in."""
+    session = session or db.session
+    totals = dict(session.query(Candidate.id, db.func.coalesce(Candidate.votes, 0)).all())
+    for candidate_id, votes in (
+        session.query(TallyShard.candidate_id, db.func.sum(TallyShard.votes))
+        .group_by(TallyShard.candidate_id)
+        .all()
+    ):
+        if candidate_id in totals:
+            totals[candidate_id] += votes or 0
+    return totals
+
+
+def fold_shards():
+    """Move shard counts into Candidate.votes in one transaction."""
+    # Relative updates on both sides, so increments that land while we fold
+    # simply stay on the shard for the next pass instead of being lost.
+    folded = 0
+    for candidate_id, shard, votes in (
+        db.session.query(TallyShard.candidate_id, TallyShard.shard, TallyShard.votes)
+        .filter(TallyShard.votes != 0)
+        .all()
+    ):
+        db.session.execute(
+            db.update(TallyShard)
+            .where(TallyShard.candidate_id == candidate_id, TallyShard.shard == shard)
+            .values(votes=TallyShard.votes - votes)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            db.update(Candidate)
+            .where(Candidate.id == candidate_id)
+            .values(votes=db.func.coalesce(Candidate.votes, 0) + votes)
+            .execution_options(synchronize_session=False)
+        )
+        folded += votes
+    db.session.commit()
+    return folded
+
+
+@click.command("fold-tallies")
+@with_appcontext
+def fold_tallies_command():
+    """Move sharded vote counts into Candidate.votes."""
+    click.echo(f"folded {fold_shards()} votes into candidate tallies")
+
+
+def drop_candidate(candidate_id):
+    db.session.execute(
+        db.delete(TallyShard)
+        .where(TallyShard.candidate_id == candidate_id)
+        .execution_options(synchronize_session=False)
+    )
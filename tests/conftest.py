@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+import catalogue  # noqa: E402
+import fragments  # noqa: E402
+import migrations  # noqa: E402
+import results  # noqa: E402
+import stats  # noqa: E402
+
+# Per-app singletons (ballot box, stores, filters) are keyed by id(app);
+# keeping every test app alive means a later app never reuses a stale id.
+_apps = []
+
+
+def _reset_process_caches():
+    catalogue._version = None
+    catalogue.invalidate()
+    fragments._cached = (None, {})
+    results._cached = None
+    stats.invalidate()
+
+
+def make_app(tmp_path, **config):
+    """An app on its own SQLite file under ``tmp_path``, schema at the latest version."""
+    settings = {
+        "TESTING": True,
+        "SECRET_KEY": "test",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "SESSION_BACKEND": "memory",
+        "OTP_STORE_BACKEND": "memory",
+        "RATE_LIMIT_BACKEND": "memory",
+        "MAIL_SUPPRESS_SEND": True,
+    }
+    settings.update(config)
+    app = create_app(settings)
+    _apps.append(app)
+    _reset_process_caches()
+    with app.app_context():
+        migrations.upgrade(db)
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    return make_app(tmp_path)
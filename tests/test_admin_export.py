@@ -0,0 +1,49 @@
+from conftest import make_app
+from models import db, User, Candidate
+import ballot_box
+
+
+def _app(tmp_path):
+    app = make_app(tmp_path, PASSWORD_HASH_ROUNDS=4)
+    with app.app_context():
+        db.session.add(Candidate(name="C1", party="P", position="Mayor"))
+        db.session.add(User(name="admin", email="admin@example.com", voter_id="V1", password="x"))
+        db.session.commit()
+        ballot_box.cast(1, [1])
+    result = app.test_cli_runner().invoke(args=["create-admin", "auditor", "--password", "s3cret"])
+    assert result.exit_code == 0, result.output
+    return app
+
+
+def _export(client):
+    return client.get("/admin/export/votes?format=csv&gzip=0")
+
+
+def test_voter_named_admin_cannot_export_votes(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_name"] = "admin"
+    assert _export(client).status_code == 403
+
+
+def test_signed_in_admin_account_can_export_votes(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    response = client.post("/admin/login", data={"username": "auditor", "password": "s3cret"})
+    assert response.get_json() == {"admin": "auditor"}
+    export = _export(client)
+    assert export.status_code == 200
+    assert export.get_data(as_text=True).splitlines()[1].split(",")[3] == "V1"
+
+    client.get("/admin/logout")
+    assert _export(client).status_code == 403
+
+
+def test_wrong_admin_password_is_refused(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    response = client.post("/admin/login", data={"username": "auditor", "password": "nope"})
+    assert response.status_code == 401
+    assert _export(client).status_code == 403
@@ -0,0 +1,146 @@
+import threading
+
+from sqlalchemy import event
+
+from conftest import make_app
+from models import db, User
+from otp_store import get_otp_store
+import admission
+import mail_queue
+
+
+def _app(tmp_path, **config):
+    settings = {
+        "OTP_IP_BUCKET": (5, 60.0),
+        "OTP_VOTER_BUCKET": (3, 60.0),
+        "MAIL_QUEUE_WORKERS": 1,
+    }
+    settings.update(config)
+    app = make_app(tmp_path, **settings)
+    with app.app_context():
+        db.session.add(User(name="Ann", email="ann@example.com", voter_id="V1", password="x"))
+        db.session.commit()
+    return app
+
+
+def _get_otp(client, voter_id="V1", ip="10.0.0.1"):
+    return client.post("/get_otp", data={"voter_id": voter_id}, environ_base={"REMOTE_ADDR": ip})
+
+
+def _statements(app):
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", record)
+    return seen
+
+
+def test_ip_flood_is_shed_with_429_before_any_lookup(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    statuses = [_get_otp(client, voter_id=f"nobody-{i}").status_code for i in range(5)]
+    assert 429 not in statuses
+
+    statements = _statements(app)
+    flood = [_get_otp(client, voter_id=f"nobody-{i}") for i in range(200)]
+    assert {r.status_code for r in flood} == {429}
+    assert all(int(r.headers["Retry-After"]) >= 1 for r in flood)
+    assert not [s for s in statements if '"user"' in s]
+
+    # another client is unaffected
+    assert _get_otp(client, voter_id="nobody", ip="10.0.0.2").status_code != 429
+
+
+def test_voter_bucket_limits_codes_per_voter_across_ips(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    statuses = [_get_otp(client, ip=f"10.0.1.{i}").status_code for i in range(6)]
+    assert statuses[:3] == [302, 302, 302]
+    assert statuses[3:] == [429, 429, 429]
+
+
+def test_inflight_cap_rejects_instead_of_queueing(tmp_path):
+    app = _app(tmp_path, OTP_MAX_INFLIGHT=2)
+    with app.test_request_context("/get_otp", method="POST", environ_base={"REMOTE_ADDR": "10.0.2.1"}):
+        with admission.OTPAdmission("a") as first, admission.OTPAdmission("b") as second:
+            assert first.rejection is None and second.rejection is None
+            with admission.OTPAdmission("c") as third:
+                assert third.rejection[1] == 429
+        # slots are returned on exit
+        with admission.OTPAdmission("d") as fourth:
+            assert fourth.rejection is None
+
+
+def test_full_mail_queue_sheds_and_discards_the_code(tmp_path):
+    # no sender threads: the backlog only fills
+    app = _app(tmp_path, MAIL_QUEUE_WORKERS=0, MAIL_QUEUE_SIZE=2, OTP_VOTER_BUCKET=(100, 60.0))
+    client = app.test_client()
+    statuses = [_get_otp(client).status_code for _ in range(4)]
+    assert statuses == [302, 302, 429, 429]
+    with app.app_context():
+        assert mail_queue.get_mail_queue().pending() == 2
+        assert get_otp_store().verify("V1", "000000") is False
+
+
+def test_memory_buckets_are_bounded():
+    buckets = admission.MemoryBuckets(max_keys=100)
+    for i in range(10000):
+        buckets.take(f"ip:{i}", 5, 60.0, now=1000.0)
+    assert len(buckets) == 100
+
+
+def test_memory_buckets_sweep_refilled_entries():
+    buckets = admission.MemoryBuckets()
+    for i in range(500):
+        buckets.take(f"ip:{i}", 5, 1.0, now=1000.0)
+    buckets.take("voter:V1", 3, 2.0, now=1004.0)
+    assert len(buckets) == 501
+    # the IP buckets have refilled 6 s later; the slower voter bucket has not
+    buckets.take("ip:late", 5, 1.0, now=1006.0)
+    assert len(buckets) == 2
+    # a refilled bucket starts over full
+    assert [buckets.take("ip:0", 5, 1.0, now=1006.0) for _ in range(6)][-2:] == [0.0, 1.0]
+
+
+def test_sqlite_buckets_open_no_connection_until_used(tmp_path):
+    # the app is built before the server forks; nothing may be inherited
+    buckets = admission.SQLiteBuckets(str(tmp_path / "ratelimit.db"))
+    assert getattr(buckets._local, "conn", None) is None
+    assert buckets.take("ip:1", 5, 1.0) == 0.0
+
+
+def test_sqlite_buckets_sweep_refilled_entries(tmp_path, monkeypatch):
+    buckets = admission.SQLiteBuckets(str(tmp_path / "ratelimit.db"))
+    for i in range(500):
+        buckets.take(f"ip:{i}", 5, 1.0, now=1000.0)
+    assert len(buckets) == 500
+    # every bucket has refilled 10 s later; the next write sweeps them
+    monkeypatch.setattr(admission.random, "random", lambda: 0.0)
+    buckets.take("ip:late", 5, 1.0, now=1010.0)
+    assert len(buckets) == 1
+
+
+def test_flood_does_not_grow_threads(tmp_path):
+    app = _app(tmp_path, OTP_IP_BUCKET=(50, 60.0), OTP_VOTER_BUCKET=(50, 60.0), MAIL_QUEUE_SIZE=20)
+    client = app.test_client()
+    _get_otp(client)  # starts the mail queue's sender
+    before = threading.active_count()
+    statuses = []
+
+    def flood(worker):
+        with app.test_client() as c:
+            statuses.extend(_get_otp(c, ip=f"10.0.3.{worker}").status_code for _ in range(100))
+
+    threads = [threading.Thread(target=flood, args=(w,)) for w in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert statuses.count(429) >= 350
+    assert threading.active_count() == before
+    with app.app_context():
+        assert mail_queue.get_mail_queue().pending() <= 20
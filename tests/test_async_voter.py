@@ -0,0 +1,184 @@
+import asyncio
+import threading
+
+from sqlalchemy import event
+
+from conftest import make_app
+from models import db, User, Candidate
+from otp_store import get_otp_store
+from async_voter import AsyncVoterApp
+import ballot_box
+import catalogue
+import results_stream
+
+
+def _app(tmp_path, **config):
+    app = make_app(tmp_path, RESULTS_STREAM_INTERVAL=0.05, **config)
+    with app.app_context():
+        db.session.add(Candidate(name="C1", party="P", position="Mayor"))
+        db.session.add(User(name="Ann", email="ann@example.com", voter_id="V1", password="x"))
+        db.session.commit()
+    return app
+
+
+async def _request(asgi, path, method="GET", headers=(), gone=None, on_body=None):
+    """Send one request to ``asgi``; ``gone`` is an Event that disconnects the client."""
+    messages = []
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await (gone or asyncio.Event()).wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if on_body and message["type"] == "http.response.body":
+            on_body(message)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"",
+        "headers": list(headers), "http_version": "1.1", "scheme": "http",
+        "server": ("testserver", 80), "client": ("10.0.0.1", 1234),
+    }
+    await asgi(scope, receive, send)
+    return messages
+
+
+async def _shutdown(asgi):
+    # closes the aiosqlite readers, whose threads would otherwise outlive the test
+    messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        pass
+
+    await asgi({"type": "lifespan"}, receive, send)
+
+
+def _login_cookie(app):
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    with app.app_context():
+        code = get_otp_store().get("V1")[0]
+    client.post("/verify_otp", data={"otp": code})
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"])
+    return (b"cookie", f"{cookie.key}={cookie.value}".encode())
+
+
+def test_live_stream_holds_no_wsgi_thread(tmp_path):
+    app = _app(tmp_path, ASYNC_WSGI_THREADS=1)
+    asgi = AsyncVoterApp(app)
+    broadcaster = results_stream.get_broadcaster(app)
+
+    async def scenario():
+        gone = asyncio.Event()
+        opened = asyncio.Semaphore(0)
+        streams = [
+            asyncio.ensure_future(_request(
+                asgi, "/admin/live_votes/stream", gone=gone,
+                on_body=lambda m: b"event: snapshot" in m["body"] and opened.release(),
+            ))
+            for _ in range(4)
+        ]
+        for _ in streams:
+            await asyncio.wait_for(opened.acquire(), 5)
+        # more viewers than WSGI threads, and the one thread is still free
+        page = await asyncio.wait_for(_request(asgi, "/register"), 5)
+        assert page[0]["status"] == 200
+        assert len(broadcaster._subscribers) == 4
+
+        gone.set()
+        await asyncio.wait_for(asyncio.gather(*streams), 5)
+        await _shutdown(asgi)
+
+    asyncio.run(scenario())
+    assert not broadcaster._subscribers
+
+
+def test_stream_past_the_cap_gets_503(tmp_path):
+    app = _app(tmp_path, RESULTS_STREAM_MAX_SUBSCRIBERS=1)
+    asgi = AsyncVoterApp(app)
+    broadcaster = results_stream.get_broadcaster(app)
+
+    async def scenario():
+        gone = asyncio.Event()
+        opened = asyncio.Event()
+        stream = asyncio.ensure_future(_request(
+            asgi, "/admin/live_votes/stream", gone=gone, on_body=lambda m: opened.set(),
+        ))
+        await asyncio.wait_for(opened.wait(), 5)
+        refused = await asyncio.wait_for(_request(asgi, "/admin/live_votes/stream"), 5)
+        gone.set()
+        await asyncio.wait_for(stream, 5)
+        await _shutdown(asgi)
+        return refused
+
+    refused = asyncio.run(scenario())
+    assert refused[0]["status"] == 503
+    assert (b"retry-after", str(results_stream.RETRY_AFTER_SECONDS).encode()) in refused[0]["headers"]
+    assert not broadcaster._subscribers
+
+
+def test_stream_delivers_deltas_on_the_loop(tmp_path):
+    app = _app(tmp_path)
+    asgi = AsyncVoterApp(app)
+    frames = []
+
+    async def scenario():
+        gone = asyncio.Event()
+        delta = asyncio.Event()
+
+        def seen(message):
+            frames.append(message["body"])
+            if b"event: delta" in message["body"]:
+                delta.set()
+
+        stream = asyncio.ensure_future(_request(asgi, "/admin/live_votes/stream", gone=gone, on_body=seen))
+        while not any(b"event: snapshot" in f for f in frames):
+            await asyncio.sleep(0.01)
+        with app.app_context():
+            assert await asyncio.to_thread(ballot_box.cast, 1, [1]) == ballot_box.RECORDED
+        await asyncio.wait_for(delta.wait(), 5)
+        gone.set()
+        await asyncio.wait_for(stream, 5)
+        await _shutdown(asgi)
+
+    asyncio.run(scenario())
+
+
+def test_catalogue_check_runs_off_the_loop(tmp_path):
+    app = _app(tmp_path)
+    asgi = AsyncVoterApp(app)
+    cookie = _login_cookie(app)
+    loop_threads = []
+
+    def record(*args):
+        if threading.current_thread() is threading.main_thread():
+            loop_threads.append(args[2])
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        catalogue.invalidate()
+
+        async def scenario():
+            try:
+                return await _request(asgi, "/dashboard", headers=[cookie])
+            finally:
+                await _shutdown(asgi)
+
+        messages = asyncio.run(scenario())
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+    assert messages[0]["status"] == 200
+    assert b"C1" in messages[1]["body"]
+    assert not loop_threads, loop_threads
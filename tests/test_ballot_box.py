@@ -0,0 +1,58 @@
+import threading
+import time
+
+from conftest import make_app
+from models import db, User, Candidate, Vote
+import ballot_box
+
+
+def _app(tmp_path):
+    app = make_app(tmp_path, VOTE_SUBMIT_TIMEOUT=0.2, VOTE_BATCH_WINDOW_MS=0)
+    with app.app_context():
+        db.session.add(Candidate(name="M1", party="P", position="Mayor"))
+        db.session.add_all(User(name=f"V{i}", email=f"v{i}@example.com", voter_id=f"V{i}", password="x") for i in (1, 2))
+        db.session.commit()
+    return app
+
+
+def _votes(app, user_id):
+    with app.app_context():
+        return Vote.query.filter_by(voter_id=user_id).count()
+
+
+def test_timed_out_ballot_is_pending_or_withdrawn(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    release, writing = threading.Event(), threading.Event()
+    commit_batch = ballot_box._commit_batch
+
+    def slow_commit(ballots):
+        writing.set()
+        release.wait(5)
+        commit_batch(ballots)
+
+    monkeypatch.setattr(ballot_box, "_commit_batch", slow_commit)
+    outcomes = {}
+
+    def first():
+        with app.app_context():
+            outcomes[1] = ballot_box.cast(1, [1])
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert writing.wait(5)
+    with app.app_context():
+        # the committer is busy with voter 1's batch; voter 2's ballot is still queued
+        outcomes[2] = ballot_box.cast(2, [1])
+    thread.join()
+    assert outcomes == {1: ballot_box.PENDING, 2: ballot_box.ERROR}
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while _votes(app, 1) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the pending ballot lands; the withdrawn one never does, so voter 2 can retry
+    assert _votes(app, 1) == 1
+    assert _votes(app, 2) == 0
+    with app.app_context():
+        assert ballot_box.cast(2, [1]) == ballot_box.RECORDED
+        assert ballot_box.cast(1, [1]) == ballot_box.ALREADY_VOTED
@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import make_app
+from models import db
+from database import READER
+
+
+def _synchronous(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA synchronous").scalar()
+
+
+def test_writer_commits_are_fsynced(app):
+    # 2 = FULL: in WAL mode NORMAL (1) would not fsync on commit
+    with app.app_context():
+        assert _synchronous(db.engine) == 2
+        assert _synchronous(db.engines[READER]) == 1
+
+
+def test_synchronous_is_configurable(tmp_path):
+    app = make_app(tmp_path, DB_SYNCHRONOUS="extra")
+    with app.app_context():
+        assert _synchronous(db.engine) == 3
+
+
+def test_unknown_synchronous_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_app(tmp_path, DB_SYNCHRONOUS="sometimes")
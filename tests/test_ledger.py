@@ -0,0 +1,172 @@
+import pytest
+from sqlalchemy import select
+
+from conftest import make_app
+from models import db, User, Candidate, Vote, LedgerNode
+import ballot_box
+import ledger
+
+VOTERS = 24
+
+
+# Reference definitions straight from RFC 6962, section 2.1, on a list of leaf hashes
+
+def _split(n):
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def reference_root(leaves):
+    if len(leaves) == 1:
+        return leaves[0]
+    k = _split(len(leaves))
+    return ledger.node_hash(reference_root(leaves[:k]), reference_root(leaves[k:]))
+
+
+def reference_path(m, leaves):
+    if len(leaves) == 1:
+        return []
+    k = _split(len(leaves))
+    if m < k:
+        return reference_path(m, leaves[:k]) + [reference_root(leaves[k:])]
+    return reference_path(m - k, leaves[k:]) + [reference_root(leaves[:k])]
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, VOTE_GROUP_COMMIT=False)
+    with app.app_context():
+        db.session.add(Candidate(name="M1", party="P", position="Mayor"))
+        db.session.add(Candidate(name="C1", party="P", position="Council"))
+        db.session.add_all(
+            User(name=f"V{i}", email=f"v{i}@example.com", voter_id=f"V{i}", password="x") for i in range(VOTERS)
+        )
+        db.session.commit()
+    return app
+
+
+def _leaves():
+    """Leaf hashes recomputed from the Vote table, independent of the stored tree."""
+    rows = db.session.execute(
+        select(Vote.id, Vote.voter_id, Vote.candidate_id, Vote.position, Vote.timestamp).order_by(Vote.id)
+    ).all()
+    return [ledger.leaf_hash(*row) for row in rows]
+
+
+def _ballots():
+    # one or two leaves per ballot, so appends start at every kind of offset
+    for n, user_id in enumerate(range(1, VOTERS + 1)):
+        yield user_id, [1, 2] if n % 3 == 0 else [1 + n % 2]
+
+
+def test_root_matches_reference_at_every_size(app):
+    sizes = []
+    with app.app_context():
+        assert ledger.root() == (0, None)
+        for user_id, candidates in _ballots():
+            assert ballot_box.cast(user_id, candidates) == ballot_box.RECORDED
+            db.session.rollback()
+            leaves = _leaves()
+            size, digest = ledger.root()
+            assert size == len(leaves)
+            assert digest == reference_root(leaves), size
+            sizes.append(size)
+    assert {3, 5, 6, 7, 9, 13, 17} & set(sizes)
+    assert not all(s & (s - 1) == 0 for s in sizes)
+
+
+def test_every_leaf_has_a_verifiable_inclusion_proof(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+            db.session.rollback()
+            leaves = _leaves()
+            root = reference_root(leaves)
+            vote_ids = [vid for (vid,) in db.session.execute(select(Vote.id).order_by(Vote.id))]
+            for index, vote_id in enumerate(vote_ids):
+                proof = ledger.prove(vote_id)
+                path = [bytes.fromhex(h) for h in proof["path"]]
+                assert (proof["leaf_index"], proof["tree_size"]) == (index, len(leaves))
+                assert bytes.fromhex(proof["leaf_hash"]) == leaves[index]
+                assert bytes.fromhex(proof["root"]) == root
+                assert path == reference_path(index, leaves)
+                assert ledger.verify_inclusion(leaves[index], index, len(leaves), path, root)
+
+
+def test_inclusion_proof_rejects_wrong_inputs(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+        db.session.rollback()
+        leaves = _leaves()
+        size, root = ledger.root()
+        index = size // 3
+        proof = ledger.prove(db.session.execute(select(Vote.id).order_by(Vote.id).offset(index)).scalar())
+        path = [bytes.fromhex(h) for h in proof["path"]]
+
+        assert ledger.verify_inclusion(leaves[index], index, size, path, root)
+        assert not ledger.verify_inclusion(leaves[index + 1], index, size, path, root)
+        assert not ledger.verify_inclusion(leaves[index], index + 1, size, path, root)
+        assert not ledger.verify_inclusion(leaves[index], index, size + 1, path, root)
+        assert not ledger.verify_inclusion(leaves[index], index, size, path[:-1], root)
+        assert not ledger.verify_inclusion(leaves[index], index, size, path + [root], root)
+        tampered = list(path)
+        tampered[0] = bytes(32)
+        assert not ledger.verify_inclusion(leaves[index], index, size, tampered, root)
+        assert not ledger.verify_inclusion(leaves[index], size, size, path, root)
+        assert ledger.prove(10 ** 6) is None
+
+
+def _verify(app):
+    return app.test_cli_runner().invoke(args=["ledger-verify"])
+
+
+def test_ledger_verify_passes_on_an_untouched_ledger(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+        size, root = ledger.root()
+    result = _verify(app)
+    assert result.exit_code == 0, result.output
+    assert f"ok: {size} votes, root {root.hex()}" in result.output
+
+
+def test_ledger_verify_fails_on_a_tampered_vote(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+        # move one Mayor vote to the Council candidate
+        vote = Vote.query.filter_by(position="Mayor").order_by(Vote.id.desc()).first()
+        vote.candidate_id = 2
+        db.session.commit()
+        bad = vote.id
+    result = _verify(app)
+    assert result.exit_code != 0
+    assert f"vote {bad} does not match its ledger leaf" in result.output
+
+
+def test_ledger_verify_fails_on_a_tampered_tree(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+        # an interior node no longer matches the leaves below it
+        node = LedgerNode.query.filter(LedgerNode.level == 2).first()
+        node.hash = bytes(32)
+        db.session.commit()
+    result = _verify(app)
+    assert result.exit_code != 0
+    assert "does not match the votes below it" in result.output
+
+
+def test_ledger_verify_fails_on_a_deleted_vote(app):
+    with app.app_context():
+        for user_id, candidates in _ballots():
+            ballot_box.cast(user_id, candidates)
+        vote = Vote.query.order_by(Vote.id.desc()).first()
+        LedgerNode.query.filter_by(vote_id=vote.id).update({"vote_id": None})
+        db.session.delete(vote)
+        db.session.commit()
+    result = _verify(app)
+    assert result.exit_code != 0
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+from flask_mail import Message
+
+from conftest import make_app
+import loadtest
+import mail_queue
+
+
+def _worker(tmp_path, name, **config):
+    # two apps on one database and one OTP store file stand in for two worker processes
+    (tmp_path / name).mkdir()
+    return make_app(
+        tmp_path / name,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'shared.db'}",
+        OTP_STORE_BACKEND="sqlite",
+        OTP_STORE_PATH=str(tmp_path / "otp.db"),
+        MAIL_QUEUE_WORKERS=0,
+        **config,
+    )
+
+
+def _message():
+    return Message(subject="OTP", sender="noreply@example.com", recipients=["ann@example.com"], body="123456")
+
+
+def test_status_is_visible_from_another_worker(tmp_path):
+    first, second = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    with first.app_context():
+        job_id = mail_queue.enqueue(_message())
+    assert len(job_id) == 32
+
+    client = second.test_client()
+    with client.session_transaction() as session:
+        session["otp_mail_job"] = job_id
+    assert client.get("/otp_status").get_json() == {"status": mail_queue.QUEUED}
+
+
+def test_unknown_or_legacy_job_ids_read_as_unknown(tmp_path):
+    first, second = _worker(tmp_path, "a"), _worker(tmp_path, "b")
+    with first.app_context():
+        mail_queue.enqueue(_message())
+
+    client = second.test_client()
+    # a job this store never saw, and an id in the old per-process counter form
+    for job_id in ("0" * 32, 1):
+        with client.session_transaction() as session:
+            session["otp_mail_job"] = job_id
+        assert client.get("/otp_status").get_json() == {"status": "unknown"}
+
+
+def test_job_ids_are_not_sequential(tmp_path):
+    app = _worker(tmp_path, "a")
+    with app.app_context():
+        ids = {mail_queue.enqueue(_message()) for _ in range(50)}
+    assert len(ids) == 50
+    assert not any(job_id.isdigit() for job_id in ids)
+
+
+def test_shed_job_leaves_no_status(tmp_path):
+    app = _worker(tmp_path, "a", MAIL_QUEUE_SIZE=1)
+    with app.app_context():
+        mail_queue.enqueue(_message())
+        with pytest.raises(mail_queue.QueueFull):
+            mail_queue.enqueue(_message())
+        store = mail_queue.get_mail_queue()._statuses
+        assert store._conn().execute("SELECT count(*) FROM mail_status").fetchone()[0] == 1
+
+
+@pytest.fixture
+def sink():
+    sink = loadtest.SMTPSink()
+    yield sink
+    sink.close()
+
+
+def _sending_app(tmp_path, sink, **config):
+    settings = dict(
+        MAIL_SUPPRESS_SEND=False, MAIL_SERVER="127.0.0.1", MAIL_PORT=sink.port, MAIL_USE_TLS=False,
+        MAIL_USE_SSL=False, MAIL_USERNAME=None, MAIL_PASSWORD=None,
+        MAIL_QUEUE_WORKERS=1, MAIL_QUEUE_BACKOFF=0.01, MAIL_QUEUE_IDLE_SECONDS=0.5,
+    )
+    settings.update(config)
+    return make_app(tmp_path, **settings)
+
+
+def _wait_for(mq, job_ids, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        statuses = [mq.delivery_status(job_id) for job_id in job_ids]
+        if all(status in (mail_queue.SENT, mail_queue.FAILED) for status in statuses):
+            return statuses
+        time.sleep(0.01)
+    return statuses
+
+
+def _otp_message(n):
+    return Message(subject="OTP", sender="noreply@example.com", recipients=[f"v{n}@example.com"],
+                   body=f"Your OTP for login is: {100000 + n}")
+
+
+def test_worker_delivers_over_one_connection(tmp_path, sink):
+    app = _sending_app(tmp_path, sink)
+    with app.app_context():
+        mq = mail_queue.get_mail_queue()
+        job_ids = [mail_queue.enqueue(_otp_message(n)) for n in range(5)]
+        assert _wait_for(mq, job_ids) == [mail_queue.SENT] * 5
+        mq.shutdown()
+    assert sink.messages == 5
+    assert [sink.wait_for_otp(f"v{n}@example.com", timeout=1) for n in range(5)] == [
+        str(100000 + n) for n in range(5)
+    ]
+    assert sink.connections == 1
+
+
+def test_transient_failure_is_retried_on_a_new_connection(tmp_path, sink):
+    app = _sending_app(tmp_path, sink)
+    sink.fail_next()
+    with app.app_context():
+        mq = mail_queue.get_mail_queue()
+        job_id = mail_queue.enqueue(_otp_message(1))
+        assert _wait_for(mq, [job_id]) == [mail_queue.SENT]
+        mq.shutdown()
+    assert sink.wait_for_otp("v1@example.com", timeout=1) == "100001"
+    assert sink.messages == 1
+    assert sink.connections == 2
+
+
+def test_delivery_fails_once_retries_run_out(tmp_path, sink):
+    app = _sending_app(tmp_path, sink, MAIL_QUEUE_MAX_RETRIES=2)
+    sink.fail_next(3)
+    with app.app_context():
+        mq = mail_queue.get_mail_queue()
+        job_id = mail_queue.enqueue(_otp_message(1))
+        assert _wait_for(mq, [job_id]) == [mail_queue.FAILED]
+        mq.shutdown()
+    assert sink.messages == 0
@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from conftest import make_app
+
+
+def _app(tmp_path, **config):
+    app = make_app(tmp_path, **config)
+
+    @app.route("/test/ok")
+    def ok():
+        return "ok"
+
+    @app.route("/test/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    return app
+
+
+def _requests(client, endpoint, status):
+    text = client.get("/metrics").get_data(as_text=True)
+    match = re.search(rf'^http_requests_total{{endpoint="{endpoint}",method="GET",status="{status}"}} (\d+)$', text, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def _latency_count(client, endpoint):
+    text = client.get("/metrics").get_data(as_text=True)
+    match = re.search(rf'^http_request_duration_seconds_count{{endpoint="{endpoint}",method="GET"}} (\d+)$', text, re.M)
+    return int(match.group(1)) if match else 0
+
+
+def test_successful_and_failed_requests_are_counted(tmp_path):
+    app = _app(tmp_path, PROPAGATE_EXCEPTIONS=False)
+    client = app.test_client()
+    ok, failed = _requests(client, "ok", 200), _requests(client, "boom", 500)
+    timed = _latency_count(client, "boom")
+
+    assert client.get("/test/ok").status_code == 200
+    assert client.get("/test/boom").status_code == 500
+
+    assert _requests(client, "ok", 200) == ok + 1
+    assert _requests(client, "boom", 500) == failed + 1
+    assert _latency_count(client, "boom") == timed + 1
+
+
+def test_propagated_exception_is_counted_as_a_500(tmp_path):
+    # under TESTING the exception escapes before any after_request hook runs
+    app = _app(tmp_path)
+    client = app.test_client()
+    failed = _requests(client, "boom", 500)
+    with pytest.raises(RuntimeError):
+        client.get("/test/boom")
+    assert _requests(client, "boom", 500) == failed + 1
+
+
+def test_scrapes_are_not_counted(tmp_path):
+    client = _app(tmp_path).test_client()
+    client.get("/metrics")
+    assert 'endpoint="metrics"' not in client.get("/metrics").get_data(as_text=True)
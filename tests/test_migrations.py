@@ -0,0 +1,62 @@
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import text
+
+from conftest import make_app
+from models import db, Candidate, User
+import ballot_box
+import migrations
+import stats
+
+BASELINE_DB = Path(__file__).resolve().parent.parent / "instance" / "database.db"
+
+
+def _baseline_copy(tmp_path):
+    """The fixture database shipped with the repo (pre-versioning schema), with a few votes."""
+    path = tmp_path / "test.db"
+    shutil.copy(BASELINE_DB, path)
+    conn = sqlite3.connect(path)
+    candidates = [cid for (cid,) in conn.execute("SELECT id FROM candidate ORDER BY id")]
+    users = [uid for (uid,) in conn.execute('SELECT id FROM "user" ORDER BY id')]
+    conn.executemany(
+        "INSERT INTO vote (voter_id, candidate_id, timestamp) VALUES (?, ?, ?)",
+        [(uid, candidates[0], datetime(2024, 1, 1).isoformat(" ")) for uid in users[:2]],
+    )
+    conn.commit()
+    conn.close()
+    return candidates, users
+
+
+def test_upgrade_from_baseline_schema(tmp_path):
+    candidates, users = _baseline_copy(tmp_path)
+    app = make_app(tmp_path)
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert migrations.has_column(conn, "candidate", "votes")
+            assert migrations.current_version(conn) == migrations.LATEST_VERSION
+        # the votes cast before the upgrade are counted
+        assert db.session.get(Candidate, candidates[0]).votes == 2
+        assert db.session.get(Candidate, candidates[1]).votes == 0
+
+        election = stats.compute()
+        assert {c.id: c.votes for c in election.candidates}[candidates[0]] == 2
+
+        voter = User.query.filter(User.id == users[2]).one()
+        assert ballot_box.cast(voter.id, [candidates[1]]) == ballot_box.RECORDED
+        assert db.session.get(Candidate, candidates[1]).votes == 1
+
+
+def test_upgrade_is_idempotent(tmp_path):
+    _baseline_copy(tmp_path)
+    app = make_app(tmp_path)
+    with app.app_context():
+        assert migrations.upgrade(db) == []
+        # rerunning the newest migration on an up-to-date schema changes nothing
+        with db.engine.begin() as conn:
+            before = conn.execute(text("SELECT id, votes FROM candidate ORDER BY id")).all()
+            migrations.MIGRATIONS[-1][2](conn, db)
+            assert conn.execute(text("SELECT id, votes FROM candidate ORDER BY id")).all() == before
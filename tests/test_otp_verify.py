@@ -0,0 +1,126 @@
+import sqlite3
+
+import pytest
+
+from conftest import make_app
+from models import db, User
+from otp_store import MemoryOTPStore, SQLiteOTPStore, OTP_MAX_MISSES, get_otp_store
+
+
+def _app(tmp_path, **config):
+    settings = {"MAIL_QUEUE_WORKERS": 1}
+    settings.update(config)
+    app = make_app(tmp_path, **settings)
+    with app.app_context():
+        db.session.add(User(name="Ann", email="ann@example.com", voter_id="V1", password="x"))
+        db.session.add(User(name="Bob", email="bob@example.com", voter_id="V2", password="x"))
+        db.session.commit()
+    return app
+
+
+def _code(app, voter_id):
+    with app.app_context():
+        return get_otp_store().get(voter_id)[0]
+
+
+def _wrong(code):
+    return f"{(int(code) - 100000 + 1) % 900000 + 100000}"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryOTPStore()
+    return SQLiteOTPStore(str(tmp_path / "otp.db"))
+
+
+def test_code_is_dropped_after_max_misses(store):
+    store.put("V1", "123456")
+    for _ in range(OTP_MAX_MISSES - 1):
+        assert store.verify("V1", "000000") is False
+    assert store.get("V1") is not None
+    assert store.verify("V1", "000000") is False
+    assert store.get("V1") is None
+    # the right code is no use once the misses ran out
+    assert store.verify("V1", "123456") is False
+
+
+def test_new_code_starts_a_fresh_miss_count(store):
+    store.put("V1", "123456")
+    for _ in range(OTP_MAX_MISSES - 1):
+        store.verify("V1", "000000")
+    store.put("V1", "654321")
+    for _ in range(OTP_MAX_MISSES - 1):
+        store.verify("V1", "000000")
+    assert store.verify("V1", "654321") is True
+
+
+def test_sqlite_store_upgrades_a_table_without_misses(tmp_path):
+    path = str(tmp_path / "otp.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE otp_codes (key TEXT PRIMARY KEY, otp TEXT NOT NULL, expiry REAL NOT NULL)")
+        conn.execute("INSERT INTO otp_codes VALUES ('V1', '123456', 9e12)")
+    store = SQLiteOTPStore(path)
+    assert store.verify("V1", "000000") is False
+    assert store.verify("V1", "123456") is True
+
+
+def test_voter_id_from_the_form_is_ignored(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    with client.session_transaction() as session:
+        session.clear()
+    # a code for V1 exists, but this session never asked for one
+    client.post("/verify_otp", data={"voter_id": "V1", "otp": _code(app, "V1")})
+    with client.session_transaction() as session:
+        assert "user_id" not in session
+
+
+def test_verify_checks_the_voter_the_session_asked_for(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    # naming someone else in the form does not redirect the guess
+    client.post("/verify_otp", data={"voter_id": "V2", "otp": _code(app, "V1")})
+    with client.session_transaction() as session:
+        assert session["user_name"] == "Ann"
+
+
+def test_guessing_through_the_endpoint_burns_the_code(tmp_path):
+    app = _app(tmp_path, OTP_VERIFY_VOTER_BUCKET=(100, 60.0))
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    code = _code(app, "V1")
+    for _ in range(OTP_MAX_MISSES):
+        client.post("/verify_otp", data={"otp": _wrong(code)})
+    client.post("/verify_otp", data={"otp": code})
+    with client.session_transaction() as session:
+        assert "user_id" not in session
+
+
+def test_verify_is_rate_limited_per_voter_across_ips(tmp_path):
+    app = _app(tmp_path, OTP_VERIFY_VOTER_BUCKET=(3, 60.0))
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    statuses = [
+        client.post("/verify_otp", data={"otp": "000000"}, environ_base={"REMOTE_ADDR": f"10.0.4.{i}"}).status_code
+        for i in range(5)
+    ]
+    assert statuses == [302, 302, 302, 429, 429]
+
+
+def test_verify_is_rate_limited_per_ip(tmp_path):
+    app = _app(tmp_path, OTP_VERIFY_IP_BUCKET=(2, 60.0))
+    client = app.test_client()
+    client.post("/get_otp", data={"voter_id": "V1"})
+    statuses = [client.post("/verify_otp", data={"otp": "000000"}).status_code for _ in range(3)]
+    assert statuses == [302, 302, 429]
+
+
+def test_sqlite_store_opens_no_connection_until_used(tmp_path):
+    # the app is built before the server forks; nothing may be inherited
+    store = SQLiteOTPStore(str(tmp_path / "otp.db"))
+    assert getattr(store._local, "conn", None) is None
+    store.put("V1", "123456")
+    assert store.verify("V1", "123456") is True
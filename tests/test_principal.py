@@ -0,0 +1,85 @@
+from datetime import datetime
+
+from conftest import make_app
+from models import db, User, Candidate, Vote
+import principal
+
+
+def _app(tmp_path, **config):
+    app = make_app(tmp_path, VOTER_PRINCIPAL_TTL=30, **config)
+    with app.app_context():
+        db.session.add(Candidate(name="M1", party="P", position="Mayor"))
+        db.session.add(Candidate(name="C1", party="P", position="Council"))
+        db.session.add(User(name="Ann", email="ann@example.com", voter_id="V1", password="x"))
+        db.session.commit()
+    return app
+
+
+def _vote_behind_the_cache(app, candidate_id, position):
+    # an out-of-band change the cached principal knows nothing about
+    with app.app_context():
+        db.session.add(Vote(voter_id=1, candidate_id=candidate_id, position=position, timestamp=datetime.utcnow()))
+        db.session.commit()
+
+
+def test_cached_principal_expires_after_the_ttl(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    clock = [1000.0]
+    monkeypatch.setattr(principal.time, "time", lambda: clock[0])
+    with app.test_request_context("/"):
+        assert principal.get(1).voted == frozenset()
+        _vote_behind_the_cache(app, 1, "Mayor")
+
+        clock[0] += 29
+        assert principal.get(1).voted == frozenset()
+        clock[0] += 1
+        assert principal.get(1).voted == {"Mayor"}
+
+
+def test_zero_ttl_disables_the_cache(tmp_path):
+    app = make_app(tmp_path, VOTER_PRINCIPAL_TTL=0)
+    with app.app_context():
+        db.session.add(User(name="Ann", email="ann@example.com", voter_id="V1", password="x"))
+        db.session.commit()
+    with app.test_request_context("/"):
+        assert principal.get(1).name == "Ann"
+        assert principal.cached(1) is None
+
+
+def _cached_voted(client):
+    with client.session_transaction() as session:
+        entry = session.get(principal._KEY)
+    return None if entry is None else set(entry[3])
+
+
+def test_ballot_drops_the_cached_principal(tmp_path):
+    app = _app(tmp_path, VOTE_GROUP_COMMIT=False)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_name"] = "Ann"
+    client.get("/dashboard")
+    assert _cached_voted(client) == set()
+
+    response = client.post("/ballot", json={"selections": {"Mayor": 1}})
+    assert response.status_code == 200
+    assert _cached_voted(client) is None
+    client.get("/dashboard")
+    assert _cached_voted(client) == {"Mayor"}
+
+
+def test_already_voted_refusal_drops_a_stale_principal(tmp_path):
+    app = _app(tmp_path, VOTE_GROUP_COMMIT=False)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_name"] = "Ann"
+    client.get("/dashboard")
+    _vote_behind_the_cache(app, 1, "Mayor")
+    assert _cached_voted(client) == set()
+
+    response = client.post("/ballot", json={"selections": {"Mayor": 1}})
+    assert response.status_code == 409
+    assert _cached_voted(client) is None
+    client.get("/dashboard")
+    assert _cached_voted(client) == {"Mayor"}
@@ -0,0 +1,113 @@
+import re
+
+import pytest
+from sqlalchemy import event
+
+from conftest import make_app
+from models import db, User, Candidate, Vote
+import ballot_box
+import results
+import stats
+import tally
+
+# The catalogue is small and read whole, in primary-key order, on purpose.
+WHOLE_TABLE_READS = {"candidate"}
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path, TALLY_SHARDS=4, VOTE_GROUP_COMMIT=False)
+    with app.app_context():
+        db.session.add_all(
+            Candidate(name=f"C{i}", party="P", position=f"Race {i % 3}") for i in range(9)
+        )
+        db.session.add_all(
+            User(name=f"V{i}", email=f"v{i}@example.com", voter_id=f"V{i}", password="x") for i in range(50)
+        )
+        db.session.commit()
+    return app
+
+
+def _selects(fn):
+    """Run ``fn`` and return the (statement, parameters) of every SELECT it issued."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            seen.append((statement, parameters))
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        fn()
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+    return seen
+
+
+def _plan(statement, parameters=()):
+    with db.engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def _plans(fn):
+    return [(statement, _plan(statement, parameters)) for statement, parameters in _selects(fn)]
+
+
+def _full_scans(plan):
+    return [m.group(1) for m in map(_FULL_SCAN.match, plan) if m and m.group(1) not in WHOLE_TABLE_READS]
+
+
+def test_vote_lookup_by_voter_uses_unique_index(app):
+    with app.app_context():
+        (statement, plan), = _plans(lambda: ballot_box.voted_positions(1))
+    assert any("USING COVERING INDEX uq_vote_voter_position (voter_id=?)" in step for step in plan), plan
+
+
+def test_vote_lookup_by_voter_and_position_uses_unique_index(app):
+    with app.app_context():
+        query = Vote.query.filter(Vote.voter_id == 1, Vote.position == "Race 0")
+        (statement, plan), = _plans(query.all)
+    assert any("USING INDEX uq_vote_voter_position (voter_id=? AND position=?)" in step for step in plan), plan
+
+
+def test_tally_read_merges_shards_by_primary_key(app):
+    with app.app_context():
+        plans = _plans(tally.candidate_totals)
+    shard_plan = next(plan for statement, plan in plans if "tally_shard" in statement)
+    assert any("USING INDEX sqlite_autoindex_tally_shard_1" in step for step in shard_plan), shard_plan
+    assert not [scan for _, plan in plans for scan in _full_scans(plan)]
+
+
+def test_stats_counts_come_from_has_voted_index(app):
+    with app.app_context():
+        stats.invalidate()
+        plans = _plans(stats.compute)
+    steps = [step for _, plan in plans for step in plan]
+    assert any("SEARCH user USING COVERING INDEX ix_user_has_voted (has_voted=?)" in step for step in steps), steps
+    assert any("SEARCH tally_shard USING INDEX sqlite_autoindex_tally_shard_1 (candidate_id=?)" in step
+               for step in steps), steps
+    assert not [scan for _, plan in plans for scan in _full_scans(plan)]
+
+
+def test_results_version_reads_no_table(app):
+    with app.app_context():
+        plans = _plans(results.results_version)
+    assert not [scan for _, plan in plans for scan in _full_scans(plan)]
+
+
+def test_casting_a_ballot_scans_no_table(app):
+    with app.app_context():
+        races = {}
+        for c in Candidate.query.order_by(Candidate.id):
+            races.setdefault(c.position, c.id)
+        user_ids = [u.id for u in User.query.order_by(User.id).limit(2)]
+        # a voter's second ballot runs the already-voted path as well
+        ballot_box.cast(user_ids[0], list(races.values())[:1])
+        plans = _plans(lambda: [ballot_box.cast(uid, list(races.values())) for uid in user_ids])
+    assert plans
+    scans = {statement: _full_scans(plan) for statement, plan in plans if _full_scans(plan)}
+    assert not scans, scans
@@ -0,0 +1,52 @@
+from conftest import make_app
+import results
+import results_stream
+
+
+def _app(tmp_path, **config):
+    return make_app(tmp_path, RESULTS_STREAM_MAX_SUBSCRIBERS=2, **config)
+
+
+def _open(client):
+    response = client.get("/admin/live_votes/stream", buffered=False)
+    if response.status_code == 200:
+        # the first frame is sent as soon as the subscription is taken
+        assert next(iter(response.response)).startswith(b"retry:")
+    return response
+
+
+def test_subscribers_past_the_cap_get_503(tmp_path):
+    app = _app(tmp_path)
+    client = app.test_client()
+    broadcaster = results_stream.get_broadcaster(app)
+
+    first, second = _open(client), _open(client)
+    assert (first.status_code, second.status_code) == (200, 200)
+    refused = _open(client)
+    assert refused.status_code == 503
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert len(broadcaster._subscribers) == 2
+
+    # a closed stream frees its slot
+    first.close()
+    third = _open(client)
+    assert third.status_code == 200
+    second.close()
+    third.close()
+    assert not broadcaster._subscribers
+
+
+def test_stream_closed_before_it_is_read_releases_its_slot(tmp_path):
+    app = _app(tmp_path)
+    broadcaster = results_stream.get_broadcaster(app)
+    with app.app_context():
+        streams = [results_stream.event_stream(results.snapshot()) for _ in range(2)]
+        try:
+            results_stream.event_stream(results.snapshot())
+        except results_stream.StreamFull:
+            pass
+        else:
+            raise AssertionError("subscribed past the cap")
+        for stream in streams:
+            stream.close()
+    assert not broadcaster._subscribers
@@ -0,0 +1,31 @@
+import os
+import time
+
+import sessions
+
+
+def test_store_keeps_no_connection_open_after_creating_the_schema(tmp_path):
+    store = sessions.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    assert getattr(store._local, "conn", None) is None
+    store.save("a" * 22, {"user_id": 1}, time.time() + 60)
+    assert store.load("a" * 22)[1] == {"user_id": 1}
+
+
+def test_forked_worker_opens_its_own_connection(tmp_path):
+    store = sessions.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    parent = store._conn()
+    store.save("p" * 22, {"who": "parent"}, time.time() + 60)
+
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = store._conn() is not parent
+            store.save("c" * 22, {"who": "child"}, time.time() + 60)
+            ok = ok and store.load("p" * 22)[1] == {"who": "parent"}
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert store._conn() is parent
+    assert store.load("c" * 22)[1] == {"who": "child"}
@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func
+
+from conftest import make_app
+from models import db, User, Candidate, Vote, TallyShard
+import ballot_box
+import tally
+
+THREADS = 8
+VOTERS = 200
+
+
+def _seed(app):
+    with app.app_context():
+        db.session.add_all(Candidate(name=f"M{i}", party="P", position="Mayor") for i in range(3))
+        db.session.add_all(Candidate(name=f"C{i}", party="P", position="Council") for i in range(2))
+        db.session.add_all(
+            User(name=f"V{i}", email=f"v{i}@example.com", voter_id=f"V{i}", password="x") for i in range(VOTERS)
+        )
+        db.session.commit()
+        mayor = [c.id for c in Candidate.query.filter_by(position="Mayor").order_by(Candidate.id)]
+        council = [c.id for c in Candidate.query.filter_by(position="Council").order_by(Candidate.id)]
+        return [u.id for u in User.query.order_by(User.id)], mayor, council
+
+
+@pytest.mark.parametrize("group_commit", [True, False], ids=["group-commit", "commit-per-ballot"])
+@pytest.mark.parametrize("shards", [1, 4])
+def test_parallel_casts_keep_tallies_exact(tmp_path, shards, group_commit):
+    app = make_app(tmp_path, TALLY_SHARDS=shards, VOTE_GROUP_COMMIT=group_commit)
+    user_ids, mayor, council = _seed(app)
+
+    # every voter sends two different two-race ballots from different
+    # threads, so each voter's ballots race each other
+    ballots = [(uid, [mayor[n % 3], council[n % 2]]) for n, uid in enumerate(user_ids)]
+    repeats = [(uid, [mayor[(n + 1) % 3], council[(n + 1) % 2]]) for n, uid in enumerate(user_ids)]
+    # rotated by one so a voter's repeat lands on the neighbouring thread
+    ballots += repeats[-1:] + repeats[:-1]
+    start = threading.Barrier(THREADS)
+
+    def cast(chunk):
+        start.wait()
+        with app.app_context():
+            return [ballot_box.cast(uid, cids) for uid, cids in chunk]
+
+    chunks = [ballots[i::THREADS] for i in range(THREADS)]
+    with ThreadPoolExecutor(THREADS) as pool:
+        outcomes = [o for chunk in pool.map(cast, chunks) for o in chunk]
+
+    assert ballot_box.ERROR not in outcomes
+    # exactly one of each voter's two ballots got in
+    assert outcomes.count(ballot_box.RECORDED) == VOTERS
+    assert outcomes.count(ballot_box.ALREADY_VOTED) == VOTERS
+
+    with app.app_context():
+        recorded = db.session.query(func.count(Vote.id)).scalar()
+        totals = tally.candidate_totals()
+        per_candidate = dict(db.session.query(Vote.candidate_id, func.count(Vote.id)).group_by(Vote.candidate_id))
+        voters_per_race = dict(
+            db.session.query(Vote.position, func.count(func.distinct(Vote.voter_id))).group_by(Vote.position)
+        )
+
+        assert sum(totals.values()) == recorded
+        assert totals == {cid: per_candidate.get(cid, 0) for cid in mayor + council}
+        # one vote per voter per race
+        assert max(n for (n,) in db.session.query(func.count(Vote.id)).group_by(Vote.voter_id, Vote.position)) == 1
+        assert voters_per_race == {"Mayor": VOTERS, "Council": VOTERS}
+        assert db.session.query(func.count(User.id)).filter(User.has_voted.is_(True)).scalar() == VOTERS
+
+    if shards > 1:
+        result = app.test_cli_runner().invoke(args=["fold-tallies"])
+        assert result.exit_code == 0, result.output
+        assert f"folded {recorded} votes" in result.output
+        with app.app_context():
+            assert tally.candidate_totals() == totals
+            assert dict(db.session.query(Candidate.id, Candidate.votes)) == totals
+            assert not db.session.query(TallyShard).filter(TallyShard.votes != 0).count()
+
+
+def test_committer_spreads_increments_over_shards(tmp_path):
+    # group commit has one committer thread per process; it must still use every shard
+    app = make_app(tmp_path, TALLY_SHARDS=4)
+    user_ids, mayor, _ = _seed(app)
+    with app.app_context():
+        for uid in user_ids[:40]:
+            assert ballot_box.cast(uid, [mayor[0]]) == ballot_box.RECORDED
+        shards = dict(db.session.query(TallyShard.shard, TallyShard.votes).filter_by(candidate_id=mayor[0]))
+    assert sum(shards.values()) == 40
+    assert len(shards) > 1
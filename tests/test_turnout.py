@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_app
+from models import db
+import turnout
+
+
+def _admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_name"] = "admin"
+    return client
+
+
+def _app_with_votes(tmp_path, *ages, **config):
+    """Rollup with one vote ``age`` ago for each of ``ages``."""
+    app = make_app(tmp_path, **config)
+    now = datetime.utcnow()
+    with app.app_context():
+        turnout.record((now - age, "Mayor", 1) for age in ages)
+        db.session.commit()
+    return app
+
+
+def test_since_before_first_vote_is_clamped(tmp_path):
+    app = _app_with_votes(tmp_path, timedelta(minutes=30), timedelta(minutes=5))
+    response = _admin_client(app).get("/admin/turnout?since=2000-01-01&resolution=minute")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["resolution_seconds"] == turnout.MINUTE
+    assert 26 <= len(body["labels"]) <= 32
+    assert body["cumulative"][-1] == 2
+
+
+def test_since_after_until_is_rejected(tmp_path):
+    app = _app_with_votes(tmp_path, timedelta(minutes=5))
+    response = _admin_client(app).get("/admin/turnout?since=2024-01-02T00:00:00Z&until=2024-01-01T00:00:00Z")
+    assert response.status_code == 400
+
+
+def test_long_minute_window_is_coarsened_to_hours(tmp_path):
+    app = _app_with_votes(tmp_path, timedelta(hours=30), timedelta(minutes=5), TURNOUT_MAX_POINTS=100)
+    body = _admin_client(app).get("/admin/turnout?resolution=minute").get_json()
+    assert body["resolution_seconds"] == turnout.HOUR
+    assert len(body["labels"]) <= 100
+    assert body["cumulative"][-1] == 2
+
+
+def test_window_too_long_for_hourly_buckets_is_refused(tmp_path):
+    app = _app_with_votes(tmp_path, timedelta(days=10), TURNOUT_MAX_POINTS=100)
+    response = _admin_client(app).get("/admin/turnout?resolution=hour")
+    assert response.status_code == 400
+    with app.app_context(), pytest.raises(turnout.WindowTooLarge):
+        turnout.series("", resolution=turnout.HOUR)
+
+
+def test_window_entirely_before_first_vote_is_empty(tmp_path):
+    app = _app_with_votes(tmp_path, timedelta(minutes=5))
+    body = _admin_client(app).get("/admin/turnout?since=2000-01-01&until=2000-01-02").get_json()
+    assert body["labels"] == []
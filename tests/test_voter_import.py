@@ -0,0 +1,128 @@
+import io
+import time
+
+from conftest import make_app
+from models import User
+import credentials
+import job_status
+import voter_import
+
+
+def _app(tmp_path, **config):
+    return make_app(tmp_path, PASSWORD_HASH_ROUNDS=4, **config)
+
+
+def _admin(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_name"] = "admin"
+    return client
+
+
+def _roll(rows, passwords=False):
+    lines = ["name,email,voter_id" + (",password" if passwords else "")]
+    for i in range(rows):
+        lines.append(f"V{i},v{i}@example.com,V{i}" + (f",pw{i}" if passwords else ""))
+    return "\n".join(lines) + "\n"
+
+
+def _upload(client, text):
+    return client.post(
+        "/admin/import_voters",
+        data={"file": (io.BytesIO(text.encode("utf-8")), "roll.csv")},
+        content_type="multipart/form-data",
+    )
+
+
+def _wait(client, url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(url).get_json()
+        if status["state"] in (voter_import.DONE, voter_import.FAILED) or time.monotonic() > deadline:
+            return status
+        time.sleep(0.05)
+
+
+class _RecordingPool(voter_import.ProcessPoolExecutor):
+    started = []
+
+    def __init__(self, *args, mp_context=None, **kwargs):
+        _RecordingPool.started.append(mp_context.get_start_method() if mp_context else None)
+        super().__init__(*args, mp_context=mp_context, **kwargs)
+
+
+def test_upload_runs_as_a_background_job(tmp_path):
+    app = _app(tmp_path)
+    client = _admin(app)
+    response = _upload(client, _roll(25) + "Bad,,V99\nDup,v0@example.com,V0\n")
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status_url"] == f"/admin/import_voters/{body['job_id']}"
+
+    status = _wait(client, body["status_url"])
+    assert status["state"] == voter_import.DONE
+    assert (status["processed"], status["inserted"], status["rejected"]) == (27, 25, 2)
+    assert {r["reason"] for r in status["rejects"]} == {"missing field", "duplicate voter_id in file"}
+    with app.app_context():
+        assert User.query.count() == 25
+
+
+def test_roll_without_passwords_starts_no_pool(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    _RecordingPool.started = []
+    monkeypatch.setattr(voter_import, "ProcessPoolExecutor", _RecordingPool)
+    with app.app_context():
+        report = voter_import.import_voters(io.StringIO(_roll(50)), chunk_size=10)
+        assert report.inserted == 50
+        assert {u.password for u in User.query} == {credentials.OTP_ONLY}
+    assert _RecordingPool.started == []
+
+
+def test_passwords_are_hashed_in_spawned_processes(tmp_path, monkeypatch):
+    app = _app(tmp_path)
+    _RecordingPool.started = []
+    monkeypatch.setattr(voter_import, "ProcessPoolExecutor", _RecordingPool)
+    with app.app_context():
+        report = voter_import.import_voters(io.StringIO(_roll(6, passwords=True)), chunk_size=2, workers=1)
+        assert report.inserted == 6
+        user = User.query.filter_by(voter_id="V3").one()
+        assert credentials.check_password(user.password, "pw3")
+    # one pool for the whole import, never forked
+    assert _RecordingPool.started == ["spawn"]
+
+
+def test_unknown_job_is_404(tmp_path):
+    app = _app(tmp_path)
+    client = _admin(app)
+    assert client.get("/admin/import_voters/" + "0" * 32).status_code == 404
+
+
+def test_status_needs_an_admin(tmp_path):
+    app = _app(tmp_path)
+    response = app.test_client().get("/admin/import_voters/" + "0" * 32)
+    assert response.status_code == 302
+
+
+def test_status_is_visible_from_another_worker(tmp_path):
+    # two apps on one database and one status file stand in for two worker processes
+    shared = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'shared.db'}",
+        "IMPORT_STATUS_BACKEND": "sqlite",
+        "OTP_STORE_PATH": str(tmp_path / "otp.db"),
+    }
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first, second = _app(tmp_path / "a", **shared), _app(tmp_path / "b", **shared)
+    job_id = _upload(_admin(first), _roll(5)).get_json()["job_id"]
+    status = _wait(_admin(second), f"/admin/import_voters/{job_id}")
+    assert status["state"] == voter_import.DONE
+    assert status["inserted"] == 5
+
+
+def test_status_store_opens_no_connection_until_used(tmp_path):
+    # the app is built before the server forks; nothing may be inherited
+    store = job_status.SQLiteStatusStore(str(tmp_path / "otp.db"), "import_status")
+    assert getattr(store._local, "conn", None) is None
+    store.set("job", "running")
+    assert store.get("job") == "running"
@@ -0,0 +1,207 @@
+import calendar
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Vote, TurnoutBucket
+from database import read_session
+
+# Turnout time series.
+#
+# Every committed vote is also counted into per-minute and per-hour buckets
+# (TurnoutBucket rows keyed by resolution, scope and bucket start), in the
+# same transaction as the Vote rows, so the rollup can never disagree with
+# the ledger. Scopes:
+#   ""            all votes
+#   "p:<position>" votes in one race
+#   "c:<id>"       votes for one candidate
+# A chart of a whole election day is then 24 hourly or 1440 per-minute rows
+# read by primary-key range, however many votes were cast. Empty buckets are
+# not stored; series() fills them in. A window is clamped to the span that
+# has votes (first bucket to now), per-minute requests that would exceed
+# TURNOUT_MAX_POINTS (2000) buckets are coarsened to hourly, and a window
+# still too long for that is refused with WindowTooLarge.
+#
+# backfill() rebuilds every bucket from the ledger (migration 5 runs it once
+# for votes cast before rollups existed; `flask backfill-turnout` repairs).
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = (MINUTE, HOUR)
+
+
+class WindowTooLarge(ValueError):
+    pass
+
+
+def scope_for(position=None, candidate_id=None):
+    if candidate_id is not None:
+        return f"c:{candidate_id}"
+    if position is not None:
+        return f"p:{position}"
+    return ""
+
+
+def _epoch(ts):
+    return calendar.timegm(ts.utctimetuple())
+
+
+def _counts(votes):
+    """{(resolution, scope, bucket): n} for an iterable of (timestamp, position, candidate_id)."""
+    counts = {}
+    for ts, position, candidate_id in votes:
+        second = _epoch(ts)
+        for resolution in RESOLUTIONS:
+            bucket = second - second % resolution
+            for scope in ("", f"p:{position}", f"c:{candidate_id}"):
+                key = (resolution, scope, bucket)
+                counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def record(votes):
+    """Count ``votes`` (timestamp, position, candidate_id) into the rollup, in the current transaction."""
+    for (resolution, scope, bucket), n in _counts(votes).items():
+        bump = (
+            db.update(TurnoutBucket)
+            .where(TurnoutBucket.resolution == resolution, TurnoutBucket.scope == scope,
+                   TurnoutBucket.bucket == bucket)
+            .values(votes=TurnoutBucket.votes + n)
+            .execution_options(synchronize_session=False)
+        )
+        if db.session.execute(bump).rowcount == 1:
+            continue
+        # first vote in this bucket: create it, or bump it if another worker just did
+        try:
+            with db.session.begin_nested():
+                db.session.execute(
+                    db.insert(TurnoutBucket).values(resolution=resolution, scope=scope, bucket=bucket, votes=n)
+                )
+        except IntegrityError:
+            db.session.execute(bump)
+
+
+def backfill(conn, batch_size=20000):
+    """Rebuild all buckets from the Vote ledger on ``conn`` (inside its transaction)."""
+    table = TurnoutBucket.__table__
+    # take the write lock first so no ballot commits between the delete and the rebuild
+    conn.execute(table.delete())
+    counts = {}
+    last = 0
+    query = select(Vote.id, Vote.timestamp, Vote.position, Vote.candidate_id).order_by(Vote.id)
+    while True:
+        page = conn.execute(query.where(Vote.id > last).limit(batch_size)).all()
+        if not page:
+            break
+        last = page[-1][0]
+        for key, n in _counts(row[1:] for row in page).items():
+            counts[key] = counts.get(key, 0) + n
+    if counts:
+        conn.execute(table.insert(), [
+            {"resolution": r, "scope": s, "bucket": b, "votes": n} for (r, s, b), n in counts.items()
+        ])
+    return len(counts)
+
+
+def pick_resolution(since, until):
+    """Per-minute for windows up to six hours, hourly beyond."""
+    return MINUTE if until - since <= timedelta(hours=6) else HOUR
+
+
+def bounds(scope=""):
+    """(first, last) bucket start for ``scope`` as UTC datetimes, or None if no votes yet."""
+    low, high = read_session().query(db.func.min(TurnoutBucket.bucket), db.func.max(TurnoutBucket.bucket)).filter(
+        TurnoutBucket.resolution == MINUTE, TurnoutBucket.scope == scope
+    ).one()
+    if low is None:
+        return None
+    return datetime.utcfromtimestamp(low), datetime.utcfromtimestamp(high)
+
+
+def _sum(session, resolution, scope, low, high):
+    query = session.query(db.func.coalesce(db.func.sum(TurnoutBucket.votes), 0)).filter(
+        TurnoutBucket.resolution == resolution, TurnoutBucket.scope == scope, TurnoutBucket.bucket < high
+    )
+    if low is not None:
+        query = query.filter(TurnoutBucket.bucket >= low)
+    return query.scalar()
+
+
+def _points(since, until, resolution):
+    start = _epoch(since) - _epoch(since) % resolution
+    return (_epoch(until) - start) // resolution + 1
+
+
+def series(scope="", since=None, until=None, resolution=None):
+    """Buckets from ``since`` to ``until`` (UTC): [(bucket start, votes, cumulative)] with gaps filled.
+
+    ``cumulative`` includes every vote in ``scope`` before ``since``. Raises
+    ValueError if ``since`` is after ``until`` and WindowTooLarge if even
+    hourly buckets would exceed TURNOUT_MAX_POINTS.
+    """
+    if since and until and since > until:
+        raise ValueError("since must not be after until")
+    span = bounds(scope)
+    if span is None:
+        return resolution or MINUTE, []
+    # nothing to chart before the first vote or after now
+    latest = max(span[1], datetime.utcnow())
+    since = max(since, span[0]) if since else span[0]
+    until = min(until, latest) if until else latest
+    if since > until:
+        return resolution or MINUTE, []
+    resolution = resolution or pick_resolution(since, until)
+    max_points = current_app.config.get("TURNOUT_MAX_POINTS", 2000)
+    if resolution == MINUTE and _points(since, until, MINUTE) > max_points:
+        resolution = HOUR
+    if _points(since, until, resolution) > max_points:
+        raise WindowTooLarge(f"window spans more than {max_points} hourly buckets")
+    start = _epoch(since) - _epoch(since) % resolution
+    end = _epoch(until)
+
+    session = read_session()
+    rows = dict(
+        session.query(TurnoutBucket.bucket, TurnoutBucket.votes).filter(
+            TurnoutBucket.resolution == resolution, TurnoutBucket.scope == scope,
+            TurnoutBucket.bucket >= start, TurnoutBucket.bucket <= end,
+        )
+    )
+    # votes before the window: whole hours, then the minutes of the first hour
+    hour_start = start - start % HOUR
+    before = _sum(session, HOUR, scope, None, hour_start) + _sum(session, MINUTE, scope, hour_start, start)
+
+    points, total = [], before
+    for bucket in range(start, end + 1, resolution):
+        n = rows.get(bucket, 0)
+        total += n
+        points.append((datetime.utcfromtimestamp(bucket), n, total))
+    return resolution, points
+
+
+def rates(scope="", windows=(5, 15, 60), now=None):
+    """Votes per minute over the last ``windows`` minutes, from per-minute buckets."""
+    now = _epoch(now or datetime.utcnow())
+    current = now - now % MINUTE
+    widest = max(windows)
+    rows = read_session().query(TurnoutBucket.bucket, TurnoutBucket.votes).filter(
+        TurnoutBucket.resolution == MINUTE, TurnoutBucket.scope == scope,
+        TurnoutBucket.bucket > current - widest * MINUTE, TurnoutBucket.bucket <= current,
+    ).all()
+    result = {}
+    for window in windows:
+        cutoff = current - window * MINUTE
+        result[window] = round(sum(n for bucket, n in rows if bucket > cutoff) / window, 3)
+    return result
+
+
+@click.command("backfill-turnout")
+@with_appcontext
+def backfill_turnout_command():
+    """Rebuild the turnout rollup from the vote ledger."""
+    with db.engine.begin() as conn:
+        buckets = backfill(conn)
+    click.echo(f"rebuilt {buckets} turnout buckets")
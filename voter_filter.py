@@ -0,0 +1,283 @@
+import hashlib
+import math
+import threading
+import time
+from flask import current_app
+
+from models import db, User
+from database import read_session
+
+# Registration pre-check: a Bloom filter over every User.voter_id and email.
+#
+# Nearly every registration is for a new voter, so the duplicate check before
+# the insert almost always finds nothing. The filter answers "definitely not
+# registered" from memory and the query is skipped; only when it says "maybe"
+# (an existing voter, or a false positive at the configured rate) does the
+# check go to the database. The unique constraints on User stay the final
+# authority, so the register views also handle an IntegrityError.
+#
+# Each process builds its filter from the User table on a background thread,
+# started by the first check; until it is ready every check goes to the
+# database as before. The process adds voters to the filter as it inserts
+# them, and at most once per REGISTRATION_FILTER_SYNC_SECONDS it also reads
+# the users other workers inserted since (a primary-key range past the last
+# id it saw). A duplicate registered by another worker inside that window
+# gets past the filter and is stopped by the unique constraint. Voters are
+# never deleted, so the filter never has to forget.
+#
+# Config:
+#   REGISTRATION_FILTER              use the filter (True)
+#   REGISTRATION_FILTER_ERROR_RATE   target false-positive rate (0.001)
+#   REGISTRATION_FILTER_CAPACITY     voters to size for (default: twice the
+#                                    current roll, at least 100000); rebuilt
+#                                    twice as large, in the background, once
+#                                    exceeded
+#   REGISTRATION_FILTER_MAX_BYTES    memory cap for the bit array (none); if
+#                                    it binds, the false-positive rate rises
+#   REGISTRATION_FILTER_SYNC_SECONDS catch-up interval (1.0)
+#
+# stats() reports size, fill, expected and observed false-positive rate, and
+# how many checks skipped the database (GET /admin/registration-filter).
+
+VOTER_ID = "voter_id"
+EMAIL = "email"
+_PAGE = 5000
+
+
+class BloomFilter:
+    """Bit array with ``hashes`` probes per key, derived from one BLAKE2b digest."""
+
+    def __init__(self, capacity, error_rate, max_bytes=None):
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes:
+            bits = min(bits, max_bytes * 8)
+        self.bits = max(64, bits)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _probes(self, key):
+        # double hashing: probe i is (h1 + i * h2) mod bits, kept to small ints
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        bits = self.bits
+        h1 = int.from_bytes(digest[:8], "little") % bits
+        h2 = int.from_bytes(digest[8:], "little") % bits or 1
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def update(self, keys):
+        probes = [self._probes(key) for key in keys]
+        with self._lock:
+            array = self._array
+            for key_probes in probes:
+                new = False
+                for p in key_probes:
+                    byte, mask = p >> 3, 1 << (p & 7)
+                    if not array[byte] & mask:
+                        array[byte] |= mask
+                        new = True
+                # a key already present (re-read by a sync) is not counted twice
+                if new:
+                    self.count += 1
+
+    def add(self, key):
+        self.update((key,))
+
+    def __contains__(self, key):
+        array = self._array
+        return all(array[p >> 3] & (1 << (p & 7)) for p in self._probes(key))
+
+    @property
+    def nbytes(self):
+        return len(self._array)
+
+    def expected_error_rate(self):
+        """False-positive rate at the current fill: (1 - e^(-kn/m))^k."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+def _key(kind, value):
+    return f"{kind}\x00{value}"
+
+
+class RegistrationFilter:
+
+    def __init__(self, app):
+        config = app.config
+        self.app = app
+        self.error_rate = config.get("REGISTRATION_FILTER_ERROR_RATE", 0.001)
+        self.capacity = config.get("REGISTRATION_FILTER_CAPACITY")
+        self.max_bytes = config.get("REGISTRATION_FILTER_MAX_BYTES")
+        self.sync_seconds = config.get("REGISTRATION_FILTER_SYNC_SECONDS", 1.0)
+        self._bloom = None
+        self._last_id = 0
+        self._synced_at = 0.0
+        self._building = False
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.build_seconds = None
+        # lookups answered by the filter, ruled out by it, then sent to the
+        # database and found there; and lookups made before it was built
+        self.checks = self.skipped = self.queried = self.found = 0
+        self.unfiltered = 0
+
+    def _start_build(self, voters=None):
+        # caller holds self._lock
+        self._building = True
+        threading.Thread(target=self._build, args=(voters,), name="registration-filter", daemon=True).start()
+
+    def _build(self, voters):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                session = read_session()
+                roll = session.query(db.func.count(User.id)).scalar() or 0
+                voters = voters or self.capacity or max(2 * roll, 100000)
+                if voters < roll:
+                    voters = 2 * roll
+                # two keys per voter
+                bloom = BloomFilter(2 * voters, self.error_rate, self.max_bytes)
+                last = self._read_since(session, bloom, 0)
+                with self._lock:
+                    # rows committed during the build are picked up by the next sync
+                    self._bloom, self._last_id = bloom, last
+                    self._synced_at = time.monotonic()
+                self.build_seconds = round(time.perf_counter() - started, 3)
+                self.app.logger.info(
+                    "Registration filter: %d voters, %d KiB, %d hashes, expected false positives %.2g",
+                    bloom.count // 2, bloom.nbytes // 1024, bloom.hashes, bloom.expected_error_rate(),
+                )
+        except Exception:
+            self.app.logger.exception("Registration filter build failed; checks keep using the database")
+        finally:
+            self._building = False
+
+    @staticmethod
+    def _read_since(session, bloom, last):
+        query = session.query(User.id, User.voter_id, User.email).order_by(User.id)
+        while True:
+            page = query.filter(User.id > last).limit(_PAGE).all()
+            if not page:
+                return last
+            bloom.update(_key(kind, value) for _, voter_id, email in page
+                         for kind, value in ((VOTER_ID, voter_id), (EMAIL, email)))
+            last = page[-1][0]
+
+    def _current(self):
+        """The filter, caught up with other workers' inserts; None while the first build runs."""
+        now = time.monotonic()
+        bloom = self._bloom
+        if bloom is not None and now - self._synced_at < self.sync_seconds:
+            return bloom
+        with self._lock:
+            bloom = self._bloom
+            if not self._building:
+                if bloom is None:
+                    self._start_build()
+                elif bloom.count > bloom.capacity:
+                    self._start_build(bloom.capacity)  # twice the voters: capacity counts keys
+            if bloom is not None and now - self._synced_at >= self.sync_seconds:
+                self._last_id = self._read_since(read_session(), bloom, self._last_id)
+                self._synced_at = now
+        return bloom
+
+    def might_contain(self, kind, value):
+        bloom = self._current()
+        if bloom is None:
+            with self._stats_lock:
+                self.unfiltered += 1
+            return True
+        present = _key(kind, value) in bloom
+        with self._stats_lock:
+            self.checks += 1
+            if not present:
+                self.skipped += 1
+        return present
+
+    def observe(self, queried, found):
+        """Record ``queried`` lookups the filter let through, ``found`` of which existed."""
+        if self._bloom is None:
+            return
+        with self._stats_lock:
+            self.queried += queried
+            self.found += found
+
+    def add(self, voter_id, email):
+        bloom = self._bloom
+        if bloom is not None:  # not built yet: the build will read the row
+            bloom.update((_key(VOTER_ID, voter_id), _key(EMAIL, email)))
+
+    def stats(self):
+        bloom = self._bloom
+        absent = self.skipped + (self.queried - self.found)
+        report = {
+            "built": bloom is not None,
+            "build_seconds": self.build_seconds,
+            "target_error_rate": self.error_rate,
+            "checks": self.checks,
+            "unfiltered_checks": self.unfiltered,
+            "skipped_queries": self.skipped,
+            "queried": self.queried,
+            "found": self.found,
+            "false_positives": self.queried - self.found,
+            "observed_error_rate": round((self.queried - self.found) / absent, 6) if absent else None,
+        }
+        if bloom is not None:
+            report.update({
+                "voters": bloom.count // 2,
+                "capacity_voters": bloom.capacity // 2,
+                "bytes": bloom.nbytes,
+                "hashes": bloom.hashes,
+                "expected_error_rate": round(bloom.expected_error_rate(), 6),
+            })
+        return report
+
+
+_filters = {}
+_filters_lock = threading.Lock()
+
+
+def get_filter(app=None):
+    """The app's RegistrationFilter, or None when REGISTRATION_FILTER is off."""
+    app = app or current_app._get_current_object()
+    if not app.config.get("REGISTRATION_FILTER", True):
+        return None
+    with _filters_lock:
+        f = _filters.get(id(app))
+        if f is None:
+            f = RegistrationFilter(app)
+            _filters[id(app)] = f
+    return f
+
+
+def taken(voter_id=None, email=None):
+    """True if a user already has ``voter_id`` or ``email``; one query at most, none if the filter rules both out."""
+    f = get_filter()
+    clauses = []
+    if voter_id is not None and (f is None or f.might_contain(VOTER_ID, voter_id)):
+        clauses.append(User.voter_id == voter_id)
+    if email is not None and (f is None or f.might_contain(EMAIL, email)):
+        clauses.append(User.email == email)
+    if not clauses:
+        return False
+    found = db.session.query(User.id).filter(db.or_(*clauses)).first() is not None
+    if f is not None:
+        f.observe(1, int(found))
+    return found
+
+
+def maybe_registered(kind, values):
+    """The subset of ``values`` (voter IDs or emails, per ``kind``) the filter cannot rule out."""
+    f = get_filter()
+    if f is None:
+        return list(values)
+    return [v for v in values if f.might_contain(kind, v)]
+
+
+def remember(voter_id, email):
+    """Add a committed voter to this process's filter."""
+    f = get_filter()
+    if f is not None:
+        f.add(voter_id, email)
@@ -0,0 +1,279 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import click
+from sqlalchemy.exc import IntegrityError
+
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, User
+import credentials
+import job_status
+import voter_filter
+
+# Bulk voter-roll import.
+#
+# The CSV is read as a stream and handled in chunks: each chunk is checked for
+# duplicates against the file seen so far and against the User.voter_id/email
+# unique columns with one IN query per column (only for the values the
+# registration filter cannot rule out), its passwords are hashed in a
+# process pool, and the surviving rows are inserted with a single executemany
+# and one commit. Memory is bounded by the chunk size (plus the sets of IDs
+# and emails already seen in this file).
+#
+# Expected columns: name, email, voter_id and optionally password. Rows
+# without a password become OTP-only accounts, as authentication.register
+# creates them, and skip hashing entirely; a roll with no passwords never
+# starts the pool. The pool's processes are spawned, not forked: a web
+# worker already runs the mail, ballot-box and filter threads, and a forked
+# child can inherit one of their locks held.
+#
+# Uploads through the admin page run as a background job, one at a time per
+# process (start_upload). The request only spools the file to disk and
+# returns a job id; the job's progress and final report are kept in a
+# job_status store (IMPORT_STATUS_BACKEND, default OTP_STORE_BACKEND), so
+# any worker can answer upload_status() for it.
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REJECT_DETAILS = 1000
+_IN_BATCH = 500  # stay below SQLite's bound-parameter limit
+STATUS_TTL_SECONDS = 86400
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.processed = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.rejects = []  # (line number, voter_id, reason), first MAX_REJECT_DETAILS only
+
+    def reject(self, line, voter_id, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REJECT_DETAILS:
+            self.rejects.append((line, voter_id, reason))
+
+    def as_dict(self):
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "rejects": [{"line": l, "voter_id": v, "reason": r} for l, v, r in self.rejects],
+        }
+
+
+def _existing(column, values):
+    found = set()
+    values = voter_filter.maybe_registered(column.key, values)
+    for i in range(0, len(values), _IN_BATCH):
+        batch = values[i:i + _IN_BATCH]
+        found.update(v for (v,) in db.session.query(column).filter(column.in_(batch)))
+    f = voter_filter.get_filter()
+    if f is not None:
+        f.observe(len(values), len(found))
+    return found
+
+
+def import_voters(stream, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, progress=None):
+    """Import voters from a CSV text stream and return an ImportReport.
+
+    ``progress`` is called with the report after every committed chunk.
+    """
+    report = ImportReport()
+    rounds = credentials.hash_rounds(current_app.config)
+    seen_ids, seen_emails = set(), set()
+    reader = csv.DictReader(stream)
+    # line numbers are 1-based and count the header row
+    numbered = zip(itertools.count(2), reader)
+
+    pool = None
+    try:
+        while True:
+            chunk = list(itertools.islice(numbered, chunk_size))
+            if not chunk:
+                break
+            report.processed += len(chunk)
+
+            candidates = []
+            for line, row in chunk:
+                name = (row.get("name") or "").strip()
+                email = (row.get("email") or "").strip()
+                voter_id = (row.get("voter_id") or "").strip()
+                if not (name and email and voter_id):
+                    report.reject(line, voter_id, "missing field")
+                elif voter_id in seen_ids:
+                    report.reject(line, voter_id, "duplicate voter_id in file")
+                elif email in seen_emails:
+                    report.reject(line, voter_id, "duplicate email in file")
+                else:
+                    seen_ids.add(voter_id)
+                    seen_emails.add(email)
+                    password = (row.get("password") or "").strip() or None
+                    candidates.append((line, name, email, voter_id, password))
+
+            taken_ids = _existing(User.voter_id, (c[3] for c in candidates))
+            taken_emails = _existing(User.email, (c[2] for c in candidates))
+            fresh = []
+            for c in candidates:
+                if c[3] in taken_ids:
+                    report.reject(c[0], c[3], "voter_id already registered")
+                elif c[2] in taken_emails:
+                    report.reject(c[0], c[3], "email already registered")
+                else:
+                    fresh.append(c)
+
+            passwords = [c[4] for c in fresh if c[4]]
+            if passwords and pool is None:
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            hashes = iter(pool.map(credentials._hash, passwords, itertools.repeat(rounds), chunksize=32)
+                          if passwords else ())
+            rows = [
+                {
+                    "name": c[1], "email": c[2], "voter_id": c[3], "has_voted": False,
+                    "password": next(hashes) if c[4] else credentials.OTP_ONLY,
+                }
+                for c in fresh
+            ]
+            _insert_chunk(rows, fresh, report)
+            if progress:
+                progress(report)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return report
+
+
+def _insert_chunk(rows, fresh, report):
+    if not rows:
+        return
+    try:
+        db.session.execute(db.insert(User), rows)
+        db.session.commit()
+        report.inserted += len(rows)
+        inserted = rows
+    except IntegrityError:
+        # someone registered one of these voters since our check; retry row by row
+        db.session.rollback()
+        inserted = []
+        for row, c in zip(rows, fresh):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(db.insert(User), [row])
+                report.inserted += 1
+                inserted.append(row)
+            except IntegrityError:
+                report.reject(c[0], c[3], "already registered")
+        db.session.commit()
+    for row in inserted:
+        voter_filter.remember(row["voter_id"], row["email"])
+
+
+@click.command("import-voters")
+@click.argument("csv_file", type=click.File("r", encoding="utf-8"))
+@click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option("--workers", default=None, type=int, help="Hashing processes (default: CPU count).")
+@click.option("--rejects", type=click.File("w", encoding="utf-8"), help="Write rejected rows to this CSV.")
+@with_appcontext
+def import_voters_command(csv_file, chunk_size, workers, rejects):
+    """Bulk-import a voter roll from CSV_FILE."""
+    def progress(report):
+        click.echo(
+            f"processed {report.processed}, inserted {report.inserted}, rejected {report.rejected}",
+            err=True,
+        )
+
+    report = import_voters(csv_file, chunk_size=chunk_size, workers=workers, progress=progress)
+    if rejects:
+        writer = csv.writer(rejects)
+        writer.writerow(["line", "voter_id", "reason"])
+        writer.writerows(report.rejects)
+    if report.rejected > len(report.rejects):
+        click.echo(f"only the first {len(report.rejects)} rejected rows are listed", err=True)
+    click.echo(f"done: inserted {report.inserted} of {report.processed} rows, rejected {report.rejected}")
+
+
+class ImportJobs:
+    """Runs uploaded rolls through import_voters() on a background thread."""
+
+    def __init__(self, app):
+        self.app = app
+        backend = app.config.get("IMPORT_STATUS_BACKEND") or app.config.get("OTP_STORE_BACKEND", "sqlite")
+        self._statuses = job_status.open_store(app, "import_status", backend, ttl=STATUS_TTL_SECONDS)
+        # one import at a time: each already uses every core for hashing
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="voter-import")
+
+    def start(self, file_storage):
+        # the upload is gone once the request returns, so spool it to disk first
+        with tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False) as spool:
+            file_storage.save(spool)
+        job_id = uuid.uuid4().hex
+        self._set(job_id, QUEUED, ImportReport())
+        self._executor.submit(self._run, job_id, spool.name)
+        return job_id
+
+    def status(self, job_id):
+        raw = self._statuses.get(job_id) if isinstance(job_id, str) else None
+        return json.loads(raw) if raw else None
+
+    def _set(self, job_id, state, report):
+        self._statuses.set(job_id, json.dumps({"state": state, **report.as_dict()}))
+
+    def _run(self, job_id, path):
+        last = ImportReport()
+
+        def progress(report):
+            nonlocal last
+            last = report
+            self._set(job_id, RUNNING, report)
+
+        try:
+            with self.app.app_context(), open(path, encoding="utf-8-sig", newline="") as stream:
+                self._set(job_id, RUNNING, last)
+                report = import_voters(stream, progress=progress)
+                self.app.logger.info(
+                    "Voter import %s: %s inserted, %s rejected", job_id, report.inserted, report.rejected
+                )
+            self._set(job_id, DONE, report)
+        except Exception:
+            self.app.logger.exception("Voter import %s failed", job_id)
+            self._set(job_id, FAILED, last)
+        finally:
+            os.unlink(path)
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def get_import_jobs(app=None):
+    app = app or current_app._get_current_object()
+    with _jobs_lock:
+        jobs = _jobs.get(id(app))
+        if jobs is None:
+            jobs = ImportJobs(app)
+            _jobs[id(app)] = jobs
+    return jobs
+
+
+def start_upload(file_storage):
+    """Import a werkzeug FileStorage in the background; returns the job id."""
+    return get_import_jobs().start(file_storage)
+
+
+def upload_status(job_id):
+    """{"state", "processed", "inserted", "rejected", "rejects"} for a job, or None if unknown."""
+    return get_import_jobs().status(job_id)
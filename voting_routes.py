@@ -1,69 +1,151 @@
-from flask import render_template, redirect, url_for, session, flash, request, current_app
-from werkzeug.routing import BuildError
-from sqlalchemy.exc import SQLAlchemyError
-from app import app, db, User, Candidate, Vote
-
-def _login_url():
-    try:
-        return url_for('auth.login')
-    except BuildError:
-        try:
-            return url_for('login')
-        except BuildError:
-            return '/login'
+from flask import redirect, url_for, session, flash, request, jsonify
+from models import Vote
+from routes import voter_bp
+import ballot_box
+import catalogue
+import ledger
+import principal
+import results_stream
 
+# The ballot page is routes.dashboard; this module adds the voting actions
+# to the same voter blueprint. /ballot takes one selection per position for
+# any number of races in one request; /vote/<id> is a ballot with a single
+# selection. Either way the ballot box writes all of a ballot's votes and
+# tally updates in one (group) commit, and only returns once it is durable.
+# The voter comes from the session's cached principal (principal.py); once
+# the ballot box answers, after_cast() drops it so the next page rereads the
+# voted state. The helpers below are shared with the ASGI views in
+# async_voter.py.
 
-@app.route('/dashboard')
-def dashboard():
-    if 'user_id' not in session:
-        return redirect(_login_url())
+OUTCOME_STATUS = {
+    ballot_box.RECORDED: 200,
+    ballot_box.ALREADY_VOTED: 409,
+    ballot_box.NO_CANDIDATE: 404,
+    ballot_box.INVALID: 400,
+    ballot_box.ERROR: 503,
+    ballot_box.PENDING: 202,
+}
 
-    user = User.query.get(session['user_id'])
-    if not user:
+
+def _current_voter():
+    user_id = session.get('user_id')
+    user = principal.get(user_id) if user_id else None
+    if user_id and not user:
         session.clear()
-        flash("User not found. Please log in again.", "warning")
-        return redirect(_login_url())
+        flash("User session invalid. Please log in again.", "warning")
+    return user
 
-    candidates = Candidate.query.order_by(Candidate.id).all()
 
-    if getattr(user, "has_voted", False):
-        return render_template('voted.html', user=user)
+def after_cast(outcome):
+    """Tell results listeners about a recorded ballot and drop the voter's cached voted state."""
+    if outcome == ballot_box.RECORDED:
+        results_stream.notify()
+    if outcome in (ballot_box.RECORDED, ballot_box.ALREADY_VOTED, ballot_box.PENDING):
+        # changed (or about to), or the cached copy was behind the ledger
+        principal.invalidate()
 
-    return render_template('dashboard.html', user=user, candidates=candidates)
 
+def flash_outcome(outcome, recorded_message):
+    if outcome == ballot_box.RECORDED:
+        flash(recorded_message, "success")
+    elif outcome == ballot_box.ALREADY_VOTED:
+        flash("You have already voted in that race.", "info")
+    elif outcome == ballot_box.NO_CANDIDATE:
+        flash("Candidate not found.", "danger")
+    elif outcome == ballot_box.INVALID:
+        flash("Choose at most one candidate in each race.", "warning")
+    elif outcome == ballot_box.PENDING:
+        flash("Your ballot is still being recorded. Check your dashboard in a moment before voting again.", "info")
+    else:
+        flash("An error occurred while recording your vote. Please try again.", "danger")
 
-@app.route('/vote/<int:candidate_id>', methods=['POST'])
-def vote(candidate_id):
-    if 'user_id' not in session:
-        return redirect(_login_url())
 
-    user = User.query.get(session['user_id'])
+def read_selections():
+    """(position, candidate_id) pairs from "pos:<position>" form fields or JSON {"selections": {...}}."""
+    if request.is_json:
+        selections = (request.get_json(silent=True) or {}).get("selections")
+        if not isinstance(selections, dict):
+            return None
+        items = selections.items()
+    else:
+        items = ((key[4:], value) for key, value in request.form.items() if key.startswith("pos:"))
+    pairs = []
+    for position, value in items:
+        try:
+            pairs.append((position, int(value)))
+        except (TypeError, ValueError):
+            return None
+    return pairs
+
+
+def precheck(selections):
+    """INVALID or NO_CANDIDATE if the cached catalogue already rules the ballot out, else None.
+
+    The ballot box re-checks everything in its transaction; this only saves
+    queueing ballots that cannot succeed.
+    """
+    if not selections:
+        return ballot_box.INVALID
+    entries = [catalogue.get(cid) for _, cid in selections]
+    if any(e is None for e in entries):
+        return ballot_box.NO_CANDIDATE
+    if not all(e.position == position for e, (position, _) in zip(entries, selections)):
+        return ballot_box.INVALID
+    return None
+
+
+def not_logged_in():
+    if request.is_json:
+        return jsonify({'error': 'Not logged in.'}), 401
+    return redirect(url_for('voter.login'))
+
+
+def ballot_response(selections, outcome):
+    after_cast(outcome)
+    if request.is_json:
+        positions = sorted(position for position, _ in selections or ())
+        return jsonify({'outcome': outcome, 'positions': positions}), OUTCOME_STATUS[outcome]
+    races = len(selections or ())
+    flash_outcome(outcome, f"Your ballot has been recorded ({races} race{'s' if races != 1 else ''}).")
+    return redirect(url_for('voter.dashboard'))
+
+
+@voter_bp.route('/ballot', methods=['POST'])
+def ballot():
+    user = _current_voter()
     if not user:
-        session.clear()
-        flash("User session invalid. Please log in again.", "warning")
-        return redirect(_login_url())
+        return not_logged_in()
+
+    selections = read_selections()
+    outcome = precheck(selections)
+    if outcome is None:
+        outcome = ballot_box.cast(user.id, [cid for _, cid in selections])
+    return ballot_response(selections, outcome)
+
 
-    candidate = Candidate.query.get(candidate_id)
+@voter_bp.route('/vote/<int:candidate_id>', methods=['POST'])
+def vote(candidate_id):
+    user = _current_voter()
+    if not user:
+        return redirect(url_for('voter.login'))
+
+    candidate = catalogue.get(candidate_id)
     if not candidate:
         flash("Candidate not found.", "danger")
-        return redirect(url_for('dashboard'))
-
-    if getattr(user, "has_voted", False):
-        flash("You have already voted.", "info")
-        return redirect(url_for('dashboard'))
-
-    # Record the vote safely and update candidate tally
-    new_vote = Vote(voter_id=user.id, candidate_id=candidate.id)
-    try:
-        db.session.add(new_vote)
-        # ensure votes is integer
-        candidate.votes = (candidate.votes or 0) + 1
-        user.has_voted = True
-        db.session.commit()
-        flash(f"Your vote for {candidate.name} has been recorded!", "success")
-    except SQLAlchemyError:
-        db.session.rollback()
-        current_app.logger.exception("Failed to record vote")
-        flash("An error occurred while recording your vote. Please try again.", "danger")
+        return redirect(url_for('voter.dashboard'))
 
-    return redirect(url_for('dashboard'))
+    outcome = ballot_box.cast(user.id, [candidate.id])
+    after_cast(outcome)
+    flash_outcome(outcome, f"Your vote for {candidate.name} has been recorded!")
+    return redirect(url_for('voter.dashboard'))
+
+
+@voter_bp.route('/receipt')
+def receipt():
+    """Inclusion proofs for the current voter's votes against the ledger's Merkle root."""
+    user = _current_voter()
+    if not user:
+        return jsonify({'error': 'Not logged in.'}), 401
+    vote_ids = [vid for (vid,) in Vote.query.with_entities(Vote.id).filter(Vote.voter_id == user.id)]
+    proofs = [proof for proof in (ledger.prove(vid) for vid in vote_ids) if proof]
+    return jsonify({'receipts': proofs})